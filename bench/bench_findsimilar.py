@@ -0,0 +1,240 @@
+#! /usr/bin/env python
+
+# ImageCmp - find similar images among many
+# Copyright (C) 2009,2017 Israel G. Lugo
+#
+# This file is part of ImageCmp.
+#
+# ImageCmp is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# ImageCmp is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with ImageCmp. If not, see <http://www.gnu.org/licenses/>.
+#
+# For suggestions, feedback or bug reports: israel.lugo@lugosys.com
+
+
+"""Benchmark the speed and quality of finding similar images.
+
+Generates a synthetic corpus of base images and their variants (see
+corpus.py), for a growing number of images, and runs the comparison
+cascade of findsimilar on it; --engine replaces the engine of its first
+stage, to compare the alternatives. For each size, reports the time
+spent and the throughput of each part of the work, and the pairwise
+precision and recall against the known ground truth.
+
+By default the fingerprints are synthesized directly, which scales to
+millions of images. With --files, real image files are written to a
+temporary directory and decoded, which also measures decoding.
+
+The parts are measured by the timers of the instrument module. Time
+spent in worker processes is not broken down; use the default serial
+executor for a complete breakdown.
+
+Usage: bench_findsimilar.py [options]   (see --help)
+
+"""
+
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# run from a source checkout, without installing the package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from imagecmp import compare
+from imagecmp import executor
+from imagecmp import imagedescr
+from imagecmp import instrument
+from imagecmp import matrix
+
+import corpus
+
+
+PARTS = ('decode', 'quadrants', 'grouping', 'voting', 'subsets', 'other')
+"""The parts of the work that time is reported for."""
+
+PART_TIMERS = {
+    'decode': ('decode',),
+    'quadrants': ('pyramid', 'quadrants'),
+    'grouping': ('group_by',),
+    'voting': ('count_quadrant', 'merge_votes', 'grid', 'phash'),
+    'subsets': ('without_subsets',),
+}
+"""The instrument timers making up each part, other than 'other'."""
+
+
+def part_seconds(report, total):
+    """Add up the self seconds of the timers of each part, from a report."""
+    timers = report['timers']
+
+    seconds = {
+        part: sum(timers[name]['self_seconds'] for name in names if name in timers)
+        for part, names in PART_TIMERS.items()
+    }
+    seconds['other'] = max(0.0, total - sum(seconds.values()))
+
+    return seconds
+
+
+def make_cascade(engine):
+    """The default cascade of findsimilar, with the given first engine."""
+    return [compare.Stage(4, 4, engine=engine)] + list(compare.DEFAULT_CASCADE[1:])
+
+
+def run_once(nbases, args, pool):
+    """Generate a corpus and compare it. Returns a dict of results."""
+    recorder = instrument.Recorder()
+    directory = None
+
+    try:
+        if args.files:
+            directory = tempfile.mkdtemp(prefix="imagecmp-bench-")
+            filenames, labels = corpus.write_corpus(directory, nbases, seed=args.seed)
+        else:
+            fingerprints, labels = corpus.synthesize_fingerprints(nbases, seed=args.seed,
+                                                                  mode=args.mode)
+
+        with instrument.listening(recorder):
+            start = time.time()
+
+            if args.files:
+                fpmatrix = matrix.FingerprintMatrix.from_files(filenames, pool, mode=args.mode)
+            else:
+                fpmatrix = matrix.FingerprintMatrix(
+                        fingerprints, [str(k) for k in range(len(fingerprints))])
+
+            try:
+                groups, stats = compare.run_cascade(
+                        fpmatrix, make_cascade(args.engine), args.tolerance, pool, args.clusters)
+            finally:
+                fpmatrix.close()
+
+            total = time.time() - start
+    finally:
+        if directory is not None:
+            shutil.rmtree(directory)
+
+    report = recorder.report()
+    precision, recall = corpus.precision_recall(groups, labels)
+
+    return {
+        'images': len(labels),
+        'total': total,
+        'parts': part_seconds(report, total),
+        'report': report,
+        'stages': stats,
+        'precision': precision,
+        'recall': recall,
+    }
+
+
+def print_result(result):
+    """Print the results of a run."""
+    images = result['images']
+
+    print("%d images: %.3f s total, %.0f images/s, precision %.4f, recall %.4f"
+          % (images, result['total'], images / max(result['total'], 1e-9),
+             result['precision'], result['recall']))
+
+    print("  %-12s %10s %14s" % ("part", "seconds", "images/s"))
+    for part in PARTS:
+        seconds = result['parts'][part]
+        rate = "%14.0f" % (images / seconds) if seconds > 0 else "%14s" % "-"
+        print("  %-12s %10.4f %s" % (part, seconds, rate))
+
+    print("  %-12s %10s %10s %14s %10s" % ("stage", "images in", "groups out",
+                                          "pairs tried", "seconds"))
+    for stats in result['stages']:
+        stage = stats.stage
+        print("  %-12s %10d %10d %14d %10.4f"
+              % ("%dx%d %s" % (stage.n_x, stage.n_y, stage.engine), stats.images_in,
+                 stats.groups_out, stats.pairs_evaluated, stats.seconds))
+
+    print()
+
+
+def json_result(result):
+    """Convert the results of a run to JSON-serializable values."""
+    result = dict(result)
+    result['stages'] = [{
+            'stage': repr(stats.stage),
+            'images_in': stats.images_in,
+            'groups_out': stats.groups_out,
+            'pairs_evaluated': stats.pairs_evaluated,
+            'seconds': stats.seconds,
+        } for stats in result['stages']]
+
+    return result
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-n", "--max-images", type=int, default=10000,
+                        help="largest corpus, in images (default: %(default)s);"
+                             " sizes grow tenfold from 1000")
+    parser.add_argument("-e", "--engine", choices=compare.ENGINES,
+                        default=compare.DEFAULT_CASCADE[0].engine,
+                        help="engine of the first stage (default: %(default)s,"
+                             " as in findsimilar)")
+    parser.add_argument("-m", "--mode", choices=imagedescr.FINGERPRINT_MODES,
+                        default='rgb',
+                        help="fingerprint mode (default: %(default)s)")
+    parser.add_argument("-t", "--tolerance", type=int, default=20,
+                        help="comparison tolerance (default: %(default)s)")
+    parser.add_argument("-w", "--workers", type=int, default=0,
+                        help="worker processes; 0 runs serially (default)")
+    parser.add_argument("-f", "--files", action="store_true",
+                        help="write and decode real image files")
+    parser.add_argument("-c", "--clusters", action="store_true",
+                        help="find non-overlapping clusters")
+    parser.add_argument("-j", "--json", metavar="FILE",
+                        help="also write the results, with the full instrument"
+                             " report of each size, as JSON to FILE")
+    parser.add_argument("-s", "--seed", type=int, default=0,
+                        help="random seed of the corpus (default: %(default)s)")
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    images_per_base = len(corpus.VARIANTS) + 1
+
+    if args.workers > 0:
+        pool = executor.ProcessExecutor(args.workers)
+    else:
+        pool = executor.SerialExecutor()
+
+    results = []
+
+    with pool:
+        nimages = 1000
+        while nimages <= args.max_images:
+            result = run_once(max(1, nimages // images_per_base), args, pool)
+            print_result(result)
+            results.append(result)
+            nimages *= 10
+
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump([json_result(result) for result in results], f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+#! /usr/bin/env python
+
+# ImageCmp - find similar images among many
+# Copyright (C) 2009,2017 Israel G. Lugo
+#
+# This file is part of ImageCmp.
+#
+# ImageCmp is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# ImageCmp is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with ImageCmp. If not, see <http://www.gnu.org/licenses/>.
+#
+# For suggestions, feedback or bug reports: israel.lugo@lugosys.com
+
+
+"""Benchmark setops.without_subsets against the quadratic algorithm.
+
+Generates candidate groups shaped like the output of
+compare.get_similar_candidates: for each image with similar images, a
+group with the image and its neighbours, so that groups overlap heavily
+and many are contained in others.
+
+Usage: bench_without_subsets.py [MAX_GROUPS]
+
+"""
+
+
+from __future__ import print_function
+
+import itertools
+import os
+import random
+import sys
+import timeit
+
+# run from a source checkout, without installing the package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from imagecmp import setops
+
+
+QUADRATIC_MAX_GROUPS = 16000
+"""Largest input size to run the quadratic algorithm on."""
+
+
+def quadratic_without_subsets(seq):
+    """The original without_subsets, checking every pair of sets."""
+    sorted_by_len = sorted(seq, key=len)
+
+    return {x for i, x in enumerate(sorted_by_len)
+            if not setops.has_supersets(x, itertools.islice(sorted_by_len, i+1, None))}
+
+
+def make_groups(ngroups, seed=0):
+    """Return ngroups overlapping candidate groups of image numbers."""
+    rng = random.Random(seed)
+
+    groups = []
+    for im in range(ngroups):
+        # neighbours are images with nearby numbers, as in a burst of
+        # similar photos
+        size = rng.randint(1, 8)
+        neighbours = rng.sample(range(im - 10, im + 10), size)
+        groups.append(frozenset([im] + neighbours))
+
+    return groups
+
+
+def best_time(func, arg, repeat=3):
+    """Return the best time of a few calls to func(arg), in seconds."""
+    return min(timeit.repeat(lambda: func(arg), repeat=repeat, number=1))
+
+
+def main():
+    max_groups = int(sys.argv[1]) if len(sys.argv) > 1 else 256000
+
+    print("%10s %14s %14s" % ("groups", "inverted (s)", "quadratic (s)"))
+
+    ngroups = 1000
+    while ngroups <= max_groups:
+        groups = make_groups(ngroups)
+
+        inverted = best_time(setops.without_subsets, groups)
+
+        if ngroups <= QUADRATIC_MAX_GROUPS:
+            quadratic = "%14.4f" % best_time(quadratic_without_subsets, groups, 1)
+            assert setops.without_subsets(groups) == quadratic_without_subsets(groups)
+        else:
+            quadratic = "%14s" % "-"
+
+        print("%10d %14.4f %s" % (ngroups, inverted, quadratic))
+
+        ngroups *= 2
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,254 @@
+# ImageCmp - find similar images among many
+# Copyright (C) 2009,2017 Israel G. Lugo
+#
+# This file is part of ImageCmp.
+#
+# ImageCmp is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# ImageCmp is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with ImageCmp. If not, see <http://www.gnu.org/licenses/>.
+#
+# For suggestions, feedback or bug reports: israel.lugo@lugosys.com
+
+
+"""Reproducible synthetic corpora of near-duplicate images.
+
+A corpus has a number of base images, each followed by variants of it:
+resized, recompressed, cropped, brightness-shifted and with added noise.
+Images with the same base are the ground truth of similar images.
+
+Corpora can be written as image files, which exercises decoding, or
+synthesized directly as fingerprints, which scales to millions of images.
+
+"""
+
+
+import io
+import os
+
+import numpy as np
+from PIL import Image, ImageEnhance
+
+from imagecmp import imagedescr
+
+
+VARIANTS = ('resized', 'recompressed', 'cropped', 'brightness', 'noise')
+"""The kinds of variant of each base image, in order."""
+
+BASE_SIZE = (320, 240)
+"""Size of the base image files, in pixels."""
+
+_GRID_SIZE = (4, 3)
+"""Size of the random grid that base images are smoothly upscaled from."""
+
+_CHROMA = 40
+"""Maximum difference between the channels and the luma of a grid cell."""
+
+
+def _random_grid(shape, rng):
+    """Return a random grid of colours, of the given (..., 3) shape.
+
+    Each cell has a random luma, with smaller random chroma around it.
+    Uncorrelated channels would average out to grey in the quadrants,
+    making unrelated images look alike, which photographs don't.
+
+    """
+    luma = rng.randint(0, 256, size=shape[:-1] + (1,))
+    chroma = rng.randint(-_CHROMA, _CHROMA + 1, size=shape)
+
+    return np.clip(luma + chroma, 0, 255)
+
+
+def base_pixels(rng):
+    """Return the pixels of a random base image, as a PIL image.
+
+    Base images are random colour grids, smoothly upscaled, so that they
+    look like blurry photographs rather than noise.
+
+    """
+    grid = _random_grid((_GRID_SIZE[1], _GRID_SIZE[0], 3), rng).astype(np.uint8)
+
+    return Image.fromarray(grid).resize(BASE_SIZE, Image.BICUBIC)
+
+
+def make_variant(im, kind, rng):
+    """Return a variant of a PIL image, of the given kind (see VARIANTS)."""
+    width, height = im.size
+
+    if kind == 'resized':
+        return im.resize((width // 2, height // 2), Image.BILINEAR)
+
+    if kind == 'recompressed':
+        data = io.BytesIO()
+        im.save(data, 'JPEG', quality=20)
+        data.seek(0)
+        return Image.open(data).convert('RGB')
+
+    if kind == 'cropped':
+        dx, dy = width // 20, height // 20
+        return im.crop((dx, dy, width - dx, height - dy))
+
+    if kind == 'brightness':
+        return ImageEnhance.Brightness(im).enhance(1.1)
+
+    if kind == 'noise':
+        pixels = np.asarray(im, np.int16) + rng.randint(-12, 13, size=(height, width, 3))
+        return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+    raise ValueError("unknown variant %r" % (kind,))
+
+
+def write_corpus(directory, nbases, variants=VARIANTS, seed=0):
+    """Write a corpus of image files to a directory.
+
+    Writes nbases base images, each followed by one file per kind of
+    variant. Returns the tuple (filenames, labels), where labels[k] is the
+    number of the base image of filenames[k].
+
+    """
+    rng = np.random.RandomState(seed)
+
+    filenames = []
+    labels = []
+    for base in range(nbases):
+        im = base_pixels(rng)
+
+        images = [('base', im)] + [(kind, make_variant(im, kind, rng)) for kind in variants]
+        for kind, variant in images:
+            filename = os.path.join(directory, "%07d_%s.jpg" % (base, kind))
+            variant.save(filename, quality=90)
+            filenames.append(filename)
+            labels.append(base)
+
+    return filenames, np.array(labels)
+
+
+def synthesize_fingerprints(nbases, variants=VARIANTS, seed=0, chunk_bases=4096,
+                            mode='rgb'):
+    """Synthesize the fingerprints of a corpus, without any image files.
+
+    Base fingerprints are smooth random thumbnails; variants are made by
+    applying the same kinds of changes directly to the thumbnails, with
+    NumPy. This approximates write_corpus, at a tiny fraction of the cost.
+    'luma' fingerprints are converted from the RGB thumbnails, as PIL does.
+
+    Returns the tuple (fingerprints, labels), where fingerprints is an
+    (N, fingerprint_len(mode)) uint8 array, and labels[k] is the number
+    of the base image of fingerprints[k].
+
+    """
+    rng = np.random.RandomState(seed)
+    nimages = nbases * (len(variants) + 1)
+
+    fingerprints = np.empty((nimages, imagedescr.fingerprint_len(mode)), np.uint8)
+    labels = np.repeat(np.arange(nbases), len(variants) + 1)
+
+    for start in range(0, nbases, chunk_bases):
+        count = min(chunk_bases, nbases - start)
+        base = _smooth_thumbnails(count, rng)
+        thumbs = [base.astype(np.uint8).reshape(count, -1)]
+        thumbs.extend(_thumbnail_variant(base, kind, rng) for kind in variants)
+
+        # interleave, so that each base is followed by its variants
+        chunk = np.dstack(thumbs).transpose(0, 2, 1).reshape(count * len(thumbs), -1)
+        if mode == 'luma':
+            chunk = _to_luma(chunk)
+        first = start * len(thumbs)
+        fingerprints[first:first + len(chunk)] = chunk
+
+    return fingerprints, labels
+
+
+_LUMA_WEIGHTS = np.array([299, 587, 114])
+"""ITU-R 601-2 weights, in thousandths, of PIL's conversion to luma."""
+
+
+def _to_luma(fingerprints):
+    """Convert (N, FINGERPRINT_LEN) RGB fingerprints to luma ones."""
+    rgb = fingerprints.reshape(len(fingerprints), -1, 3).astype(np.int32)
+
+    return ((rgb.dot(_LUMA_WEIGHTS) + 500) // 1000).astype(np.uint8)
+
+
+def _smooth_thumbnails(count, rng):
+    """Return count smooth random (16, 16, 3) thumbnails, as int16."""
+    size_x, size_y = imagedescr.FINGERPRINT_SIZE
+    grid = _random_grid((count, _GRID_SIZE[1] + 1, _GRID_SIZE[0] + 1, 3), rng)
+
+    # bilinear interpolation of the grid
+    ys = np.linspace(0, _GRID_SIZE[1], size_y)
+    xs = np.linspace(0, _GRID_SIZE[0], size_x)
+    y0 = np.minimum(ys.astype(int), _GRID_SIZE[1] - 1)
+    x0 = np.minimum(xs.astype(int), _GRID_SIZE[0] - 1)
+    fy = (ys - y0)[:, None, None]
+    fx = (xs - x0)[None, :, None]
+
+    top = grid[:, y0][:, :, x0] * (1 - fx) + grid[:, y0][:, :, x0 + 1] * fx
+    bottom = grid[:, y0 + 1][:, :, x0] * (1 - fx) + grid[:, y0 + 1][:, :, x0 + 1] * fx
+
+    return (top * (1 - fy) + bottom * fy).astype(np.int16)
+
+
+def _thumbnail_variant(thumbs, kind, rng):
+    """Apply a kind of variant to (N, 16, 16, 3) thumbnails."""
+    if kind == 'resized':
+        # lose some detail: average each pixel with its right neighbour
+        result = (thumbs + np.roll(thumbs, -1, axis=2)) // 2
+    elif kind == 'recompressed':
+        result = thumbs // 16 * 16 + 8
+    elif kind == 'cropped':
+        # a slight zoom: drop the outer ring, and stretch the rest back
+        positions = np.linspace(1, thumbs.shape[1] - 2, thumbs.shape[1]).round().astype(int)
+        result = thumbs[:, positions][:, :, positions]
+    elif kind == 'brightness':
+        result = thumbs * 11 // 10
+    elif kind == 'noise':
+        result = thumbs + rng.randint(-12, 13, size=thumbs.shape)
+    else:
+        raise ValueError("unknown variant %r" % (kind,))
+
+    return np.clip(result, 0, 255).astype(np.uint8).reshape(len(thumbs), -1)
+
+
+def true_pairs(labels):
+    """Return the set of (a, b) pairs of images with the same base, a < b."""
+    order = np.argsort(labels, kind='mergesort')
+    sorted_labels = labels[order]
+    boundaries = np.flatnonzero(sorted_labels[1:] != sorted_labels[:-1]) + 1
+
+    pairs = set()
+    for group in np.split(order, boundaries):
+        group = sorted(group.tolist())
+        pairs.update((a, b) for i, a in enumerate(group) for b in group[i+1:])
+
+    return pairs
+
+
+def found_pairs(groups):
+    """Return the set of (a, b) pairs of images in the same group, a < b."""
+    pairs = set()
+    for group in groups:
+        group = sorted(group)
+        pairs.update((a, b) for i, a in enumerate(group) for b in group[i+1:])
+
+    return pairs
+
+
+def precision_recall(groups, labels):
+    """Return the pairwise (precision, recall) of groups of row indices."""
+    expected = true_pairs(labels)
+    found = found_pairs(groups)
+
+    correct = len(found & expected)
+    precision = float(correct) / len(found) if found else 1.0
+    recall = float(correct) / len(expected) if expected else 1.0
+
+    return precision, recall
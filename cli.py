@@ -8,8 +8,9 @@ import sys
 import os
 import optparse
 
-import compare
-import walk
+from imagecmp import compare
+from imagecmp import instrument
+from imagecmp import scan
 
 
 PROGRAM_VERSION = '0.1'
@@ -19,6 +20,9 @@ PROGRAM_VERSION = '0.1'
 # choices is important (it's used for -P, -L and in the help strings).
 _SYMLINK_CHOICES = ('never', 'always', 'directory', 'file')
 
+# Default tolerance for the --tolerance command-line option.
+_DEFAULT_TOLERANCE = 20
+
 
 
 def parse_args():
@@ -56,6 +60,28 @@ def parse_args():
                       "directory), '%s' (only when pointing to a file)"
                         % _SYMLINK_CHOICES)
 
+    parser.add_option('-t', '--tolerance', action='store', type='int',
+                      metavar='N', dest='tolerance',
+                      default=_DEFAULT_TOLERANCE,
+                      help='maximum difference in average color for two '
+                      'image regions to be considered similar, between 0 '
+                      'and 255 (default %d)' % _DEFAULT_TOLERANCE)
+
+    parser.add_option('--all-files', action='store_true',
+                      dest='all_files', default=False,
+                      help='when recursing, consider every file, not only '
+                      'those with an image extension')
+
+    parser.add_option('--luma', action='store_const', const='luma',
+                      dest='mode', default='rgb',
+                      help='compare brightness only, ignoring color (faster, '
+                      'and uses less memory)')
+
+    parser.add_option('--report', action='store', metavar='FILE',
+                      dest='report', default=None,
+                      help='write a JSON report of the time spent in each '
+                      'part of the comparison, and other statistics, to FILE')
+
     (cmdline_opts, cmdline_args) = parser.parse_args()
 
     # make sure we're given the base image for comparison
@@ -69,11 +95,62 @@ def parse_args():
                      "Try `%s --help' for more information." % prog_name)
 
 
+    if not 0 <= cmdline_opts.tolerance <= 255:
+        parser.error("tolerance must be between 0 and 255\n"
+                     "Try `%s --help' for more information." % prog_name)
+
+
     return cmdline_opts, cmdline_args[0], cmdline_args[1:]
 
 
 
+def expand_paths(paths, recursive, follow_symlinks, all_files=False):
+    """Generate the image file names to compare.
+
+    Receives the paths given on the command line, whether to recurse into
+    directories, and one of _SYMLINK_CHOICES. Directories are skipped
+    with a warning, unless recursive is true. Files found in directories
+    are skipped unless they have an image extension, or all_files is true.
+
+    """
+    follow_dirs = follow_symlinks in (_SYMLINK_CHOICES[1], _SYMLINK_CHOICES[2])
+    follow_files = follow_symlinks in (_SYMLINK_CHOICES[1], _SYMLINK_CHOICES[3])
+
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+
+        if not recursive:
+            sys.stderr.write("omitting directory '%s'\n" % path)
+            continue
+
+        extensions = None if all_files else scan.IMAGE_EXTENSIONS
+
+        # the scan comes in no particular order
+        for filename in sorted(scan.scan_files([path], follow_dirs, follow_files,
+                                               extensions=extensions)):
+            yield filename
+
+
+
 if __name__ == '__main__':
     options, base_image, compare_list = parse_args() 
 
-    # TODO: Finish implementing.
+    filenames = list(expand_paths(compare_list, options.recursive,
+                                  options.follow_symlinks, options.all_files))
+
+    listeners = [instrument.Recorder()] if options.report is not None else []
+
+    with instrument.listening(*listeners) as recorder:
+        similar = compare.findsimilar_to(base_image, filenames, options.tolerance,
+                                         mode=options.mode)
+
+    if recorder is not None:
+        with open(options.report, 'w') as f:
+            f.write(recorder.to_json(indent=2))
+
+    for filename in similar:
+        print(filename)
+
+    sys.exit(0 if similar else 1)
@@ -24,18 +24,60 @@
 """This module implements the ImageCmp public API."""
 
 
-import multiprocessing
 import itertools
 import functools
-import operator
+import os
+import time
 
+import numpy as np
+
+from imagecmp import dedup
+from imagecmp import executor
+from imagecmp import fpcache
+from imagecmp import gridindex
 from imagecmp import imagedescr
+from imagecmp import instrument
+from imagecmp import matrix
+from imagecmp import phash
 from imagecmp import setops
+from imagecmp import sharedarray
 
 
 SIMILAR_QUADS_RATIO = 0.6
 """Ratio of quadrants that must match for two images to be similar."""
 
+STREAM_BATCH_SIZE = 1024
+"""Smallest number of files fingerprinted per batch by iter_similar."""
+
+ENGINES = ('groups', 'grid', 'phash')
+"""Engines for finding the candidates in get_similar_candidates.
+
+'groups' sorts each quadrant separately, and counts a vote for every pair
+of images within tolerance in that quadrant. 'grid' finds the
+pairs of images whose quadrant vectors are within tolerance directly,
+with the grid-hash spatial index in gridindex. 'phash' ignores the
+quadrants and the tolerance, and pairs the images whose 64-bit average
+hashes are within phash.MAX_DISTANCE bits of each other.
+
+"""
+
+BATCH_VOTES = 1 << 22
+"""Approximate number of votes counted at a time when refining many groups.
+
+A group of k images has k*(k-1)/2 pairs, each voted on in every quadrant,
+so large or heavily overlapping groups are refined a few at a time, and
+each batch is reduced to its similar pairs before the next is counted.
+
+"""
+
+SHARED_TRANSPORT_MIN_IMAGES = 1024
+"""Minimum number of images for sending quadrants through shared memory.
+
+Below this, pickling the data to the worker processes is cheaper than
+setting up a SharedArray.
+
+"""
+
 
 def create_worker_pool(worker_count=None):
     """Create a pool of worker processes.
@@ -44,185 +86,1224 @@ def create_worker_pool(worker_count=None):
     worker_count is None, the function will create as many processes as
     there are CPUs.
 
+    Returns an executor.ProcessExecutor.
+
     """
-    return multiprocessing.Pool(processes=worker_count)
+    return executor.ProcessExecutor(worker_count)
+
 
+def count_quadrant(groups, nimages):
+    """Count images similar to each other, within a quadrant.
 
-def get_grouped_quadrants(img_descriptors, tolerance, nquads_x, nquads_y, pool):
-    """Calculate quadrants for the images, and group them by similarity.
+    Receives a list of groups of image positions, and the total number of
+    images. Every pair of images sharing at least one group gets a single
+    vote: a quadrant votes for a pair at most once, however many of its
+    groups overlap. Returns the tuple (pair_ids, votes), as described in
+    sum_votes.
 
-    Receives a list of ImageDescr, a tolerance value between 0 and 255, the
-    number of subdivisions along the x axis, the number of subdivisions
-    along the y axis, and a multiprocessing.Pool object to parallelize the
-    work. The tolerance value specifies the difference in average value for
-    two quadrants to be considered similar.
+    For example, with positions a < b < c < d:
 
-    Returns a list of grouped quadrants, of length nquads_x * nquads_y.
-    Each grouped quadrant is a (possibly overlapping) list of sets of
-    similar QuadrantAverages within that quadrant:
-        [{a, b, c}, {f, g, c}, ...]
+        groups = [[a, b, c], [a, b, d]]
+        count_quadrant(groups, n)
+            = ([a*n+b, a*n+c, a*n+d, b*n+c, b*n+d], [1, 1, 1, 1, 1])
 
     """
-    # specific calc_quadrants for our nquads_x and nquads_y; needs Python
-    # >= 2.7, since in earlier versions partial functions weren't picklable
-    # (and pool.map needs a global or picklable function)
-    calc_quadrants_xy = functools.partial(imagedescr.calc_quadrants,
-                                          n_x=nquads_x, n_y=nquads_y)
+    sizes = np.array([len(group) for group in groups], np.int64)
+    members = np.fromiter(itertools.chain.from_iterable(groups), np.int64,
+                          int(sizes.sum()))
 
-    all_image_quads = pool.map(calc_quadrants_xy, img_descriptors)
+    instrument.histogram('group_by.sizes', sizes)
 
-    # XXX: These pool operations imply memory copies. The data is pickled
-    # and sent to the worker processes. The return values will contain
-    # copies of the original objects, which wastes memory. We may want to
-    # add a unification pass to eliminate duplicate objects: iterate the
-    # quadrants, storing each object in a set, and replacing it with the
-    # instance from the set.
+    with instrument.timed('count_quadrant'):
+        first, second = setops.pairs_within_groups(sizes)
+        pair_ids = _pair_ids(members[first], members[second], nimages)
 
-    quads_per_image = nquads_x * nquads_y
-    grouped_quads = [
-            setops.group_by(all_image_quads, tolerance, key=lambda q: q.quadrants[n])
-            for n in range(quads_per_image)
-    ]
+        return _single_votes(np.sort(pair_ids))
 
-    return grouped_quads
 
+def count_column(column, tolerance):
+    """Count the images similar to each other, within a single quadrant.
+
+    Receives an array with the quadrant's average for each image, and a
+    tolerance value between 0 and 255. Every pair of images whose
+    averages are within tolerance of each other gets a single vote, so no
+    pair gets more votes than there are quadrants. Returns the tuple
+    (pair_ids, votes), as described in sum_votes.
+
+    Groups of images within tolerance of a common value hold images up
+    to twice the tolerance apart, and overlap; the pairs are found
+    directly instead.
+
+    """
+    with instrument.timed('group_by'):
+        order, hi = setops.within_tolerance_array(column, tolerance)
+
+    return _count_within(order, hi, len(column))
+
+
+def count_segmented_column(column, segments, tolerance):
+    """Count a single quadrant, within many groups of images.
+
+    Receives an array with the quadrant's average for each entry, the
+    group number of each entry, and a tolerance value between 0 and 255.
+    Only entries of the same group are compared. Equivalent to count_column
+    within each group on its own, but with pair IDs encoding positions
+    into column.
+
+    """
+    with instrument.timed('group_by'):
+        order, hi = setops.within_tolerance_array(column, tolerance, segments)
+
+    return _count_within(order, hi, len(column))
+
+
+def _count_within(order, hi, nimages):
+    """Count the votes of the pairs found by setops.within_tolerance_array.
+
+    Receives its tuple (order, hi), and the total number of images.
+    Returns the tuple (pair_ids, votes), as described in sum_votes.
+
+    """
+    positions = np.arange(len(order))
+    later = hi - positions - 1
+
+    instrument.histogram('group_by.sizes', later[later > 0] + 1)
+
+    with instrument.timed('count_quadrant'):
+        first = np.repeat(positions, later)
+        second = setops.expand_ranges(positions + 1, later)
+        pair_ids = np.sort(_pair_ids(order[first], order[second], nimages))
+
+        return pair_ids, np.ones(len(pair_ids), np.int64)
+
+
+def _pair_ids(a, b, nimages):
+    """Encode the pairs (a[k], b[k]) of positions, as described in sum_votes."""
+    a = np.asarray(a, np.int64)
+    b = np.asarray(b, np.int64)
+
+    return np.minimum(a, b) * nimages + np.maximum(a, b)
+
+
+def _single_votes(pair_ids):
+    """Give a single vote to each of a sorted array of pair IDs.
+
+    Returns the tuple (pair_ids, votes), without repeated pair IDs.
+
+    """
+    if len(pair_ids):
+        pair_ids = pair_ids[np.concatenate(([True], pair_ids[1:] != pair_ids[:-1]))]
+
+    return pair_ids, np.ones(len(pair_ids), np.int64)
 
-def count_quadrant(image_groups):
-    """Count images similar to each other, within a quadrant.
 
-    Receives a list of QuadrantAverages groups. Returns a dictionary
-    mapping ImageDescr to ImageDescr counts, e.g.:
+def sum_votes(pair_ids, votes):
+    """Add together the votes for equal pairs.
 
-        groups = [{a, b, c}, {a, d}]
-        count_quadrant(groups)
-            = {a:{b:1, c:1, d:1}, b:{a:1, c:1}, c:{a:1, b:1}, d:{a:1}}
+    Receives an array of encoded pair IDs, where a pair of images at
+    positions a < b among n images is encoded as a*n + b, and an array of
+    votes for each pair ID. Returns the tuple (pair_ids, votes), where
+    pair_ids are sorted and unique.
 
     """
-    image_counts = {}
-    for group in image_groups:
-        for quadavg in group:
-            im = quadavg.imdesc
-            if im not in image_counts:
-                image_counts[im] = {}
+    if not len(pair_ids):
+        return pair_ids, votes
 
-            # add the counts from this group to the current image's counts
-            d = image_counts[im]
-            for other_quadavg in group:
-                other_im = other_quadavg.imdesc
-                if other_im != im:
-                    d[other_im] = d.get(other_im, 0) + 1
+    size = int(pair_ids.max()) + 1
+    if size <= _DENSE_VOTES * len(pair_ids):
+        # few distinct IDs for their range: add them up directly
+        present = np.flatnonzero(np.bincount(pair_ids, minlength=size))
+        totals = np.bincount(pair_ids, votes, minlength=size)
 
-    return image_counts
+        return present.astype(pair_ids.dtype), totals[present].astype(votes.dtype)
 
+    order = np.argsort(pair_ids)
+    pair_ids = pair_ids[order]
+    votes = votes[order]
 
-def get_similar_counts(quadrants, pool):
+    starts = np.flatnonzero(np.concatenate(([True], pair_ids[1:] != pair_ids[:-1])))
+
+    return pair_ids[starts], np.add.reduceat(votes, starts)
+
+
+_DENSE_VOTES = 4
+"""Largest ratio between the range of the pair IDs and their number, for
+sum_votes to add them up with bincount instead of sorting them."""
+
+
+def merge_votes(quadrant_votes):
+    """Add together the votes of several quadrants.
+
+    Receives an iterable of (pair_ids, votes), as returned by
+    count_quadrant. Returns a single (pair_ids, votes).
+
+    """
+    quadrant_votes = list(quadrant_votes)
+
+    with instrument.timed('merge_votes'):
+        pair_ids = np.concatenate([p for p, v in quadrant_votes] + [np.empty(0, np.int64)])
+        votes = np.concatenate([v for p, v in quadrant_votes] + [np.empty(0, np.int64)])
+
+        return sum_votes(pair_ids, votes)
+
+
+def get_similar_votes(all_image_quads, tolerance, pool, quad_sums=None):
     """Count the similar images within each quadrant.
 
-    Receives a multiprocessing.Pool and a list of quadrants. Quadrants are
-    lists of ImageDescr groups. Returns a dictionary mapping images to
-    image counts:
+    Receives an (N, nquads) array of quadrant averages, a tolerance value
+    between 0 and 255, and a multiprocessing.Pool or executor to
+    parallelize the work. Returns the total votes of every pair of
+    images, as the tuple (pair_ids, votes) described in sum_votes.
+
+    Small sets of images, or all of them if pool is None, are counted in
+    this process. For large sets, the quadrants are placed in a
+    SharedArray, one quadrant per contiguous row, so that each worker
+    process receives only the number of the quadrant to group and count,
+    and reads only that row. Executors that run in-process receive the
+    quadrants directly.
+
+    quad_sums, if provided and not None, is the tuple (sums, area), where
+    sums are the same quadrants as integer sums of area pixel values each
+    (see FingerprintMatrix.quadrant_sums). The sums are smaller, and are
+    shared instead of the averages.
+
+    """
+    nimages, nquads = all_image_quads.shape
+
+    if not _shares_memory(nimages, pool):
+        columns = np.ascontiguousarray(all_image_quads.T)
+        count = functools.partial(count_column, tolerance=tolerance)
+        quadrant_votes = _map_in_process(count, columns, pool, nimages)
+    else:
+        shared_columns, area = _shared_columns(all_image_quads, quad_sums)
+        with sharedarray.SharedArray.copy_of(shared_columns) as shared_quads:
+            tasks = [(shared_quads, area, n, tolerance) for n in range(nquads)]
+            quadrant_votes = executor.map_work(pool, _count_shared_quadrant, tasks, nimages)
+        _count_ipc(shared_columns, quadrant_votes)
+
+    return merge_votes(quadrant_votes)
+
+
+def _shares_memory(nimages, pool):
+    """Return True if the quadrants of nimages go to pool in a SharedArray."""
+    return (nimages >= SHARED_TRANSPORT_MIN_IMAGES and pool is not None
+            and not getattr(pool, 'in_process', False))
+
+
+def _map_in_process(func, items, pool, nimages):
+    """Map func over items in this process, with pool if it runs in-process.
+
+    nimages is the number of images the items cover (see executor.map_work).
+
+    """
+    if pool is not None and getattr(pool, 'in_process', False):
+        return executor.map_work(pool, func, items, nimages)
+
+    return [func(item) for item in items]
+
+
+def _shared_columns(all_image_quads, quad_sums):
+    """Get the quadrants to share with the worker processes.
+
+    Returns the tuple (columns, area), where columns is an (nquads, N)
+    contiguous array with a row per quadrant, of the sums if quad_sums is
+    not None, and area is the divisor that gives the averages back (1 for
+    the averages themselves).
+
+    """
+    if quad_sums is None:
+        return np.ascontiguousarray(all_image_quads.T), 1
+
+    sums, area = quad_sums
+
+    return np.ascontiguousarray(sums.T), area
+
+
+def _shared_column(shared_columns, area, n):
+    """Get the averages of quadrant n, from the rows of _shared_columns."""
+    column = shared_columns.array[n]
+
+    # the same division as imagedescr.quadrants_from_sums
+    return column / float(area) if area != 1 else column
+
+
+def _count_ipc(shared, quadrant_votes, *more_shared):
+    """Count the bytes exchanged with the worker processes for the votes.
+
+    Receives the arrays copied to shared memory, and the votes returned
+    by the workers, which were pickled.
+
+    """
+    if instrument.enabled():
+        instrument.count('ipc.shared_bytes', sum(a.nbytes for a in (shared,) + more_shared))
+        instrument.count('ipc.result_bytes',
+                         sum(p.nbytes + v.nbytes for p, v in quadrant_votes))
+
 
-        quads = [[{a, b, c}, {a, d}], [{a, c}, {a, b}], [{a, b}], [{a, b}]]
-        get_similar_counts(quads, pool)
-            = {a:{b:4, c:2, d:1}, b:{a:4, c:1}, c:{a:2, b:1}, d:{a:1}}
+def _count_shared_quadrant(task):
+    """Group and count a single quadrant, from shared memory.
+
+    Receives the tuple (shared_columns, area, n, tolerance), and returns
+    count_column for quadrant n. Runs in the worker processes.
+
+    """
+    shared_columns, area, n, tolerance = task
+
+    return count_column(_shared_column(shared_columns, area, n), tolerance)
+
+
+def get_segmented_votes(all_image_quads, positions, segments, tolerance, pool, quad_sums=None):
+    """Count the similar images within each quadrant, within many groups.
+
+    Receives an (N, nquads) array of quadrant averages, and, for each
+    entry of every group, the position of its image in all_image_quads and
+    its group number. Images are only compared within the same group.
+    Returns the total votes of every pair of entries, as the tuple
+    (pair_ids, votes) described in sum_votes.
+
+    The work is divided among the pool like in get_similar_votes, and
+    quad_sums is as there.
+
+    """
+    nquads = all_image_quads.shape[1]
+
+    if not _shares_memory(len(positions), pool):
+        columns = np.ascontiguousarray(all_image_quads.T)
+        count = functools.partial(_count_segmented_quadrant, columns, positions,
+                                  segments, tolerance)
+        quadrant_votes = _map_in_process(count, range(nquads), pool, len(positions))
+    else:
+        shared_columns, area = _shared_columns(all_image_quads, quad_sums)
+        entries = np.vstack((positions, segments)).astype(np.int64)
+        with sharedarray.SharedArray.copy_of(shared_columns) as shared_quads, \
+                sharedarray.SharedArray.copy_of(entries) as shared_entries:
+            tasks = [(shared_quads, area, shared_entries, n, tolerance) for n in range(nquads)]
+            quadrant_votes = executor.map_work(pool, _count_shared_segmented_quadrant,
+                                               tasks, len(positions))
+        _count_ipc(shared_columns, quadrant_votes, entries)
+
+    return merge_votes(quadrant_votes)
+
+
+def _count_segmented_quadrant(columns, positions, segments, tolerance, n):
+    """Group and count quadrant n of every entry, within its group.
+
+    Receives the quadrants as an (nquads, N) array, with a row per
+    quadrant.
 
     """
-    # get a list of quadrant counts
-    quadrant_counts = pool.map(count_quadrant, quadrants)
+    return count_segmented_column(columns[n][positions], segments, tolerance)
+
+
+def _count_shared_segmented_quadrant(task):
+    """Group and count a single quadrant within many groups, from shared memory.
+
+    Receives the tuple (shared_columns, area, shared_entries, n, tolerance),
+    where shared_entries holds the positions and the group numbers of the
+    entries. Runs in the worker processes.
+
+    """
+    shared_columns, area, shared_entries, n, tolerance = task
+    positions, segments = shared_entries.array
+
+    column = _shared_column(shared_columns, area, n)
+
+    return count_segmented_column(column[positions], segments, tolerance)
 
-    # XXX: Pool operations imply memory copies. The data is pickled
-    # and sent to the worker processes. The return values will contain
-    # copies of the original objects, which wastes memory. We may want to
-    # add a unification pass to eliminate duplicate objects: iterate the
-    # quadrants, storing each object in a set, and replacing it with the
-    # instance from the set.
 
-    # add the quadrant counts together
-    similar_counts = {}
-    for quadrant_count in quadrant_counts:
-        for key_im in quadrant_count:
-            if key_im not in similar_counts:
-                similar_counts[key_im] = {}
+def candidates_from_votes(indices, pair_ids, votes, min_votes):
+    """Build the candidate groups from pair votes.
 
-            d = similar_counts[key_im]
-            counts = quadrant_count[key_im]
-            for im in counts:
-                d[im] = d.get(im, 0) + counts[im]
+    Receives the array of row indices of the images, and the pair votes
+    as described in sum_votes, with positions into indices. Pairs with at
+    least min_votes votes are similar.
 
-    return similar_counts
+    Returns a set with a frozenset for each image that has similar
+    images, holding the image and all the images similar to it.
+
+    """
+    return candidates_from_pairs(indices, pair_ids[votes >= min_votes])
+
+
+def candidates_from_pairs(indices, pair_ids):
+    """Build the candidate groups from similar pairs.
+
+    Receives the array of row indices of the images, and the encoded IDs
+    of the similar pairs, as described in sum_votes, with positions into
+    indices. Returns the candidate groups, like candidates_from_votes.
+
+    """
+    a, b = pair_ids // len(indices), pair_ids % len(indices)
+
+    # list each pair in both directions, and sort by source image
+    src = np.concatenate((a, b))
+    dst = np.concatenate((b, a))
+    order = np.argsort(src, kind='mergesort')
+    src = src[order]
+    dst = dst[order]
+
+    boundaries = np.flatnonzero(src[1:] != src[:-1]) + 1
+    sources = src[np.concatenate(([0], boundaries))] if len(src) else src
+
+    return {frozenset(indices[np.append(similar, im)].tolist())
+            for im, similar in zip(sources, np.split(dst, boundaries))}
+
+
+def get_similar_pairs(fpmatrix, indices, tolerance, nquads_x, nquads_y, pool, engine='groups',
+                      ratio=SIMILAR_QUADS_RATIO):
+    """Get the similar pairs within a group of images.
+
+    Receives the same arguments as get_similar_candidates. Returns the
+    tuple (indices, pair_ids), where indices is the sorted array of row
+    indices, and pair_ids are the encoded IDs of the similar pairs, as
+    described in sum_votes, with positions into indices.
+
+    """
+    indices, pair_ids, evaluated = _similar_pairs(
+            fpmatrix, indices, tolerance, nquads_x, nquads_y, pool, engine, ratio)
+
+    return indices, pair_ids
+
+
+def _similar_pairs(fpmatrix, indices, tolerance, nquads_x, nquads_y, pool, engine, ratio):
+    """Get the similar pairs within a group of images, and the pairs tried.
+
+    Like get_similar_pairs, but returns the tuple (indices, pair_ids,
+    evaluated), where evaluated is the number of pairs that were compared
+    (i.e. that got at least one vote).
+
+    """
+    if engine not in ENGINES:
+        raise ValueError("unknown engine %r" % (engine,))
 
+    indices = np.asarray(sorted(indices), dtype=np.intp)
 
-def get_similar_candidates(img_descriptors, tolerance, nquads_x, nquads_y, pool):
+    if engine == 'phash':
+        with instrument.timed('phash'):
+            hashes = phash.average_hash(fpmatrix.fingerprints[indices])
+            pair_ids, distances = phash.HashIndex(hashes).pairs()
+        return indices, pair_ids, len(pair_ids)
+
+    all_image_quads = fpmatrix.quadrants(indices, nquads_x, nquads_y)
+
+    min_similar_quads = int(nquads_x * nquads_y * ratio)
+
+    if engine == 'grid':
+        with instrument.timed('grid'):
+            pair_ids, votes = gridindex.similar_pairs(all_image_quads, tolerance, min_similar_quads)
+    else:
+        quad_sums = None
+        if _shares_memory(len(indices), pool):
+            quad_sums = fpmatrix.quadrant_sums(indices, nquads_x, nquads_y)
+        pair_ids, votes = get_similar_votes(all_image_quads, tolerance, pool, quad_sums)
+
+    return indices, pair_ids[votes >= min_similar_quads], len(pair_ids)
+
+
+def get_similar_pairs_batch(fpmatrix, groups, tolerance, nquads_x, nquads_y, pool,
+                            ratio=SIMILAR_QUADS_RATIO):
+    """Get the similar pairs within each of many groups of images, at once.
+
+    Receives a FingerprintMatrix, an iterable of (possibly overlapping)
+    groups of row indices, and the remaining arguments as in
+    get_similar_pairs, with the 'groups' engine. The groups are compared
+    in batches of about BATCH_VOTES votes; within a batch, the quadrants
+    of all the images are taken from the matrix at once, and every group
+    is compared in the same pass over each quadrant, so the cost is
+    proportional to the total membership of the groups rather than to
+    their number, while the memory stays bounded.
+
+    Returns the tuple (members, pair_ids), where members is a flat array
+    with the row indices of each group, one group after the other, and
+    pair_ids are the encoded IDs of the similar pairs, as described in
+    sum_votes, with positions into members. Both entries of a pair always
+    belong to the same group.
+
+    """
+    members, pair_ids, evaluated = _similar_pairs_batch(
+            fpmatrix, groups, tolerance, nquads_x, nquads_y, pool, ratio)
+
+    return members, pair_ids
+
+
+def _similar_pairs_batch(fpmatrix, groups, tolerance, nquads_x, nquads_y, pool, ratio):
+    """Like get_similar_pairs_batch, plus the count of pairs compared.
+
+    Returns the tuple (members, pair_ids, evaluated), as in _similar_pairs.
+    The groups are compared in batches of about BATCH_VOTES votes.
+
+    """
+    groups = [np.fromiter(group, np.intp) for group in groups]
+    sizes = np.array([len(group) for group in groups], np.int64)
+
+    members = np.concatenate(groups + [np.empty(0, np.intp)])
+    ends = np.cumsum(sizes)
+    nquads = nquads_x * nquads_y
+
+    found = [np.empty(0, np.int64)]
+    evaluated = 0
+    for chunk in setops.chunks_by_total(sizes * (sizes - 1) // 2 * nquads, BATCH_VOTES):
+        start = int(ends[chunk.start] - sizes[chunk.start])
+        stop = int(ends[chunk.stop - 1])
+
+        pair_ids, batch_evaluated = _similar_pairs_segments(
+                fpmatrix, members[start:stop], sizes[chunk], tolerance, nquads_x, nquads_y,
+                pool, ratio)
+
+        # from positions into the batch to positions into members
+        a, b = pair_ids // (stop - start), pair_ids % (stop - start)
+        found.append((a + start) * len(members) + (b + start))
+        evaluated += batch_evaluated
+
+    return members, np.concatenate(found), evaluated
+
+
+def _similar_pairs_segments(fpmatrix, members, sizes, tolerance, nquads_x, nquads_y, pool,
+                            ratio):
+    """Compare the groups laid out one after the other in members.
+
+    Receives a flat array with the row indices of each group, and the
+    sizes of the groups. Returns the tuple (pair_ids, evaluated), with
+    positions into members.
+
+    """
+    segments = np.repeat(np.arange(len(sizes)), sizes)
+
+    rows, positions = np.unique(members, return_inverse=True)
+    all_image_quads = fpmatrix.quadrants(rows, nquads_x, nquads_y)
+
+    min_similar_quads = int(nquads_x * nquads_y * ratio)
+
+    quad_sums = None
+    if _shares_memory(len(members), pool):
+        quad_sums = fpmatrix.quadrant_sums(rows, nquads_x, nquads_y)
+
+    pair_ids, votes = get_segmented_votes(all_image_quads, positions.ravel(), segments, tolerance,
+                                          pool, quad_sums)
+
+    return pair_ids[votes >= min_similar_quads], len(pair_ids)
+
+
+def get_similar_candidates(fpmatrix, indices, tolerance, nquads_x, nquads_y, pool, engine='groups',
+                           ratio=SIMILAR_QUADS_RATIO):
     """Get similar candidates within a group of images.
 
-    Receives an iterable of ImageDescr, a tolerance value within 0 and
-    255, the number of subdivisions along the x axis, the number of
-    subdivisions along the y axis, and a multiprocessing.Pool object to
-    parallelize the work.
+    Receives a FingerprintMatrix, an iterable of row indices, a tolerance
+    value within 0 and 255, the number of subdivisions along the x axis,
+    the number of subdivisions along the y axis, and a
+    multiprocessing.Pool or executor to parallelize the work. engine is
+    one of ENGINES. Two images are similar if at least the given ratio of
+    their quadrants are within tolerance.
+
+    Returns a set of candidate similar groups, in the form of frozensets
+    of row indices.
+
+    """
+    indices, pair_ids = get_similar_pairs(fpmatrix, indices, tolerance, nquads_x, nquads_y, pool, engine,
+                                          ratio)
+
+    return candidates_from_pairs(indices, pair_ids)
+
+
+def cluster_labels(nimages, indices, pair_ids):
+    """Merge similar pairs into non-overlapping clusters.
+
+    Receives the total number of images, and similar pairs as returned
+    by get_similar_pairs. Returns an array of nimages cluster labels,
+    numbered from 0. Images in no similar pair are labeled -1.
+
+    """
+    labels = np.full(nimages, -1, np.intp)
+
+    paired, numbered = _number_clusters(len(indices), pair_ids)
+    labels[indices[paired]] = numbered
+
+    return labels
+
+
+def _number_clusters(nimages, pair_ids):
+    """Number the clusters formed by similar pairs.
+
+    Receives the number of images and the encoded IDs of the similar
+    pairs. Returns the tuple (paired, numbered), where paired is a
+    boolean mask of the images in some pair, and numbered holds their
+    cluster numbers, from 0.
+
+    """
+    a, b = pair_ids // nimages, pair_ids % nimages
+
+    components = setops.connected_components(nimages, a, b)
+
+    paired = np.zeros(nimages, bool)
+    paired[a] = True
+    paired[b] = True
+    numbered = np.unique(components[paired], return_inverse=True)[1]
+
+    return paired, numbered.ravel()
+
 
-    Returns a set of candidate similar ImageDescr.
+def labels_to_clusters(labels):
+    """Get the clusters of a label array.
+
+    Returns a list with an array of row indices for each label, other
+    than -1.
 
     """
-    quadrants = get_grouped_quadrants(img_descriptors, tolerance, nquads_x, nquads_y, pool)
+    rows = np.flatnonzero(labels >= 0)
+    order = np.argsort(labels[rows], kind='mergesort')
+    rows = rows[order]
+    sorted_labels = labels[rows]
+
+    boundaries = np.flatnonzero(sorted_labels[1:] != sorted_labels[:-1]) + 1
+
+    return np.split(rows, boundaries) if len(rows) else []
 
-    similar_counts = get_similar_counts(quadrants, pool)
 
-    min_similar_quads = int(nquads_x * nquads_y * SIMILAR_QUADS_RATIO)
+def refine_clusters(fpmatrix, labels, tolerance, nquads_x, nquads_y, pool,
+                    ratio=SIMILAR_QUADS_RATIO):
+    """Refine clusters of similar images.
 
-    candidates = set()
-    for im in similar_counts:
-        im_counts = similar_counts[im]
-        similar_to_im = {
-                other_im
-                for other_im in im_counts
-                if im_counts[other_im] >= min_similar_quads
-            }
-        if similar_to_im:
-            similar_to_im.add(im)
-            candidates.add(frozenset(similar_to_im))
+    Receives a FingerprintMatrix and a cluster label array, as returned
+    by cluster_labels. Each cluster is compared once, as with
+    get_similar_pairs, and split into the clusters of its similar pairs.
+    All the clusters are compared in a single pass, with
+    get_similar_pairs_batch.
+
+    Returns a new label array.
+
+    """
+    refined, evaluated = _refine_clusters(fpmatrix, labels, tolerance, nquads_x, nquads_y, pool,
+                                          'groups', ratio)
 
-    return candidates
+    return refined
+
+
+def _refine_clusters(fpmatrix, labels, tolerance, nquads_x, nquads_y, pool, engine, ratio):
+    """Like refine_clusters, but returns the tuple (labels, evaluated).
+
+    Engines other than 'groups' compare one cluster at a time.
+
+    """
+    refined = np.full(len(labels), -1, np.intp)
 
+    if engine != 'groups':
+        next_label = 0
+        evaluated = 0
+        for cluster in labels_to_clusters(labels):
+            indices, pair_ids, cluster_evaluated = _similar_pairs(
+                    fpmatrix, cluster, tolerance, nquads_x, nquads_y, pool, engine, ratio)
+            paired, numbered = _number_clusters(len(indices), pair_ids)
+            refined[indices[paired]] = numbered + next_label
+            next_label += len(np.unique(numbered))
+            evaluated += cluster_evaluated
 
-def refine_candidates(candidates, tolerance, nquads_x, nquads_y, pool):
+        return refined, evaluated
+
+    members, pair_ids, evaluated = _similar_pairs_batch(
+            fpmatrix, labels_to_clusters(labels), tolerance, nquads_x, nquads_y, pool, ratio)
+
+    # clusters don't overlap, so each row is a single member
+    paired, numbered = _number_clusters(len(members), pair_ids)
+    refined[members[paired]] = numbered
+
+    return refined, evaluated
+
+
+def refine_candidates(fpmatrix, candidates, tolerance, nquads_x, nquads_y, pool, engine='groups',
+                      ratio=SIMILAR_QUADS_RATIO):
     """Refine candidate groups.
 
-    Receives an iterable of candidate sets (groups). For each candidate
-    set, the images are divided into the specified number of quadrants
-    vertically and horizontally, and compared by the specified tolerance.
+    Receives a FingerprintMatrix and an iterable of candidate sets
+    (groups) of row indices. For each candidate set, the images are
+    divided into the specified number of quadrants vertically and
+    horizontally, and compared by the specified tolerance. engine and
+    ratio are passed on to get_similar_candidates.
+
+    With the 'groups' engine, all the candidate sets are compared in a
+    single pass, with get_similar_pairs_batch.
 
-    Returns a refined set of candidate groups, in the form of frozensets.
+    Returns a refined set of candidate groups, in the form of frozensets
+    of row indices.
 
     """
+    refined_candidates, evaluated = _refine_candidates(
+            fpmatrix, candidates, tolerance, nquads_x, nquads_y, pool, engine, ratio)
+
+    return refined_candidates
+
+
+def _refine_candidates(fpmatrix, candidates, tolerance, nquads_x, nquads_y, pool, engine, ratio):
+    """Like refine_candidates, but returns the tuple (candidates, evaluated)."""
+    if engine == 'groups':
+        members, pair_ids, evaluated = _similar_pairs_batch(
+                fpmatrix, candidates, tolerance, nquads_x, nquads_y, pool, ratio)
+
+        candidates = candidates_from_pairs(members, pair_ids)
+        with instrument.timed('without_subsets'):
+            return setops.without_subsets(candidates), evaluated
+
     refined_candidates = set()
+    evaluated = 0
 
     for candidate_group in candidates:
-        refined_candidates.update(get_similar_candidates(candidate_group, tolerance, nquads_x, nquads_y, pool))
+        indices, pair_ids, group_evaluated = _similar_pairs(
+                fpmatrix, candidate_group, tolerance, nquads_x, nquads_y, pool, engine, ratio)
+        refined_candidates.update(candidates_from_pairs(indices, pair_ids))
+        evaluated += group_evaluated
+
+    with instrument.timed('without_subsets'):
+        return setops.without_subsets(refined_candidates), evaluated
+
+
+class Stage(object):
+    """A stage of a comparison cascade.
+
+    Each stage divides the images into n_x by n_y quadrants, and keeps
+    the images with at least the given ratio of quadrants within
+    tolerance of each other. A tolerance of None stands for the tolerance
+    of the whole run. engine is one of ENGINES.
+
+    This is a lightweight read-only data container class.
+
+    """
+    __slots__ = ('_n_x', '_n_y', '_tolerance', '_ratio', '_engine')
+
+    def __init__(self, n_x, n_y, tolerance=None, ratio=SIMILAR_QUADS_RATIO, engine='groups'):
+        if engine not in ENGINES:
+            raise ValueError("unknown engine %r" % (engine,))
+
+        self._n_x = n_x
+        self._n_y = n_y
+        self._tolerance = tolerance
+        self._ratio = ratio
+        self._engine = engine
+
+    @property
+    def n_x(self): return self._n_x
+
+    @property
+    def n_y(self): return self._n_y
+
+    @property
+    def tolerance(self): return self._tolerance
+
+    @property
+    def ratio(self): return self._ratio
+
+    @property
+    def engine(self): return self._engine
+
+    def __repr__(self):
+        return ("Stage(%d, %d, tolerance=%r, ratio=%r, engine=%r)"
+                % (self._n_x, self._n_y, self._tolerance, self._ratio, self._engine))
+
+
+DEFAULT_CASCADE = (Stage(4, 4), Stage(16, 16))
+"""The stages of findsimilar, when no cascade is given."""
+
+
+class StageStats(object):
+    """Statistics of a stage of a comparison cascade.
+
+    Holds the stage, the number of distinct images that entered it, the
+    number of candidate groups (or clusters) it produced, the number of
+    image pairs it compared, and the time it took, in seconds.
+
+    This is a lightweight read-only data container class.
+
+    """
+    __slots__ = ('_stage', '_images_in', '_groups_out', '_pairs_evaluated', '_seconds')
+
+    def __init__(self, stage, images_in, groups_out, pairs_evaluated, seconds):
+        self._stage = stage
+        self._images_in = images_in
+        self._groups_out = groups_out
+        self._pairs_evaluated = pairs_evaluated
+        self._seconds = seconds
+
+    @property
+    def stage(self): return self._stage
+
+    @property
+    def images_in(self): return self._images_in
+
+    @property
+    def groups_out(self): return self._groups_out
+
+    @property
+    def pairs_evaluated(self): return self._pairs_evaluated
+
+    @property
+    def seconds(self): return self._seconds
+
+    def __repr__(self):
+        return ("StageStats(%r, images_in=%d, groups_out=%d, pairs_evaluated=%d, seconds=%.6f)"
+                % (self._stage, self._images_in, self._groups_out,
+                   self._pairs_evaluated, self._seconds))
+
+
+def run_cascade(fpmatrix, cascade, tolerance, pool, clusters=False):
+    """Run a cascade of comparison stages over all the images of a matrix.
+
+    Receives a FingerprintMatrix, a sequence of Stage, the tolerance for
+    stages that don't have their own, and a multiprocessing.Pool or
+    executor to parallelize the work. The first stage compares all the
+    images; every following stage refines the groups of the stage before.
+
+    Returns the tuple (groups, stats), where groups is a set of
+    frozensets of row indices, and stats a list with the StageStats of
+    each stage. If clusters is True, the groups are non-overlapping
+    clusters, as with cluster_labels and refine_clusters.
+
+    Raises ValueError if the cascade has no stages.
+
+    """
+    if not cascade:
+        raise ValueError("the cascade must have at least one stage")
+
+    stats = []
+    candidates = [range(len(fpmatrix))]
+    labels = None
+
+    for k, stage in enumerate(cascade):
+        start = time.time()
+        stage_name = "stage.%d.%dx%d" % (k, stage.n_x, stage.n_y)
+
+        stage_tolerance = stage.tolerance if stage.tolerance is not None else tolerance
+
+        with instrument.timed(stage_name):
+            if clusters and k == 0:
+                images_in = len(fpmatrix)
+                indices, pair_ids, evaluated = _similar_pairs(
+                        fpmatrix, range(len(fpmatrix)), stage_tolerance,
+                        stage.n_x, stage.n_y, pool, stage.engine, stage.ratio)
+                labels = cluster_labels(len(fpmatrix), indices, pair_ids)
+            elif clusters:
+                images_in = int((labels >= 0).sum())
+                labels, evaluated = _refine_clusters(
+                        fpmatrix, labels, stage_tolerance, stage.n_x, stage.n_y, pool,
+                        stage.engine, stage.ratio)
+            else:
+                images_in = len(set().union(*candidates)) if k else len(fpmatrix)
+                candidates, evaluated = _refine_candidates(
+                        fpmatrix, candidates, stage_tolerance, stage.n_x, stage.n_y, pool,
+                        stage.engine, stage.ratio)
+
+        if clusters:
+            groups_out = int(labels.max()) + 1 if len(labels) else 0
+        else:
+            groups_out = len(candidates)
+
+        stage_stats = StageStats(stage, images_in, groups_out, evaluated, time.time() - start)
+        _report_stage(stage_name, stage_stats, labels if clusters else candidates, clusters)
+
+        stats.append(stage_stats)
+
+    if clusters:
+        return {frozenset(cluster.tolist()) for cluster in labels_to_clusters(labels)}, stats
+
+    return set(candidates), stats
+
+
+def _report_stage(name, stage_stats, groups, clusters):
+    """Send the counters and group sizes of a cascade stage to instrument.
+
+    groups are the candidate groups of the stage, or its cluster labels
+    if clusters is True.
+
+    """
+    if not instrument.enabled():
+        return
+
+    instrument.count(name + ".images_in", stage_stats.images_in)
+    instrument.count(name + ".groups_out", stage_stats.groups_out)
+    instrument.count(name + ".pairs_evaluated", stage_stats.pairs_evaluated)
+
+    if clusters:
+        sizes = np.bincount(groups[groups >= 0])
+    else:
+        sizes = np.array([len(group) for group in groups], np.int64)
+    instrument.histogram(name + ".group_sizes", sizes)
+
+
+def findsimilar(filenames, tolerance, cache_file=None, engine='groups', clusters=False,
+                decode_threads=None, executor=None, cascade=None, stats=None,
+                collapse_duplicates=True, mode='rgb'):
+    """Find similar images among many.
+
+    Receives a sequence of image file names, and a tolerance value within
+    0 and 255. Returns a set of groups of similar images, in the form of
+    frozensets of file names.
+
+    cache_file, if provided and not None, is the name of a persistent
+    fingerprint cache (see fpcache.FingerprintCache). Images whose cached
+    fingerprint is still valid will not be decoded.
+
+    mode is one of imagedescr.FINGERPRINT_MODES. 'luma' fingerprints are
+    a third of the size of 'rgb' ones, and so are their quadrants, which
+    makes them cheaper to compute, hold and compare; but images that
+    differ only in colour are similar. The quadrants of a cascade must
+    evenly divide the fingerprints of the mode.
+
+    cascade, if provided and not None, is a sequence of Stage, which
+    the images go through in order (see run_cascade). By default, the
+    images are compared with 4x4 quadrants, and then the candidates with
+    16x16 quadrants, both with the given tolerance. stats, if provided
+    and not None, is a list to which the StageStats of each stage are
+    appended.
+
+    engine is one of ENGINES, and selects how the first stage of the
+    default cascade finds its candidates, over the whole set of images.
+    The smaller candidate groups of the later stages are refined with
+    'groups'. Stages of a given cascade have their own engine.
+
+    If clusters is True, the similar pairs are merged into clusters
+    instead, which don't overlap: images similar to a common image end up
+    in the same cluster, even if they are not similar to each other.
+
+    decode_threads, if provided and not None, is the number of threads
+    decoding the images, in a pipeline that reads files ahead of them
+    (see decode.decode_fingerprints). Otherwise, the images are decoded
+    by the executor.
+
+    executor, if provided and not None, is the executor (see the
+    executor module) that parallelizes the work. It is left open, so that
+    it can be reused. Otherwise, a pool of worker processes is created
+    for the call.
+
+    If collapse_duplicates is True, byte-identical files are found first
+    (see dedup.find_duplicates), and only one of each set of them is
+    decoded and compared. The others are put back in the groups of the
+    one that was, and identical files are always grouped together.
+
+    The work is reported to the listeners of the instrument module, if
+    any.
+
+    """
+    with instrument.timed('findsimilar'):
+        pool = executor if executor is not None else create_worker_pool()
+        cache = fpcache.FingerprintCache(cache_file, mode) if cache_file is not None else None
+        fpmatrix = None
+        copies = {}
+
+        try:
+            if collapse_duplicates:
+                with instrument.timed('dedup'):
+                    filenames, copies = dedup.collapse_duplicates(filenames, pool)
+                instrument.count('images.duplicates', sum(len(c) for c in copies.values()))
+
+            if decode_threads is not None:
+                fpmatrix = matrix.FingerprintMatrix.from_files_threaded(
+                        filenames, cache, decode_threads, mode)
+            else:
+                fpmatrix = matrix.FingerprintMatrix.from_files(filenames, pool, cache, mode)
+            filepaths = fpmatrix.filepaths
+
+            if cascade is None:
+                cascade = (Stage(4, 4, engine=engine),) + DEFAULT_CASCADE[1:]
+
+            similar_candidates, stage_stats = run_cascade(fpmatrix, cascade, tolerance, pool, clusters)
+
+            if stats is not None:
+                stats.extend(stage_stats)
+
+        finally:
+            if executor is None:
+                pool.close()
+            if cache is not None:
+                cache.close()
+            if fpmatrix is not None:
+                fpmatrix.close()
+
+        return dedup.expand_duplicates(
+                (frozenset(filepaths[i] for i in group) for group in similar_candidates),
+                copies)
+
+
+def similar_mask(base_quads, quads, tolerance):
+    """Find the images similar to a base image, by their quadrants.
+
+    Receives the quadrant averages of the base image, an (N, nquads)
+    array with the quadrant averages of N other images, and a tolerance
+    value between 0 and 255. Returns a boolean array of length N, which
+    is True for the images where at least SIMILAR_QUADS_RATIO of the
+    quadrants are within tolerance of the base image's.
+
+    """
+    min_similar_quads = int(len(base_quads) * SIMILAR_QUADS_RATIO)
+
+    votes = (np.abs(quads - base_quads) <= tolerance).sum(axis=1)
+
+    return votes >= min_similar_quads
+
+
+def similar_fingerprints_mask(base_fingerprint, fingerprints, tolerance, nquads_x, nquads_y):
+    """Find the images similar to a base image, by their fingerprints.
+
+    Receives the base image's fingerprint, an (N, FINGERPRINT_LEN) array
+    of fingerprints, a tolerance value between 0 and 255, and the number
+    of subdivisions along each axis. Calculates the quadrants and returns
+    similar_mask for them.
+
+    """
+    base_quads = _base_quadrants(base_fingerprint, nquads_x, nquads_y)
+
+    return similar_mask(base_quads,
+                        imagedescr.calc_quadrants_batch(fingerprints, nquads_x, nquads_y),
+                        tolerance)
+
+
+def _base_quadrants(base_fingerprint, n_x, n_y):
+    """Get the quadrant averages of a single fingerprint."""
+    return imagedescr.calc_quadrants_batch(np.reshape(base_fingerprint, (1, -1)), n_x, n_y)[0]
+
+
+def query_similar(base_fingerprint, fingerprints, tolerance):
+    """Find the images similar to a base image, one against many.
+
+    Receives the base image's fingerprint, an (N, FINGERPRINT_LEN) array
+    of fingerprints or a FingerprintMatrix, and a tolerance value between
+    0 and 255. Returns an array with the positions of the similar
+    fingerprints.
+
+    The base image's quadrants are calculated once. All fingerprints are
+    scanned with 4x4 quadrants first, and only the ones that pass are
+    compared with 16x16 quadrants. The quadrants of a FingerprintMatrix
+    come from its precalculated sums.
+
+    """
+    if not isinstance(fingerprints, matrix.FingerprintMatrix):
+        fingerprints = np.asarray(fingerprints)
+        coarse_mask = similar_fingerprints_mask(base_fingerprint, fingerprints, tolerance, 4, 4)
+        matches = np.flatnonzero(coarse_mask)
+
+        fine_mask = similar_fingerprints_mask(
+                base_fingerprint, fingerprints[matches], tolerance, 16, 16)
+
+        return matches[fine_mask]
+
+    fpmatrix = fingerprints
+    coarse_mask = similar_mask(_base_quadrants(base_fingerprint, 4, 4),
+                               fpmatrix.quadrants(slice(None), 4, 4), tolerance)
+    matches = np.flatnonzero(coarse_mask)
+
+    fine_mask = similar_mask(_base_quadrants(base_fingerprint, 16, 16),
+                             fpmatrix.quadrants(matches, 16, 16), tolerance)
+
+    return matches[fine_mask]
+
+
+def _fingerprint_item(item):
+    """Fingerprint an image file, keeping track of its position.
+
+    Receives the tuple (k, filepath, mode). Returns (k, fingerprint).
+    Runs in the worker processes.
+
+    """
+    k, filepath, mode = item
+
+    return k, imagedescr.calc_fingerprint(filepath, mode)
+
+
+def _submit_batch(filenames, pool, cache, batch_size, mode):
+    """Submit the next batch of files for fingerprinting.
+
+    Takes up to batch_size names from the filenames iterator. Files with
+    a valid cached fingerprint are not sent to the pool; the others are
+    fingerprinted in the given mode. Returns the tuple
+    (batch, cached, results), where batch is the list of names, cached
+    maps positions in batch to cached fingerprints, and results is an
+    iterator of (position, fingerprint) for the remaining files, in
+    completion order. Returns None if there are no more files.
+
+    """
+    batch = list(itertools.islice(filenames, batch_size))
+    if not batch:
+        return None
+
+    cached = {}
+    if cache is not None:
+        for k, filepath in enumerate(batch):
+            fingerprint = cache.get(filepath)
+            if fingerprint is not None:
+                cached[k] = fingerprint
+
+    missing = [(k, filepath, mode) for k, filepath in enumerate(batch) if k not in cached]
+    results = pool.imap_unordered(_fingerprint_item, missing, chunksize=16)
+
+    return batch, cached, results
+
+
+def _grow(array, min_rows):
+    """Return array with room for at least min_rows rows.
+
+    Capacity grows geometrically, so that appending rows one batch at a
+    time costs amortized constant time per row.
+
+    """
+    if len(array) >= min_rows:
+        return array
 
-    return setops.without_subsets(refined_candidates)
+    grown = np.empty((max(min_rows, 2 * len(array)),) + array.shape[1:],
+                     array.dtype)
+    grown[:len(array)] = array
 
+    return grown
 
-def findsimilar(filenames, tolerance):
-    pool = create_worker_pool()
+
+def iter_similar(filenames, tolerance, pool, cache=None, batch_size=STREAM_BATCH_SIZE,
+                 cascade=DEFAULT_CASCADE, mode='rgb'):
+    """Find similar images among many, as a stream.
+
+    Receives an iterable of image file names (which may be a lazy
+    iterator, e.g. fed from a directory walk), a tolerance value within 0
+    and 255, a multiprocessing.Pool or executor to parallelize the work,
+    and optionally a FingerprintCache of the given fingerprint mode.
+
+    Files are taken from the iterable a batch at a time, and fingerprinted
+    by the pool in the background while the previous batch is being
+    compared. After each batch, the cascade (see run_cascade) is run over
+    all the images seen so far. Batches hold at least batch_size files,
+    and as many as were seen before them, so that the cascade runs about
+    log2(N) times, on at most twice as many images in total as the last run.
+
+    Yields groups of similar images as soon as they are found, in the
+    form of frozensets of file names: after each batch, the groups with a
+    newly seen image that weren't yielded before. A group that grows is
+    yielded again, and supersedes the groups it contains. The groups of
+    the last run, which are those of findsimilar, have all been yielded
+    when the stream ends.
+
+    Besides a bounded number of files in flight, memory use is limited
+    to the file name and fingerprint of each image seen, and to the
+    quadrants of the last run.
+
+    """
+    filenames = iter(filenames)
+
+    filepaths = []
+    fingerprints = np.empty((0, imagedescr.fingerprint_len(mode)), np.uint8)
+    yielded = set()
+
+    pending = _submit_batch(filenames, pool, cache, batch_size, mode)
+    while pending is not None:
+        batch, cached, results = pending
+
+        start = len(filepaths)
+        end = start + len(batch)
+
+        # keep the pool busy with the next batch while we compare this one
+        pending = _submit_batch(filenames, pool, cache, max(batch_size, end), mode)
+
+        fingerprints = _grow(fingerprints, end)
+
+        for k, fingerprint in cached.items():
+            fingerprints[start + k] = fingerprint
+
+        for k, fingerprint in results:
+            fingerprints[start + k] = fingerprint
+            if cache is not None:
+                cache.put(batch[k], fingerprint)
+
+        if cache is not None:
+            cache.commit()
+
+        filepaths.extend(batch)
+
+        if end < 2:
+            continue
+
+        fpmatrix = matrix.FingerprintMatrix(fingerprints[:end], filepaths)
+        groups = run_cascade(fpmatrix, cascade, tolerance, pool)[0]
+
+        for group in sorted(groups, key=min):
+            if max(group) >= start and group not in yielded:
+                yielded.add(group)
+                yield frozenset(fpmatrix.filepath(i) for i in group)
+
+
+def findsimilar_iter(filenames, tolerance, cache_file=None, executor=None, mode='rgb'):
+    """Find similar images among many, as a stream.
+
+    Like findsimilar, but receives an iterable of file names that may be
+    a lazy iterator, and yields groups of similar images as they are
+    found. See iter_similar for details.
+
+    cache_file, executor and mode are as in findsimilar.
+
+    """
+    pool = executor if executor is not None else create_worker_pool()
+    cache = fpcache.FingerprintCache(cache_file, mode) if cache_file is not None else None
 
     try:
-        similar_candidates = refine_candidates([pool.map(imagedescr.ImageDescr, filenames)], tolerance, 4, 4, pool)
+        for group in iter_similar(filenames, tolerance, pool, cache, mode=mode):
+            yield group
+
+    finally:
+        if executor is None:
+            pool.close()
+        if cache is not None:
+            cache.close()
 
-        #similar_candidates = refine_candidates(similar_candidates, tolerance, 8, 8, pool)
 
-        similar_candidates = refine_candidates(similar_candidates, tolerance, 16, 16, pool)
+def findsimilar_to(base_filename, filenames, tolerance, cache_file=None, executor=None,
+                   mode='rgb'):
+    """Find the images similar to a base image.
+
+    Receives the base image's file name, a sequence of image file names
+    to compare it with, and a tolerance value within 0 and 255. Returns a
+    list with the names of the similar files, in their original order.
+
+    This is much cheaper than findsimilar, since it doesn't need to
+    compare every pair of images. See query_similar for details.
+
+    The base image itself is never listed, even if it is among filenames
+    (e.g. when its directory is scanned), under the same or another path.
+
+    cache_file, executor and mode are as in findsimilar.
+
+    """
+    pool = executor if executor is not None else create_worker_pool()
+    cache = fpcache.FingerprintCache(cache_file, mode) if cache_file is not None else None
+    fpmatrix = None
+
+    try:
+        base_fingerprint = cache.get(base_filename) if cache is not None else None
+        if base_fingerprint is None:
+            base_fingerprint = imagedescr.calc_fingerprint(base_filename, mode)
+
+        base_stat = os.stat(base_filename)
+        filenames = [f for f in filenames if not _is_same_file(f, base_stat)]
+
+        fpmatrix = matrix.FingerprintMatrix.from_files(filenames, pool, cache, mode)
+
+        with instrument.timed('query'):
+            matches = query_similar(base_fingerprint, fpmatrix, tolerance)
+
+        similar = [fpmatrix.filepath(i) for i in matches]
 
     finally:
-        pool.terminate()
-        pool.join()
+        if executor is None:
+            pool.close()
+        if cache is not None:
+            cache.close()
+        if fpmatrix is not None:
+            fpmatrix.close()
+
+    return similar
 
-    return similar_candidates
+
+def _is_same_file(filepath, stat):
+    """Return True if filepath is the file of a given os.stat result."""
+    try:
+        return os.path.samestat(os.stat(filepath), stat)
+    except OSError:
+        return False
 
 
 if __name__ == '__main__':
     # debug/testing
     import sys
-    import time
 
     filenames = sys.argv[1:]
 
@@ -231,8 +1312,8 @@ if __name__ == '__main__':
     t1 = time.time()
 
     for g in similar:
-        for i in g:
-            print(i, i.filepath)
+        for filepath in g:
+            print(filepath)
         print("-------------")
 
     print("%d file(s) compared in %.6f seconds" % (len(filenames), t1-t0))
@@ -0,0 +1,159 @@
+# ImageCmp - find similar images among many
+# Copyright (C) 2009,2017 Israel G. Lugo
+#
+# This file is part of ImageCmp.
+#
+# ImageCmp is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# ImageCmp is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with ImageCmp. If not, see <http://www.gnu.org/licenses/>.
+#
+# For suggestions, feedback or bug reports: israel.lugo@lugosys.com
+
+
+"""This module implements a threaded image decoding pipeline.
+
+Files are read ahead by a set of I/O threads, into a bounded queue, and
+decoded by another set of threads. Pillow releases the GIL while reading
+and decoding, so the threads run in parallel without the cost of sending
+the results back from worker processes; and reading overlaps decoding,
+which matters on slow (e.g. network-backed) storage.
+
+"""
+
+
+import io
+import multiprocessing
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from imagecmp import imagedescr
+
+
+READ_THREADS = 4
+"""Default number of threads reading files."""
+
+PREFETCH_FILES = 64
+"""Default maximum number of files read but not yet decoded."""
+
+
+_DONE = object()
+"""Marks the end of the queue of files read, for the decoding threads."""
+
+
+def decode_fingerprints(fingerprints, rows, filepaths, read_threads=READ_THREADS,
+                        decode_threads=None, prefetch=PREFETCH_FILES):
+    """Fingerprint image files into rows of a preallocated array.
+
+    Receives an (N, fingerprint_len(mode)) array, and sequences of rows
+    and file paths of equal length. Fingerprints filepaths[k] and writes
+    the result to fingerprints[rows[k]]. The fingerprint mode is that of
+    the width of the array.
+
+    read_threads is the number of threads reading files, and
+    decode_threads the number of threads decoding them (by default, as
+    many as there are CPUs). At most prefetch files are held in memory,
+    waiting to be decoded.
+
+    If any file can't be read or decoded, the pipeline stops and the
+    first error is raised.
+
+    """
+    if decode_threads is None:
+        decode_threads = multiprocessing.cpu_count()
+
+    pipeline = _Pipeline(fingerprints, zip(rows, filepaths), prefetch)
+
+    readers = [threading.Thread(target=pipeline.read)
+               for i in range(max(1, read_threads))]
+    decoders = [threading.Thread(target=pipeline.decode)
+                for i in range(max(1, decode_threads))]
+
+    for thread in readers + decoders:
+        thread.daemon = True
+        thread.start()
+
+    for thread in readers:
+        thread.join()
+
+    for thread in decoders:
+        pipeline.loaded.put(_DONE)
+    for thread in decoders:
+        thread.join()
+
+    if pipeline.error is not None:
+        raise pipeline.error
+
+
+class _Pipeline(object):
+    """State shared by the threads of decode_fingerprints."""
+
+    def __init__(self, fingerprints, tasks, prefetch):
+        self.fingerprints = fingerprints
+        self.mode = imagedescr.fingerprint_mode(fingerprints.shape[1])
+        self.loaded = queue.Queue(max(1, prefetch))
+        self.error = None
+        self._tasks = iter(tasks)
+        self._lock = threading.Lock()
+
+    def _next_task(self):
+        """Get the next (row, filepath) to read, or None when done."""
+        with self._lock:
+            if self.error is not None:
+                return None
+            return next(self._tasks, None)
+
+    def _fail(self, error):
+        """Record an error, if it's the first one."""
+        with self._lock:
+            if self.error is None:
+                self.error = error
+
+    def read(self):
+        """Read files into the loaded queue, until there are no more."""
+        while True:
+            task = self._next_task()
+            if task is None:
+                return
+
+            row, filepath = task
+            try:
+                with open(filepath, 'rb') as f:
+                    data = f.read()
+            except Exception as e:
+                self._fail(e)
+                return
+
+            # blocks while the queue is full
+            self.loaded.put((row, data))
+
+    def decode(self):
+        """Decode files from the loaded queue, until it's done."""
+        while True:
+            item = self.loaded.get()
+            if item is _DONE:
+                return
+
+            # after an error, keep draining the queue so that no reader
+            # stays blocked on it
+            if self.error is not None:
+                continue
+
+            row, data = item
+            try:
+                self.fingerprints[row] = imagedescr.calc_fingerprint(io.BytesIO(data),
+                                                                      self.mode)
+            except Exception as e:
+                self._fail(e)
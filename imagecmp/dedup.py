@@ -0,0 +1,196 @@
+# ImageCmp - find similar images among many
+# Copyright (C) 2009,2017 Israel G. Lugo
+#
+# This file is part of ImageCmp.
+#
+# ImageCmp is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# ImageCmp is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with ImageCmp. If not, see <http://www.gnu.org/licenses/>.
+#
+# For suggestions, feedback or bug reports: israel.lugo@lugosys.com
+
+
+"""This module implements the detection of byte-identical files.
+
+Files are grouped by size first, which costs one stat each. Only files
+of equal size are read: first a hash of their first and last few KB,
+then, for those that still match, a hash of their whole content. Files
+of a size no other file has are never read.
+
+"""
+
+
+import functools
+import hashlib
+import os
+
+
+PARTIAL_HASH_BYTES = 4096
+"""Number of bytes at each end of a file hashed by the partial hash."""
+
+_READ_SIZE = 1 << 20
+"""Size of the reads of the full hash."""
+
+
+def partial_hash(filepath, size):
+    """Hash the first and last PARTIAL_HASH_BYTES of a file of a given size.
+
+    Files of up to twice PARTIAL_HASH_BYTES are hashed whole.
+
+    """
+    with open(filepath, 'rb') as f:
+        head = f.read(PARTIAL_HASH_BYTES)
+        if size > 2 * PARTIAL_HASH_BYTES:
+            f.seek(-PARTIAL_HASH_BYTES, os.SEEK_END)
+        tail = f.read(PARTIAL_HASH_BYTES)
+
+    return hashlib.sha1(head + tail).digest()
+
+
+def full_hash(filepath):
+    """Hash the whole content of a file."""
+    digest = hashlib.sha1()
+
+    with open(filepath, 'rb') as f:
+        for data in iter(lambda: f.read(_READ_SIZE), b''):
+            digest.update(data)
+
+    return digest.digest()
+
+
+def _partial_hash_item(item):
+    """Apply partial_hash to a (filepath, size) tuple, for pool.map."""
+    return partial_hash(*item)
+
+
+def find_duplicates(filenames, pool=None):
+    """Find the byte-identical files among many.
+
+    Receives a sequence of file names, and optionally a
+    multiprocessing.Pool or executor to hash the files (a ThreadExecutor
+    suits this I/O-bound work). Returns a list with a list of file names
+    for each set of identical files, in their original order. Files that
+    can't be read are never reported as duplicates, and neither are
+    repetitions of the same file name.
+
+    """
+    do_map = pool.map if pool is not None else lambda func, items: list(map(func, items))
+
+    order = {}
+    for k, filepath in enumerate(filenames):
+        order.setdefault(filepath, k)
+
+    by_size = {}
+    for filepath in sorted(order, key=order.get):
+        try:
+            size = os.stat(filepath).st_size
+        except EnvironmentError:
+            continue
+        by_size.setdefault(size, []).append(filepath)
+
+    candidates = [(size, group) for size, group in by_size.items() if len(group) > 1]
+
+    # same size: compare the ends of the files
+    items = [(filepath, size) for size, group in candidates for filepath in group]
+    hashes = _try_map(do_map, _partial_hash_item, items)
+
+    by_partial = {}
+    for (filepath, size), digest in zip(items, hashes):
+        if digest is not None:
+            by_partial.setdefault((size, digest), []).append(filepath)
+
+    duplicates = []
+    full_candidates = []
+    for (size, digest), group in by_partial.items():
+        if len(group) < 2:
+            continue
+        if size <= 2 * PARTIAL_HASH_BYTES:
+            # the partial hash was of the whole file
+            duplicates.append(group)
+        else:
+            full_candidates.append(group)
+
+    # same ends: compare the whole files
+    items = [filepath for group in full_candidates for filepath in group]
+    hashes = iter(_try_map(do_map, full_hash, items))
+
+    for group in full_candidates:
+        by_full = {}
+        for filepath in group:
+            digest = next(hashes)
+            if digest is not None:
+                by_full.setdefault(digest, []).append(filepath)
+        duplicates.extend(same for same in by_full.values() if len(same) > 1)
+
+    duplicates = [sorted(group, key=order.get) for group in duplicates]
+
+    return sorted(duplicates, key=lambda group: order[group[0]])
+
+
+def _try_map(do_map, func, items):
+    """Map func over items, with None for the items it raised an error on."""
+    return do_map(functools.partial(_try_call, func), items)
+
+
+def _try_call(func, item):
+    """Return func(item), or None if it raises EnvironmentError."""
+    try:
+        return func(item)
+    except EnvironmentError:
+        return None
+
+
+def collapse_duplicates(filenames, pool=None):
+    """Replace each set of byte-identical files by a single one.
+
+    Receives the same arguments as find_duplicates. Returns the tuple
+    (unique, copies), where unique is the list of file names without the
+    duplicates, keeping the first of each set, and copies maps each file
+    kept to the list of its duplicates that were left out.
+
+    """
+    filenames = list(filenames)
+
+    copies = {}
+    for group in find_duplicates(filenames, pool):
+        copies[group[0]] = group[1:]
+
+    left_out = {filepath for group in copies.values() for filepath in group}
+
+    return [filepath for filepath in filenames if filepath not in left_out], copies
+
+
+def expand_duplicates(groups, copies):
+    """Put back the duplicates left out by collapse_duplicates.
+
+    Receives an iterable of groups of similar file names, found among the
+    unique files, and the copies returned by collapse_duplicates. Returns
+    a set of frozensets: each group with the duplicates of its members,
+    plus a group for each set of duplicates not in any group, since
+    identical files are similar to each other.
+
+    """
+    expanded = set()
+    grouped = set()
+
+    for group in groups:
+        members = set(group)
+        for filepath in group:
+            members.update(copies.get(filepath, ()))
+        grouped.update(group)
+        expanded.add(frozenset(members))
+
+    for filepath, duplicates in copies.items():
+        if filepath not in grouped:
+            expanded.add(frozenset([filepath] + duplicates))
+
+    return expanded
@@ -0,0 +1,223 @@
+# ImageCmp - find similar images among many
+# Copyright (C) 2009,2017 Israel G. Lugo
+#
+# This file is part of ImageCmp.
+#
+# ImageCmp is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# ImageCmp is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with ImageCmp. If not, see <http://www.gnu.org/licenses/>.
+#
+# For suggestions, feedback or bug reports: israel.lugo@lugosys.com
+
+
+"""This module implements executors, which run work in parallel.
+
+An executor has the map and imap_unordered methods of a
+multiprocessing.Pool, so either can be passed wherever the work is
+parallelized. Executors also pick the chunksize themselves, and run small
+batches in the calling process, where the cost of starting the workers
+and dispatching to them would outweigh the work. The workers are only
+started by the first batch large enough to need them, so an executor
+that only ever sees small batches never starts any.
+
+An executor can be used as a context manager, which closes it on exit. A
+long-lived executor can be reused across many calls of findsimilar.
+
+"""
+
+
+import multiprocessing
+import multiprocessing.pool
+
+
+MIN_BATCH = 256
+"""Default minimum amount of work for a batch to be sent to the workers.
+
+Work is counted in items, or in images where the caller says so (see
+map_work). Smaller batches are run in the calling process. Fingerprinting
+a photo takes a few milliseconds, while starting a pool of processes
+takes tens of milliseconds with fork and around a second with spawn, so
+a pool only pays for itself over hundreds of images.
+
+"""
+
+CHUNKS_PER_WORKER = 4
+"""Number of chunks each worker receives from a batch, on average.
+
+More chunks balance the load better, at the cost of more dispatching.
+
+"""
+
+
+class Executor(object):
+    """Base executor, which runs everything in the calling process.
+
+    Subclasses implement _create_pool, returning a multiprocessing.Pool-like
+    object. It is called by the first batch sent to the workers.
+
+    """
+
+    in_process = True
+    """Whether the work runs in the calling process, sharing its memory."""
+
+    def __init__(self, workers=1, min_batch=MIN_BATCH):
+        self._workers = workers
+        self._min_batch = min_batch
+        self._pool = None
+
+    @property
+    def workers(self):
+        """Get the number of workers."""
+        return self._workers
+
+    @property
+    def started(self):
+        """Whether the workers have been started."""
+        return self._pool is not None
+
+    def chunksize(self, count):
+        """Get the chunksize for a batch of count items."""
+        return max(1, count // (CHUNKS_PER_WORKER * self._workers))
+
+    def _create_pool(self):
+        """Create the pool of workers, or return None to run in-process."""
+        return None
+
+    def _get_pool(self, count, work):
+        """Get the pool for a batch of count items, or None to run in-process.
+
+        work is the amount of work in the batch, or None for count. The
+        pool is created the first time it is needed.
+
+        """
+        if work is None:
+            work = count
+
+        if count == 0 or work < self._min_batch:
+            return None
+
+        if self._pool is None:
+            self._pool = self._create_pool()
+
+        return self._pool
+
+    def map(self, func, iterable, chunksize=None, work=None):
+        """Apply func to every item, and return the list of results.
+
+        work, if not None, is the amount of work in the batch, for batches
+        whose items are each worth many units of work; it is compared to
+        min_batch instead of the number of items.
+
+        """
+        items = list(iterable)
+        pool = self._get_pool(len(items), work)
+
+        if pool is None:
+            return [func(item) for item in items]
+
+        return pool.map(func, items, chunksize or self.chunksize(len(items)))
+
+    def imap_unordered(self, func, iterable, chunksize=None, work=None):
+        """Apply func to every item, and iterate the results as they come.
+
+        Batches that are run in-process are evaluated lazily, in order, as
+        the results are iterated. work is as in map.
+
+        """
+        items = list(iterable)
+        pool = self._get_pool(len(items), work)
+
+        if pool is None:
+            return (func(item) for item in items)
+
+        return pool.imap_unordered(func, items, chunksize or self.chunksize(len(items)))
+
+    def close(self):
+        """Stop the workers. The executor must not be used afterwards."""
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class SerialExecutor(Executor):
+    """Executor that runs everything in the calling process."""
+
+
+class ThreadExecutor(Executor):
+    """Executor backed by a pool of threads.
+
+    Best for work that releases the GIL, such as decoding images or large
+    NumPy operations. Nothing needs to be pickled.
+
+    """
+
+    def __init__(self, workers=None, min_batch=MIN_BATCH):
+        """Create a ThreadExecutor with workers threads.
+
+        If workers is None, there will be as many threads as there are
+        CPUs.
+
+        """
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+
+        super(ThreadExecutor, self).__init__(workers, min_batch)
+
+    def _create_pool(self):
+        return multiprocessing.pool.ThreadPool(self._workers)
+
+
+class ProcessExecutor(Executor):
+    """Executor backed by a multiprocessing.Pool of worker processes.
+
+    Functions and their arguments must be picklable.
+
+    """
+
+    in_process = False
+
+    def __init__(self, workers=None, min_batch=MIN_BATCH):
+        """Create a ProcessExecutor with workers processes.
+
+        If workers is None, there will be as many processes as there are
+        CPUs.
+
+        """
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+
+        super(ProcessExecutor, self).__init__(workers, min_batch)
+
+    def _create_pool(self):
+        return multiprocessing.Pool(processes=self._workers)
+
+
+def map_work(pool, func, items, work):
+    """Apply func to every item with pool, for a batch of the given work.
+
+    Like pool.map, but an executor decides whether to send the batch to
+    its workers by work, rather than by the number of items. For batches
+    of a few coarse items, each worth many units of work (e.g. a chunk of
+    images). A multiprocessing.Pool always runs the batch.
+
+    """
+    if isinstance(pool, Executor):
+        return pool.map(func, items, work=work)
+
+    return pool.map(func, items)
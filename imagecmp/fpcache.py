@@ -0,0 +1,224 @@
+
+# ImageCmp - find similar images among many
+# Copyright (C) 2009,2017 Israel G. Lugo
+#
+# This file is part of ImageCmp.
+#
+# ImageCmp is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# ImageCmp is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with ImageCmp. If not, see <http://www.gnu.org/licenses/>.
+#
+# For suggestions, feedback or bug reports: israel.lugo@lugosys.com
+
+
+"""This module implements a persistent on-disk fingerprint cache.
+
+Fingerprints are stored in an SQLite database, keyed by the file's path,
+size, modification time and inode number. A cached fingerprint is only
+used if all of those still match the file on disk; otherwise it is
+considered stale, and is discarded.
+
+Each fingerprint mode has a table of its own, so that a cache file can
+hold both the 'rgb' and the 'luma' fingerprints of the same files.
+
+The database's user_version records the imagedescr.FINGERPRINT_VERSION
+the fingerprints were calculated with. A cache of any other version is
+emptied when opened.
+
+"""
+
+
+import os
+import sqlite3
+
+import numpy as np
+
+from imagecmp import imagedescr
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS %s (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    fingerprint BLOB NOT NULL
+)
+"""
+
+
+def stat_key(st):
+    """Get the cache key of a file, from its os.stat result.
+
+    Returns the tuple (st_size, st_mtime_ns, st_ino). On Python versions
+    without st_mtime_ns, the modification time is derived from st_mtime.
+
+    """
+    mtime_ns = getattr(st, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        mtime_ns = int(st.st_mtime * 1000000000)
+
+    return st.st_size, mtime_ns, st.st_ino
+
+
+def _table_name(mode):
+    """Get the name of the table holding the fingerprints of a mode.
+
+    'rgb' fingerprints keep the table name they had before there were
+    other modes, so existing caches remain valid.
+
+    """
+    imagedescr.fingerprint_len(mode)    # validates the mode
+
+    return 'fingerprints' if mode == 'rgb' else 'fingerprints_' + mode
+
+
+def _check_version(conn):
+    """Empty a cache of another version of the fingerprint algorithm.
+
+    SQLite starts user_version at 0, so caches created before the version
+    was recorded are emptied as well.
+
+    """
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version == imagedescr.FINGERPRINT_VERSION:
+        return
+
+    for mode in imagedescr.FINGERPRINT_MODES:
+        conn.execute("DROP TABLE IF EXISTS %s" % _table_name(mode))
+
+    conn.execute("PRAGMA user_version = %d" % imagedescr.FINGERPRINT_VERSION)
+    conn.commit()
+
+
+class FingerprintCache(object):
+    """Persistent cache of image fingerprints.
+
+    Usable as a context manager, which closes the cache on exit.
+
+    """
+
+    def __init__(self, filename, mode='rgb'):
+        """Open (or create) the cache stored in filename.
+
+        The cache holds fingerprints of the given mode, one of
+        imagedescr.FINGERPRINT_MODES. If it was made by another version
+        of the fingerprint algorithm, it is emptied first.
+
+        """
+        self._table = _table_name(mode)
+        self._length = imagedescr.fingerprint_len(mode)
+        self._conn = sqlite3.connect(filename)
+        _check_version(self._conn)
+        self._conn.execute(_SCHEMA % self._table)
+        self._conn.commit()
+
+    def close(self):
+        """Commit any pending changes and close the cache."""
+        self._conn.commit()
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        """Return the number of cached fingerprints."""
+        return self._conn.execute("SELECT COUNT(*) FROM %s" % self._table).fetchone()[0]
+
+    def get(self, filepath):
+        """Get the cached fingerprint of a file.
+
+        Returns the fingerprint, or None if the file isn't cached or if
+        it can't be stat'ed. A stale entry, i.e. one that no longer
+        matches the file on disk, is removed from the cache.
+
+        """
+        try:
+            key = stat_key(os.stat(filepath))
+        except OSError:
+            return None
+
+        row = self._conn.execute(
+                "SELECT size, mtime_ns, inode, fingerprint FROM %s"
+                " WHERE path = ?" % self._table, (filepath,)).fetchone()
+
+        if row is None:
+            return None
+
+        blob = row[3]
+        if tuple(row[:3]) != key or len(blob) != self._length:
+            self._conn.execute("DELETE FROM %s WHERE path = ?" % self._table,
+                               (filepath,))
+            return None
+
+        array = np.frombuffer(blob, np.uint8)
+        array.setflags(write=False)
+
+        return array
+
+    def put(self, filepath, fingerprint):
+        """Store the fingerprint of a file.
+
+        The file is stat'ed to obtain its cache key. Files that can't be
+        stat'ed are not stored.
+
+        Changes are written to disk by commit() or close().
+
+        """
+        try:
+            size, mtime_ns, inode = stat_key(os.stat(filepath))
+        except OSError:
+            return
+
+        self._conn.execute(
+                "INSERT OR REPLACE INTO %s"
+                " (path, size, mtime_ns, inode, fingerprint)"
+                " VALUES (?, ?, ?, ?, ?)" % self._table,
+                (filepath, size, mtime_ns, inode,
+                 sqlite3.Binary(np.ascontiguousarray(fingerprint, np.uint8))))
+
+    def commit(self):
+        """Write pending changes to disk."""
+        self._conn.commit()
+
+    def compact(self):
+        """Remove stale entries and reclaim their disk space.
+
+        Every cached file is stat'ed. Entries for files that no longer
+        exist, or that were changed since they were cached, are removed.
+
+        Returns the number of removed entries.
+
+        """
+        stale = []
+        rows = self._conn.execute(
+                "SELECT path, size, mtime_ns, inode FROM %s" % self._table).fetchall()
+        for row in rows:
+            try:
+                key = stat_key(os.stat(row[0]))
+            except OSError:
+                key = None
+
+            if tuple(row[1:]) != key:
+                stale.append((row[0],))
+
+        self._conn.executemany("DELETE FROM %s WHERE path = ?" % self._table,
+                               stale)
+        self._conn.commit()
+
+        # VACUUM can't run inside a transaction
+        self._conn.execute("VACUUM")
+
+        return len(stale)
@@ -0,0 +1,171 @@
+
+# ImageCmp - find similar images among many
+# Copyright (C) 2009,2017 Israel G. Lugo
+#
+# This file is part of ImageCmp.
+#
+# ImageCmp is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# ImageCmp is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with ImageCmp. If not, see <http://www.gnu.org/licenses/>.
+#
+# For suggestions, feedback or bug reports: israel.lugo@lugosys.com
+
+
+"""This module implements a grid-hash spatial index over quadrant vectors.
+
+Two images are similar if at least min_votes of their quadrant averages
+are within tolerance of each other. Instead of grouping each quadrant
+separately and voting, the quadrant dimensions are split into disjoint
+blocks, and each block is hashed into a grid of tolerance-sized cells.
+Two values within tolerance always fall in the same or in adjacent
+cells, so probing the neighbouring cells of a block finds every pair
+that matches on all of the block's dimensions.
+
+A similar pair fails at most (nquads - min_votes) dimensions. With
+(nquads - min_votes + 1) disjoint blocks, at least one block has no
+failing dimension, and so every similar pair is found. Candidate pairs
+are then confirmed by counting their votes.
+
+"""
+
+
+import itertools
+
+import numpy as np
+
+from imagecmp import setops
+
+
+MAX_KEY_DIMS = 3
+"""Maximum number of dimensions of a block used for hashing.
+
+Probing the neighbouring cells costs 3**d lookups for d dimensions. A
+block with more dimensions is hashed by its first MAX_KEY_DIMS only;
+pairs matching all of the block's dimensions still match those, so no
+similar pair is lost, at the cost of a few more candidates to confirm.
+
+"""
+
+CHUNK_PAIRS = 1 << 20
+"""Approximate number of candidate pairs to generate and confirm at a time.
+
+Bounds the memory used for the (pairs, nquads) difference arrays.
+
+"""
+
+
+def similar_pairs(quads, tolerance, min_votes):
+    """Find the similar pairs of images, by their quadrant averages.
+
+    Receives an (N, nquads) array of quadrant averages, a tolerance value
+    between 0 and 255, and the minimum number of quadrants within
+    tolerance for two images to be similar (at least 1).
+
+    Returns the tuple (pair_ids, votes) for the similar pairs, in the
+    format of compare.sum_votes: a pair of images at positions a < b is
+    encoded as a*N + b, and votes is the number of quadrants within
+    tolerance.
+
+    """
+    quads = np.asarray(quads)
+    nimages, nquads = quads.shape
+
+    if not 1 <= min_votes <= nquads:
+        raise ValueError("min_votes (%d) must be between 1 and %d"
+                         % (min_votes, nquads))
+
+    nblocks = nquads - min_votes + 1
+    dims_per_block = nquads // nblocks
+
+    # cells are tolerance wide, so that values within tolerance are in
+    # the same or adjacent cells
+    cells = np.floor(quads / max(tolerance, 1)).astype(np.int64)
+
+    found = [np.empty(0, np.int64)]
+    for block in range(nblocks):
+        start = block * dims_per_block
+        dims = slice(start, start + min(dims_per_block, MAX_KEY_DIMS))
+
+        for a, b in _neighbour_pairs(cells[:, dims]):
+            pair_ids = _confirm(quads, a, b, tolerance, min_votes)
+            found.append(pair_ids)
+
+    # pairs may be found through more than one block
+    pair_ids = np.unique(np.concatenate(found))
+
+    a, b = pair_ids // nimages, pair_ids % nimages
+    votes = (np.abs(quads[a] - quads[b]) <= tolerance).sum(axis=1)
+
+    return pair_ids, votes
+
+
+def _neighbour_pairs(cells):
+    """Generate the pairs of images in the same or adjacent grid cells.
+
+    Receives an (N, d) array of integer cell coordinates. Generates
+    tuples (a, b) of arrays of image positions, a != b, such that every
+    pair of images whose cells differ by at most 1 along every dimension
+    is generated exactly once, in one direction.
+
+    """
+    nimages, ndims = cells.shape
+
+    # encode the cells as integer keys, leaving room for the neighbours
+    # of the lowest and highest cells
+    cells = cells - cells.min(axis=0) + 1 if nimages else cells
+    radix = int(cells.max()) + 2 if nimages else 1
+    weights = radix ** np.arange(ndims, dtype=np.int64)
+
+    keys = cells.dot(weights)
+    order = np.argsort(keys, kind='mergesort')
+    sorted_keys = keys[order]
+    positions = np.arange(nimages)
+
+    for offset in itertools.product((-1, 0, 1), repeat=ndims):
+        # Each pair of adjacent cells is probed from one side only: the
+        # one where the first non-zero offset component is positive.
+        nonzero = [o for o in offset if o]
+        if nonzero and nonzero[0] < 0:
+            continue
+
+        neighbour_keys = sorted_keys + np.dot(offset, weights)
+        lo = np.searchsorted(sorted_keys, neighbour_keys, 'left')
+        hi = np.searchsorted(sorted_keys, neighbour_keys, 'right')
+
+        if not nonzero:
+            # within the same cell, only pair with the images after us
+            lo = np.maximum(lo, positions + 1)
+            hi = np.maximum(hi, lo)
+
+        sizes = hi - lo
+        for chunk in setops.chunks_by_total(sizes, CHUNK_PAIRS):
+            a = order[np.repeat(positions[chunk], sizes[chunk])]
+            b = order[setops.expand_ranges(lo[chunk], sizes[chunk])]
+
+            yield a, b
+
+
+def _confirm(quads, a, b, tolerance, min_votes):
+    """Confirm candidate pairs by counting their votes.
+
+    Receives the quadrant averages, the arrays of positions of the
+    candidate pairs, the tolerance and the minimum number of votes.
+    Returns the encoded IDs of the pairs that are similar.
+
+    """
+    votes = (np.abs(quads[a] - quads[b]) <= tolerance).sum(axis=1)
+    similar = votes >= min_votes
+
+    a = a[similar].astype(np.int64)
+    b = b[similar].astype(np.int64)
+
+    return np.minimum(a, b) * len(quads) + np.maximum(a, b)
@@ -1,6 +1,8 @@
 
+import io
+
 import numpy as np
-from PIL import Image, ImageOps
+from PIL import ExifTags, Image, ImageOps
 
 
 # FINGERPRINT_SIZE can't be a class attribute of ImageDescr, because
@@ -11,6 +13,59 @@ from PIL import Image, ImageOps
 FINGERPRINT_SIZE = (16, 16)
 """Size of the fingerprint thumbnail, in pixels."""
 
+FINGERPRINT_LEN = FINGERPRINT_SIZE[0] * FINGERPRINT_SIZE[1] * 3
+"""Length of a fingerprint, in bytes (one byte per RGB channel)."""
+
+FINGERPRINT_MODES = ('rgb', 'luma')
+"""Kinds of fingerprint.
+
+'rgb' has one byte per channel, interleaved, for FINGERPRINT_LEN bytes.
+'luma' has a single (ITU-R 601-2) luma byte per pixel, for a third of
+that; its quadrants never split the channels of a pixel.
+
+"""
+
+FINGERPRINT_VERSION = 1
+"""Version of the fingerprint algorithm.
+
+Must be increased by any change to the decoding or resizing that alters
+the fingerprints of existing files, so that persistent caches (see
+fpcache) discard the fingerprints they hold.
+
+"""
+
+_MODE_CHANNELS = {'rgb': 3, 'luma': 1}
+"""Number of bytes per pixel of each fingerprint mode."""
+
+_PIXELS = FINGERPRINT_SIZE[0] * FINGERPRINT_SIZE[1]
+"""Number of pixels in a fingerprint."""
+
+
+def fingerprint_len(mode='rgb'):
+    """Get the length in bytes of the fingerprints of a mode.
+
+    Raises ValueError if mode is not one of FINGERPRINT_MODES.
+
+    """
+    if mode not in _MODE_CHANNELS:
+        raise ValueError("unknown fingerprint mode %r" % (mode,))
+
+    return _PIXELS * _MODE_CHANNELS[mode]
+
+
+def fingerprint_mode(length):
+    """Get the mode of fingerprints of a given length in bytes.
+
+    Raises ValueError if no mode has fingerprints of that length.
+
+    """
+    for mode, channels in _MODE_CHANNELS.items():
+        if length == _PIXELS * channels:
+            return mode
+
+    raise ValueError("no fingerprint mode has length %d" % (length,))
+
+
 class ImageDescr(object):
     """Image descriptor.
 
@@ -50,52 +105,291 @@ class ImageDescr(object):
     @staticmethod
     def _calc_fingerprint(filepath):
         """Calculate an image's fingerprint."""
+        return calc_fingerprint(filepath)
+
+
+def calc_fingerprint(filepath, mode='rgb'):
+    """Calculate an image's fingerprint.
+
+    Receives a file name or a file object, and one of FINGERPRINT_MODES.
+    Returns a read-only NumPy array of fingerprint_len(mode) uint8 values.
+
+    This is a module-level function, so that it can be sent to the
+    worker processes of a multiprocessing.Pool.
+
+    """
+    length = fingerprint_len(mode)
+
+    im = open_small(filepath)
+
+    if mode == 'luma':
+        im = im.convert('L')
+
+    im = ImageOps.autocontrast(im, 5)
+    im = im.resize(FINGERPRINT_SIZE, Image.NEAREST)
 
-        im = Image.open(filepath)
+    array = np.frombuffer(im.tobytes(), np.uint8)
+    array.setflags(write=False)
 
-        # TODO: Make sure we always convert to RGB. Image may be grayscale
-        # or RGBA or something else, and we want fingerprints to be
-        # standard in size and shape.
+    im.close()
 
-        im.draft(None, FINGERPRINT_SIZE)
+    assert array.size == length
 
-        im = ImageOps.autocontrast(im, 5)
-        im = im.resize(FINGERPRINT_SIZE, Image.NEAREST)
+    return array
 
-        array = np.fromstring(im.tobytes(), np.uint8)
-        array.setflags(write=False)
 
+def open_small(filepath):
+    """Open an image, decoded as cheaply as possible for a fingerprint.
+
+    Returns an RGB image no smaller than FINGERPRINT_SIZE (unless the
+    image itself is smaller), with the same aspect ratio as the original.
+    The cheapest source is used:
+
+     - the embedded EXIF thumbnail, if there is a usable one
+     - for JPEG, DCT scaling by up to 1/8 while decoding (draft)
+     - otherwise, a full decode
+
+    The result is then reduced by an integer factor (see _reduce), to no
+    less than REDUCED_MIN_SIZE, before any further processing.
+
+    Images with more than 8 bits per sample (see _WIDE_MODES) are scaled to
+    8-bit grayscale first, rather than clipped.
+
+    """
+    im = Image.open(filepath)
+
+    thumbnail = _exif_thumbnail(im)
+    if thumbnail is not None:
         im.close()
+        im = thumbnail
+
+    # a no-op for formats other than JPEG
+    im.draft('RGB', FINGERPRINT_SIZE)
+
+    if im.mode in _WIDE_MODES:
+        im = _to_8bit(im)
+    elif im.mode not in _REDUCE_MODES:
+        im = im.convert('RGB')
+
+    factor = min(im.size[0] // REDUCED_MIN_SIZE[0],
+                 im.size[1] // REDUCED_MIN_SIZE[1])
+    if factor > 1:
+        im = _reduce(im, factor)
 
-        return array
+    if im.mode != 'RGB':
+        im = im.convert('RGB')
+
+    return im
+
+
+def _reduce(im, factor):
+    """Reduce an image by an integer factor, averaging blocks of pixels.
+
+    Uses Image.reduce, which appeared in Pillow 7.0. Older versions,
+    which are the only ones for Python 2, resize the image instead.
+
+    """
+    if hasattr(im, 'reduce'):
+        return im.reduce(factor)
+
+    size = (max(1, im.size[0] // factor), max(1, im.size[1] // factor))
+
+    # BOX is the same filter as reduce, since Pillow 3.4
+    return im.resize(size, Image.BOX if hasattr(Image, 'BOX') else Image.ANTIALIAS)
+
+
+REDUCED_MIN_SIZE = (FINGERPRINT_SIZE[0] * 4, FINGERPRINT_SIZE[1] * 4)
+"""Smallest size that images are reduced to, before being resized to a
+fingerprint. Nearest neighbour resizing from this size samples nearly the
+same points as it would from the full image."""
+
+_REDUCE_MODES = ('L', 'RGB')
+"""Image modes reduced before being converted to RGB."""
+
+_WIDE_MODES = ('I;16', 'I;16L', 'I;16B', 'I;16N', 'I', 'F')
+"""Grayscale image modes with more than 8 bits per sample. Converting them
+directly to RGB clips every value above 255."""
+
+
+def _to_8bit(im):
+    """Scale a grayscale image of one of _WIDE_MODES to an 8-bit 'L' image.
+
+    The 16-bit modes are scaled from their full range. 'I' and 'F' have no
+    fixed range, so their own minimum to maximum is stretched to 0-255 (a
+    flat image becomes black).
+
+    """
+    pixels = np.asarray(im, dtype=np.float32)
+
+    if im.mode.startswith('I;16'):
+        low, high = 0.0, 65535.0
+    else:
+        low, high = float(pixels.min()), float(pixels.max())
+
+    if high > low:
+        pixels = (pixels - low) * (255.0 / (high - low))
+    else:
+        pixels = np.zeros_like(pixels)
+
+    return Image.fromarray(np.rint(pixels).astype(np.uint8))
+
+EXIF_THUMBNAIL_ASPECT_TOLERANCE = 0.05
+"""Maximum relative difference between the aspect ratios of an image and
+its EXIF thumbnail. Thumbnails that differ more (e.g. letterboxed ones)
+are not used."""
+
+_EXIF_HEADER = b'Exif\x00\x00'
+_EXIF_THUMBNAIL_OFFSET = 0x0201
+_EXIF_THUMBNAIL_LENGTH = 0x0202
+
+
+def _exif_thumbnail(im):
+    """Get the embedded EXIF thumbnail of an image.
+
+    Returns the loaded thumbnail, or None if the image has none, or if
+    it's smaller than FINGERPRINT_SIZE, or doesn't have the same aspect
+    ratio as the image.
+
+    """
+    exif = im.info.get('exif')
+    if not exif:
+        return None
+
+    # offsets are relative to the TIFF header, after the JPEG APP1 marker
+    if exif.startswith(_EXIF_HEADER):
+        exif = exif[len(_EXIF_HEADER):]
+
+    try:
+        ifd1 = im.getexif().get_ifd(ExifTags.IFD.IFD1)
+        offset = ifd1[_EXIF_THUMBNAIL_OFFSET]
+        length = ifd1[_EXIF_THUMBNAIL_LENGTH]
+    except (AttributeError, KeyError):
+        # no thumbnail, or a Pillow version without IFD1 support
+        return None
+
+    try:
+        thumbnail = Image.open(io.BytesIO(exif[offset:offset+length]))
+        thumbnail.load()
+    except (IOError, SyntaxError):
+        return None
+
+    width, height = im.size
+    thumb_width, thumb_height = thumbnail.size
+
+    if (thumb_width < FINGERPRINT_SIZE[0] or thumb_height < FINGERPRINT_SIZE[1]
+            or abs(thumb_width * height - thumb_height * width)
+                > EXIF_THUMBNAIL_ASPECT_TOLERANCE * thumb_height * width):
+        thumbnail.close()
+        return None
+
+    return thumbnail
 
 
 class QuadrantAverages(object):
     """Quadrant averages for an image.
 
+    Created with the averages themselves, or with from_sums. In the
+    latter case, the averages are kept as the integer sums of the pixel
+    values of each quadrant, in the smallest unsigned dtype that holds
+    them (see quadrant_sums_dtype), along with the number of pixel values
+    per quadrant. This takes a fraction of the memory of a tuple of
+    floats; the quadrants property calculates the averages when accessed.
+
     This is a lightweight read-only data container class.
 
     """
-    __slots__ = ('_imdesc', '_quadrants')
+    __slots__ = ('_imdesc', '_sums', '_area')
 
     def __init__(self, imdesc, quadrants):
+        self._set(imdesc, np.array(quadrants, np.float64), 1)
+
+    @classmethod
+    def from_sums(cls, imdesc, sums, area):
+        """Create from the sums of the pixel values of each quadrant.
+
+        area is the number of pixel values per quadrant.
+
+        """
+        self = cls.__new__(cls)
+        self._set(imdesc, np.asarray(sums), area)
+
+        return self
+
+    def _set(self, imdesc, sums, area):
+        sums.setflags(write=False)
+
         self._imdesc = imdesc
-        self._quadrants = quadrants
+        self._sums = sums
+        self._area = area
 
     @property
     def imdesc(self): return self._imdesc
 
     @property
-    def quadrants(self): return self._quadrants
+    def sums(self): return self._sums
+
+    @property
+    def area(self): return self._area
+
+    @property
+    def quadrants(self):
+        """Get the tuple of quadrant averages, as floats."""
+        return tuple((self._sums / float(self._area)).tolist())
 
     def __eq__(self, other):
         """Compare with another QuadrantAverages."""
         return (self._imdesc == other._imdesc
-                and self._quadrants == self._quadrants)
+                and self.quadrants == other.quadrants)
+
+    def __ne__(self, other):
+        """Compare with another QuadrantAverages."""
+        return not self == other
 
     def __hash__(self):
         """Return hash(self)."""
-        return hash((self._imdesc, self._quadrants))
+        return hash((self._imdesc, self.quadrants))
+
+
+def _quadrant_shape(n_x, n_y, channels=3):
+    """Get the fingerprint rectangle and quadrant sizes.
+
+    Receives the number of quadrants along the x axis, the number of
+    quadrants along the y axis, and the number of bytes per pixel (3 for
+    'rgb' fingerprints, 1 for 'luma'). Returns the tuple
+    (x, y, quad_x, quad_y), where x and y are the dimensions of the
+    fingerprint when viewed as a 2D rectangle of pixel values, and quad_x
+    and quad_y are the dimensions of each quadrant.
+
+    Raises ValueError if the number of quadrants does not evenly divide
+    the fingerprint along its respective axis.
+
+    """
+    x = FINGERPRINT_SIZE[0]
+    pixel_cols = FINGERPRINT_SIZE[1]
+
+    y = pixel_cols*channels
+
+    quad_x, rem_x = divmod(x, n_x)
+    quad_y, rem_y = divmod(y, n_y)
+
+    if (rem_x != 0):
+        raise ValueError("thumbnail x (%d) does not evenly divide by n_x (%d)"
+                         % (x, n_x))
+    if (rem_y != 0):
+        raise ValueError("thumbnail y (%d) does not evenly divide by n_y (%d)"
+                         % (y, n_y))
+
+    return x, y, quad_x, quad_y
+
+
+def _channels(length):
+    """Get the number of bytes per pixel of fingerprints of a given length."""
+    return _MODE_CHANNELS[fingerprint_mode(length)]
+
+
+def _stack_channels(fingerprints):
+    """Get the number of bytes per pixel of a stack of fingerprints."""
+    return _channels(int(np.prod(fingerprints.shape[1:])))
 
 
 def calc_quadrants(imdesc, n_x, n_y):
@@ -112,28 +406,136 @@ def calc_quadrants(imdesc, n_x, n_y):
     fingerprint size along its respective axis.
 
     """
+    channels = _channels(imdesc.fingerprint.size)
+    x, y, quad_x, quad_y = _quadrant_shape(n_x, n_y, channels)
+
+    assert imdesc.fingerprint.size == x * y
+
+    # split the 2D rectangle of pixel values into quadrants, and add up
+    # the pixels within each one
+    blocks = imdesc.fingerprint.reshape(n_x, quad_x, n_y, quad_y)
+    sums = blocks.sum(axis=(1, 3), dtype=quadrant_sums_dtype(n_x, n_y, channels))
+
+    return QuadrantAverages.from_sums(imdesc, sums.ravel(), quad_x * quad_y)
+
+
+def calc_quadrants_batch(fingerprints, n_x, n_y):
+    """Calculate quadrant averages for many fingerprints at once.
+
+    Receives a stack of N fingerprints, either as an (N, x, y) array of
+    2D pixel rectangles or as an (N, x*y) array of flat fingerprints, the
+    number of quadrants along the x axis, and the number of quadrants
+    along the y axis.
+
+    Returns an (N, n_x*n_y) float array, where row k holds the quadrant
+    averages of fingerprint k, in the same order as calc_quadrants.
+
+    The number of quadrants must be an even divisor of the fingerprint
+    size along its respective axis.
+
+    """
+    fingerprints = np.asarray(fingerprints)
+    count = fingerprints.shape[0]
+
+    x, y, quad_x, quad_y = _quadrant_shape(n_x, n_y, _stack_channels(fingerprints))
+
+    assert fingerprints.size == count * x * y
+
+    # split each rectangle into (row of quadrants, row within quadrant,
+    # column of quadrants, column within quadrant), and reduce over the
+    # pixels within each quadrant
+    blocks = fingerprints.reshape(count, n_x, quad_x, n_y, quad_y)
+
+    return blocks.mean(axis=(2, 4)).reshape(count, n_x * n_y)
+
+
+PYRAMID_LEVELS = ((4, 4), (8, 8), (16, 16))
+"""Quadrant resolutions (n_x, n_y) precalculated for every fingerprint."""
+
+
+def calc_integral_batch(fingerprints):
+    """Calculate the summed-area tables of many fingerprints.
+
+    Receives a stack of N fingerprints, as in calc_quadrants_batch.
+    Returns an (N, x+1, y+1) int32 array, where element [k, i, j] is the
+    sum of the pixel values of fingerprint k in the rectangle [0:i, 0:j].
+
+    """
+    fingerprints = np.asarray(fingerprints)
+    count = fingerprints.shape[0]
+
     x = FINGERPRINT_SIZE[0]
-    pixel_cols = FINGERPRINT_SIZE[1]
+    y = FINGERPRINT_SIZE[1] * _stack_channels(fingerprints)
 
-    y = pixel_cols*3
+    integral = np.zeros((count, x + 1, y + 1), np.int32)
+    np.cumsum(fingerprints.reshape(count, x, y), axis=1, dtype=np.int32,
+              out=integral[:, 1:, 1:])
+    np.cumsum(integral[:, 1:, 1:], axis=2, out=integral[:, 1:, 1:])
 
-    assert imdesc.fingerprint.size == x * y
+    return integral
 
-    quad_x, rem_x = divmod(x, n_x)
-    quad_y, rem_y = divmod(y, n_y)
 
-    if (rem_x != 0):
-        raise ValueError("thumbnail x (%d) does not evenly divide by n_x (%d)"
-                         % (x, n_x))
-    if (rem_y != 0):
-        raise ValueError("thumbnail y (%d) does not evenly divide by n_y (%d)"
-                         % (y, n_y))
+def quadrant_sums_from_integral(integral, n_x, n_y):
+    """Calculate quadrant sums from summed-area tables.
 
-    # reshape into a 2D rectangle of pixel values
-    rect = imdesc.fingerprint.reshape(x, y)
+    Receives an array of summed-area tables, as returned by
+    calc_integral_batch, and the number of quadrants along each axis.
+    Returns an (N, n_x*n_y) array with the sum of the pixel values within
+    each quadrant, in the same order as calc_quadrants. Each sum takes
+    four lookups, whatever the size of the quadrant.
 
-    quadrants = tuple(rect[i:i+quad_x, j:j+quad_y].mean()
-                        for i in range(0, x, quad_x)
-                        for j in range(0, y, quad_y))
+    """
+    channels = _channels((integral.shape[1] - 1) * (integral.shape[2] - 1))
+    x, y, quad_x, quad_y = _quadrant_shape(n_x, n_y, channels)
+
+    corners = integral[:, ::quad_x, ::quad_y]
+    sums = (corners[:, 1:, 1:] - corners[:, :-1, 1:]
+            - corners[:, 1:, :-1] + corners[:, :-1, :-1])
+
+    return sums.reshape(len(integral), n_x * n_y)
+
+
+def calc_pyramid_batch(fingerprints, levels=PYRAMID_LEVELS):
+    """Calculate the quadrant sums of many fingerprints, at many resolutions.
+
+    Receives a stack of N fingerprints, as in calc_quadrants_batch, and a
+    sequence of (n_x, n_y) resolutions. A single summed-area table is
+    calculated per fingerprint, and every resolution is derived from it.
+
+    Returns a dict mapping each (n_x, n_y) to an (N, n_x*n_y) array of
+    quadrant sums, of the smallest unsigned type that holds them (see
+    quadrant_sums_dtype). Dividing the sums by the number of pixel values
+    per quadrant gives the same averages as calc_quadrants_batch.
+
+    """
+    fingerprints = np.asarray(fingerprints)
+    channels = _stack_channels(fingerprints)
+    integral = calc_integral_batch(fingerprints)
+
+    return {(n_x, n_y): quadrant_sums_from_integral(integral, n_x, n_y).astype(
+                quadrant_sums_dtype(n_x, n_y, channels))
+            for n_x, n_y in levels}
+
+
+def quadrant_sums_dtype(n_x, n_y, channels=3):
+    """Get the smallest unsigned type that holds the sums of a quadrant.
+
+    Receives the number of quadrants along each axis, and the number of
+    bytes per pixel of the fingerprints, as in _quadrant_shape.
+
+    """
+    x, y, quad_x, quad_y = _quadrant_shape(n_x, n_y, channels)
+
+    return np.min_scalar_type(quad_x * quad_y * 255)
+
+
+def quadrants_from_sums(sums, n_x, n_y, channels=3):
+    """Get quadrant averages from quadrant sums, as in calc_quadrants_batch.
+
+    Receives the sums, the number of quadrants along each axis, and the
+    number of bytes per pixel of the fingerprints they were taken from.
+
+    """
+    x, y, quad_x, quad_y = _quadrant_shape(n_x, n_y, channels)
 
-    return QuadrantAverages(imdesc, quadrants)
+    return sums / float(quad_x * quad_y)
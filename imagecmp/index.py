@@ -0,0 +1,446 @@
+
+# ImageCmp - find similar images among many
+# Copyright (C) 2009,2017 Israel G. Lugo
+#
+# This file is part of ImageCmp.
+#
+# ImageCmp is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# ImageCmp is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with ImageCmp. If not, see <http://www.gnu.org/licenses/>.
+#
+# For suggestions, feedback or bug reports: israel.lugo@lugosys.com
+
+
+"""This module implements an incremental similarity index.
+
+The index keeps the fingerprints of a library of images, and their 4x4
+and 16x16 quadrant sums, in buffers that double their capacity when
+full. For each 4x4 quadrant, the sums are also kept sorted, so that the
+images within tolerance of a given value can be found by binary search.
+
+The sorted quadrants are kept in runs: each batch of new images becomes
+a run of its own, and consecutive runs of similar sizes are merged, so
+that there are only about log2(N) runs. Removed images are only marked
+as such, and dropped when half of the rows are removed ones.
+
+Adding B images thus costs amortized O(B log N) time to store them,
+rather than time proportional to the size N of the library. Finding the
+images similar to them costs time proportional to the number of
+candidates in the binary search ranges. For libraries where many images
+have close 4x4 quadrant averages, that grows with N.
+
+"""
+
+
+import numpy as np
+
+from imagecmp import compare
+from imagecmp import imagedescr
+from imagecmp import setops
+
+
+NQUADS_X = 4
+"""Number of quadrants along the x axis, for the indexed quadrants."""
+
+NQUADS_Y = 4
+"""Number of quadrants along the y axis, for the indexed quadrants."""
+
+REFINE_QUADS = (16, 16)
+"""Quadrants (n_x, n_y) that the indexed candidates are confirmed with."""
+
+_LEVELS = ((NQUADS_X, NQUADS_Y), REFINE_QUADS)
+"""Quadrant resolutions whose sums are kept for every image."""
+
+EXTRA_PROBES = 3
+"""Number of quadrant ranges probed beyond the minimum, per image.
+
+Each extra range probed makes the candidates be found in one more range,
+which rules out many more of them than it adds.
+
+"""
+
+_MIN_CAPACITY = 64
+"""Smallest number of rows allocated for the buffers."""
+
+_QUERY_CHUNK = 256
+"""Number of images whose candidates are looked up at once."""
+
+_PAIR_CHUNK = 1 << 16
+"""Number of candidate pairs whose quadrants are compared at once."""
+
+
+class SimilarityIndex(object):
+    """Incremental index of similar images.
+
+    Images are added and removed by file path. Two images are similar if
+    they are similar by both their 4x4 and their 16x16 quadrants (see
+    compare.similar_mask).
+
+    """
+
+    def __init__(self, tolerance):
+        """Create an empty index, for a tolerance value within 0 and 255."""
+        self._tolerance = tolerance
+
+        # file path of each row, or None for removed rows
+        self._filepaths = []
+        self._rows = {}
+        self._size = 0
+
+        self._fingerprints = np.empty((0, imagedescr.FINGERPRINT_LEN), np.uint8)
+        self._sums = dict(((n_x, n_y), np.empty((0, n_x * n_y),
+                                                imagedescr.quadrant_sums_dtype(n_x, n_y)))
+                          for n_x, n_y in _LEVELS)
+        self._live = np.empty(0, bool)
+
+        # runs of (values, rows), with the (nquads, m) sorted 4x4 quadrant
+        # sums of m images, and the row of the image of each value;
+        # older (and larger) runs first
+        self._runs = []
+
+    @property
+    def tolerance(self):
+        """Get the tolerance value of the index."""
+        return self._tolerance
+
+    @property
+    def filepaths(self):
+        """Get a tuple with the file paths of the indexed images."""
+        return tuple(f for f in self._filepaths if f is not None)
+
+    def __len__(self):
+        """Return the number of indexed images."""
+        return len(self._rows)
+
+    def __contains__(self, filepath):
+        """Return True if filepath is indexed."""
+        return filepath in self._rows
+
+    def add(self, filepaths, pool=None):
+        """Fingerprint image files and add them to the index.
+
+        Receives an iterable of file paths and, optionally, a
+        multiprocessing.Pool object to parallelize the fingerprinting.
+        Files already in the index are updated.
+
+        Returns a list of the groups affected by the new images. Each
+        group is a frozenset holding a new image and the images similar
+        to it (new or previously indexed).
+
+        """
+        filepaths = list(filepaths)
+
+        if pool is not None:
+            fingerprints = pool.map(imagedescr.calc_fingerprint, filepaths)
+        else:
+            fingerprints = [imagedescr.calc_fingerprint(f) for f in filepaths]
+
+        return self.add_fingerprints(filepaths, fingerprints)
+
+    def add_fingerprints(self, filepaths, fingerprints):
+        """Add images with already calculated fingerprints to the index.
+
+        Receives a sequence of file paths, and a matching sequence of
+        fingerprints. Returns the affected groups, like add().
+
+        """
+        filepaths = list(filepaths)
+        if not filepaths:
+            return []
+
+        # the last occurrence of each path wins, as if added one by one
+        latest = dict((filepath, k) for k, filepath in enumerate(filepaths))
+        keep = sorted(latest.values())
+        filepaths = [filepaths[k] for k in keep]
+        fingerprints = np.asarray(fingerprints, np.uint8).reshape(
+                -1, imagedescr.FINGERPRINT_LEN)[keep]
+
+        self.remove(f for f in filepaths if f in self._rows)
+
+        new_rows = self._append(filepaths, fingerprints)
+        self._add_run(new_rows)
+
+        groups = []
+        for row, similar in zip(new_rows.tolist(), self._find_similar(new_rows)):
+            similar = similar[similar != row]
+            if len(similar):
+                groups.append(frozenset([self._filepaths[row]]
+                                        + [self._filepaths[i] for i in similar]))
+
+        return groups
+
+    def remove(self, filepaths):
+        """Remove images from the index.
+
+        Receives an iterable of file paths. Paths that aren't indexed are
+        ignored. The rows of the removed images are only marked as such,
+        until half of the rows are removed ones.
+
+        """
+        removed = [self._rows.pop(f) for f in set(filepaths) if f in self._rows]
+        if not removed:
+            return
+
+        self._live[removed] = False
+        for row in removed:
+            self._filepaths[row] = None
+
+        if self._size - len(self._rows) > max(len(self._rows), _MIN_CAPACITY):
+            self._compact()
+
+    def query(self, filepath):
+        """Find the indexed images similar to an image.
+
+        filepath may or may not be indexed. If it isn't, it is
+        fingerprinted (but not added to the index).
+
+        Returns a frozenset with the paths of the similar images, not
+        including filepath itself.
+
+        """
+        row = self._rows.get(filepath)
+        if row is not None:
+            similar = self._find_similar(np.array([row]))[0]
+            return frozenset(self._filepaths[i] for i in similar if i != row)
+
+        return self.query_fingerprint(imagedescr.calc_fingerprint(filepath)) - {filepath}
+
+    def query_fingerprint(self, fingerprint):
+        """Find the indexed images similar to a fingerprint.
+
+        Returns a frozenset with the paths of the similar images.
+
+        """
+        fingerprints = np.asarray(fingerprint, np.uint8).reshape(1, -1)
+        pyramid = imagedescr.calc_pyramid_batch(fingerprints, _LEVELS)
+
+        similar = self._find_similar_sums([pyramid[level] for level in _LEVELS])[0]
+
+        return frozenset(self._filepaths[i] for i in similar)
+
+    def save(self, filename):
+        """Save the index to a file."""
+        rows = self._live_rows()
+        with open(filename, 'wb') as f:
+            np.savez(f, tolerance=self._tolerance,
+                     filepaths=np.array([self._filepaths[row] for row in rows],
+                                        dtype=np.str_),
+                     fingerprints=self._fingerprints[rows])
+
+    @classmethod
+    def load(cls, filename):
+        """Load an index previously saved to a file."""
+        with np.load(filename) as data:
+            index = cls(data['tolerance'].item())
+            index.add_fingerprints(data['filepaths'].tolist(), data['fingerprints'])
+
+        return index
+
+    def _live_rows(self):
+        """Get the array of rows of images that weren't removed."""
+        return np.flatnonzero(self._live[:self._size])
+
+    def _append(self, filepaths, fingerprints):
+        """Append new images to the rows, and return their row numbers."""
+        start = self._size
+        end = start + len(filepaths)
+
+        if end > len(self._live):
+            self._reserve(max(_MIN_CAPACITY, 2 * len(self._live), end))
+
+        pyramid = imagedescr.calc_pyramid_batch(fingerprints, _LEVELS)
+
+        self._fingerprints[start:end] = fingerprints
+        for level, sums in pyramid.items():
+            self._sums[level][start:end] = sums
+        self._live[start:end] = True
+
+        self._filepaths.extend(filepaths)
+        self._rows.update((f, row) for row, f in enumerate(filepaths, start))
+        self._size = end
+
+        return np.arange(start, end)
+
+    def _reserve(self, capacity):
+        """Reallocate the row buffers with a given capacity."""
+        def resized(array):
+            result = np.empty((capacity,) + array.shape[1:], array.dtype)
+            result[:self._size] = array[:self._size]
+            return result
+
+        self._fingerprints = resized(self._fingerprints)
+        self._sums = dict((level, resized(sums)) for level, sums in self._sums.items())
+        self._live = resized(self._live)
+
+    def _compact(self):
+        """Drop the removed rows, and renumber the others to fill the gaps."""
+        rows = self._live_rows()
+
+        self._fingerprints = self._fingerprints[rows]
+        self._sums = dict((level, sums[rows]) for level, sums in self._sums.items())
+        self._live = np.ones(len(rows), bool)
+        self._filepaths = [self._filepaths[row] for row in rows]
+        self._rows = dict((f, row) for row, f in enumerate(self._filepaths))
+        self._size = len(rows)
+
+        self._runs = []
+        if len(rows):
+            self._add_run(np.arange(len(rows)))
+
+    def _add_run(self, rows):
+        """Add the 4x4 quadrants of new rows to the sorted runs.
+
+        Merges the newest runs while the older one isn't more than twice
+        the size of the newer one, dropping the removed rows. Each row is
+        thus merged about log2(N) times.
+
+        """
+        self._runs.append(self._sorted_run(rows))
+
+        while (len(self._runs) > 1
+               and self._runs[-2][1].shape[1] <= 2 * self._runs[-1][1].shape[1]):
+            newer = self._runs.pop()
+            older = self._runs.pop()
+
+            rows = np.concatenate((older[1][0], newer[1][0]))
+            self._runs.append(self._sorted_run(rows[self._live[rows]]))
+
+    def _sorted_run(self, rows):
+        """Sort the 4x4 quadrant sums of some rows into a run."""
+        sums = self._sums[_LEVELS[0]][rows]
+        order = np.argsort(sums, axis=0, kind='mergesort')
+
+        return sums[order, np.arange(sums.shape[1])].T, rows[order].T
+
+    def _find_similar(self, rows):
+        """Find the indexed images similar to each of several indexed ones.
+
+        Receives an array of B rows. Returns a list of B arrays of rows,
+        including the rows themselves.
+
+        """
+        return self._find_similar_sums([self._sums[level][rows] for level in _LEVELS])
+
+    def _find_similar_sums(self, sums):
+        """Find the indexed images similar to each of several images.
+
+        Receives a list with the (B, n_x*n_y) quadrant sums of B images,
+        for each of _LEVELS. Returns a list of B arrays of rows.
+
+        """
+        results = []
+        for start in range(0, len(sums[0]), _QUERY_CHUNK):
+            results.extend(self._find_similar_chunk(
+                    [level_sums[start:start + _QUERY_CHUNK] for level_sums in sums]))
+
+        return results
+
+    def _find_similar_chunk(self, sums):
+        """Find the indexed images similar to a chunk of images, at once."""
+        count = len(sums[0])
+        size = max(self._size, 1)
+
+        # (image, row) candidate pairs, from every run
+        images, rows, min_hits = self._candidates(sums[0])
+
+        # drop the removed rows, and the rows found in too few probes; keep
+        # one of each of the others
+        live = self._live[rows]
+        keys = np.sort(images[live] * size + rows[live])
+        if not len(keys):
+            return [np.empty(0, np.intp) for k in range(count)]
+
+        firsts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1], [True])))
+        keys = keys[firsts[:-1][np.diff(firsts) >= min_hits]]
+
+        similar = []
+        for start in range(0, len(keys), _PAIR_CHUNK):
+            chunk = keys[start:start + _PAIR_CHUNK]
+            images, rows = chunk // size, chunk % size
+
+            for level, level_sums in zip(_LEVELS, sums):
+                mask = _similar_sums_mask(level_sums[images], self._sums[level][rows],
+                                          self._tolerance * _quadrant_area(level))
+                images, rows = images[mask], rows[mask]
+
+            similar.append((images, rows))
+
+        images = np.concatenate([images for images, rows in similar] + [[]]).astype(np.intp)
+        rows = np.concatenate([rows for images, rows in similar] + [[]]).astype(np.intp)
+
+        # the keys were sorted by image
+        return np.split(rows, np.cumsum(np.bincount(images, minlength=count))[:-1])
+
+    def _candidates(self, sums):
+        """Find the candidates within range of a chunk of images.
+
+        Receives the (B, nquads) 4x4 quadrant sums of B images. Returns the
+        tuple (images, rows, min_hits), where images and rows are arrays of
+        candidate pairs, one for each range a row was found in, and a
+        similar pair is found in at least min_hits ranges.
+
+        """
+        limit = self._tolerance * _quadrant_area(_LEVELS[0])
+        count, nquads = sums.shape
+        min_similar_quads = int(nquads * compare.SIMILAR_QUADS_RATIO)
+        sums = sums.astype(np.int64)
+
+        # A similar image must match at least min_similar_quads quadrants,
+        # so it can fail at most (nquads - min_similar_quads) of them. It
+        # must therefore be within range on at least (k + 1) of any
+        # (nquads - min_similar_quads + 1 + k) quadrants; we pick the ones
+        # with the narrowest ranges, in each run.
+        max_failed = nquads - min_similar_quads
+        nprobe = min(nquads, max_failed + 1 + EXTRA_PROBES)
+
+        images = [np.empty(0, np.intp)]
+        rows = [np.empty(0, np.intp)]
+
+        for values, run_rows in self._runs:
+            lo = np.empty(sums.shape, np.intp)
+            hi = np.empty(sums.shape, np.intp)
+            for n in range(nquads):
+                lo[:, n] = np.searchsorted(values[n], sums[:, n] - limit, 'left')
+                hi[:, n] = np.searchsorted(values[n], sums[:, n] + limit, 'right')
+
+            narrowest = np.argsort(hi - lo, axis=1)[:, :nprobe]
+            images_column = np.arange(len(sums))[:, np.newaxis]
+            starts = lo[images_column, narrowest].ravel()
+            sizes = hi[images_column, narrowest].ravel() - starts
+
+            positions = setops.expand_ranges(starts, sizes)
+            columns = np.repeat(narrowest.ravel(), sizes)
+
+            rows.append(run_rows[columns, positions])
+            images.append(np.repeat(np.repeat(np.arange(count), nprobe), sizes))
+
+        return np.concatenate(images), np.concatenate(rows), nprobe - max_failed
+
+
+def _quadrant_area(level):
+    """Get the number of pixel values in a quadrant, at one of _LEVELS."""
+    n_x, n_y = level
+    return imagedescr.FINGERPRINT_LEN // (n_x * n_y)
+
+
+def _similar_sums_mask(base_sums, sums, limit):
+    """Row by row compare.similar_mask, of two (M, nquads) arrays of sums.
+
+    Two quadrant averages are within tolerance if their sums are within
+    limit, the tolerance times the number of pixel values in a quadrant.
+
+    """
+    min_similar_quads = int(sums.shape[1] * compare.SIMILAR_QUADS_RATIO)
+
+    diffs = np.abs(base_sums.astype(np.int32) - sums.astype(np.int32))
+
+    return (diffs <= limit).sum(axis=1) >= min_similar_quads
@@ -0,0 +1,335 @@
+# ImageCmp - find similar images among many
+# Copyright (C) 2009,2017 Israel G. Lugo
+#
+# This file is part of ImageCmp.
+#
+# ImageCmp is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# ImageCmp is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with ImageCmp. If not, see <http://www.gnu.org/licenses/>.
+#
+# For suggestions, feedback or bug reports: israel.lugo@lugosys.com
+
+
+"""This module implements the instrumentation of the comparison pipeline.
+
+The pipeline reports what it does through three calls: timed(name), a
+context manager around each part of the work; count(name, value), for
+counters; and histogram(name, sizes), for distributions of sizes. The
+events are passed on to the active listeners (see listening). With no
+listeners, each call only tests a global, so the instrumentation is
+always in place.
+
+A Recorder is a listener that aggregates the events into a report, which
+can be serialized to JSON:
+
+    with instrument.listening(instrument.Recorder()) as recorder:
+        compare.findsimilar(filenames, 20)
+    print(recorder.to_json())
+
+Listeners only see the events of their own process. Work sent to worker
+processes is timed as a whole, by the part of the pipeline waiting for it.
+
+"""
+
+
+import contextlib
+import cProfile
+import json
+import pstats
+import sys
+import threading
+import time
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+PROFILE_LIMIT = 20
+"""Default number of functions in the report of each profiled timer."""
+
+
+_listeners = ()
+"""The active listeners, innermost last."""
+
+
+class Listener(object):
+    """Base listener, which ignores every event.
+
+    Subclasses override the events they're interested in. Timers that
+    are nested within others start after and stop before them.
+
+    """
+
+    def start(self, name):
+        """A timer is starting."""
+
+    def stop(self, name, seconds):
+        """A timer stopped, after the given number of seconds."""
+
+    def count(self, name, value):
+        """A counter is incremented by value."""
+
+    def histogram(self, name, sizes):
+        """Sizes were observed, as an array of integers."""
+
+
+@contextlib.contextmanager
+def listening(*listeners):
+    """Send the events to some listeners, within a with block.
+
+    The listeners are added to those already active, and removed at the
+    end of the block. Yields the first listener.
+
+    """
+    global _listeners
+
+    previous = _listeners
+    _listeners = previous + listeners
+
+    try:
+        yield listeners[0] if listeners else None
+    finally:
+        _listeners = previous
+
+
+def enabled():
+    """Return True if there are active listeners.
+
+    Callers check this before doing extra work only to report it.
+
+    """
+    return bool(_listeners)
+
+
+def timed(name):
+    """Return a context manager that times its block, as timer name."""
+    if not _listeners:
+        return _NULL_TIMER
+
+    return _Timer(name, _listeners)
+
+
+def count(name, value=1):
+    """Increment counter name by value."""
+    if _listeners:
+        for listener in _listeners:
+            listener.count(name, value)
+
+
+def histogram(name, sizes):
+    """Add an iterable of integer sizes to histogram name."""
+    if _listeners:
+        if not isinstance(sizes, np.ndarray):
+            sizes = np.fromiter(sizes, np.int64)
+        for listener in _listeners:
+            listener.histogram(name, sizes)
+
+
+class _NullTimer(object):
+    """Context manager that does nothing, for when no one is listening."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer(object):
+    """Context manager that sends the start and stop of a timer."""
+    __slots__ = ('_name', '_listeners', '_start')
+
+    def __init__(self, name, listeners):
+        self._name = name
+        self._listeners = listeners
+        self._start = None
+
+    def __enter__(self):
+        for listener in self._listeners:
+            listener.start(self._name)
+        self._start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.time() - self._start
+        for listener in reversed(self._listeners):
+            listener.stop(self._name, seconds)
+        return False
+
+
+def peak_memory():
+    """Get the peak resident memory of this process so far, in bytes.
+
+    Returns None where the resource module is not available.
+
+    """
+    if resource is None:
+        return None
+
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # bytes on macOS, kilobytes elsewhere
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+class Recorder(Listener):
+    """Listener that aggregates the events into a report.
+
+    For each timer, records the number of calls, the total seconds, the
+    self seconds (excluding nested timers), and the peak memory of the
+    process when it last stopped. Counters are added up. Histograms count
+    the sizes in power-of-two buckets, named by their lower bound.
+
+    profile is a collection of timer names to run under cProfile; the
+    report lists the profile_limit functions with the highest cumulative
+    time of each one. A timer nested within a profiled one is not
+    profiled separately.
+
+    Events may come from several threads, e.g. with a ThreadExecutor.
+    Timers nest within the timers of their own thread only; time spent
+    by other threads isn't subtracted from the self seconds.
+
+    """
+
+    def __init__(self, profile=(), profile_limit=PROFILE_LIMIT):
+        self._profile = frozenset(profile)
+        self._profile_limit = profile_limit
+        self._timers = {}
+        self._counters = {}
+        self._histograms = {}
+        self._profiles = {}
+        self._lock = threading.Lock()
+        # the running timers of each thread
+        self._local = threading.local()
+        # only one profiler runs at a time, in the thread that started it
+        self._profiler = None
+        self._profiled_name = None
+        self._profiled_thread = None
+
+    def _nested(self):
+        """Get the stack of running timers of the calling thread."""
+        try:
+            return self._local.nested
+        except AttributeError:
+            self._local.nested = []
+            return self._local.nested
+
+    def start(self, name):
+        self._nested().append(0.0)
+
+        if name in self._profile:
+            with self._lock:
+                if self._profiler is not None:
+                    return
+                self._profiler = cProfile.Profile()
+                self._profiled_name = name
+                self._profiled_thread = threading.current_thread()
+            self._profiler.enable()
+
+    def stop(self, name, seconds):
+        if (self._profiled_thread is threading.current_thread()
+                and name == self._profiled_name):
+            self._profiler.disable()
+            with self._lock:
+                if name in self._profiles:
+                    self._profiles[name].add(self._profiler)
+                else:
+                    self._profiles[name] = pstats.Stats(self._profiler)
+                self._profiler = None
+                self._profiled_name = None
+                self._profiled_thread = None
+
+        stack = self._nested()
+        nested = stack.pop()
+        if stack:
+            stack[-1] += seconds
+
+        memory = peak_memory()
+        with self._lock:
+            timer = self._timers.setdefault(
+                    name, {'calls': 0, 'seconds': 0.0, 'self_seconds': 0.0})
+            timer['calls'] += 1
+            timer['seconds'] += seconds
+            timer['self_seconds'] += seconds - nested
+            timer['peak_memory'] = memory
+
+    def count(self, name, value):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def histogram(self, name, sizes):
+        sizes = np.asarray(sizes, np.int64)
+        sizes = sizes[sizes > 0]
+        if not len(sizes):
+            return
+
+        # bucket k holds the sizes in [2**k, 2**(k+1))
+        buckets = np.bincount(np.frexp(sizes)[1] - 1)
+
+        with self._lock:
+            counts = self._histograms.get(name, np.zeros(0, np.int64))
+            if len(counts) < len(buckets):
+                counts = np.concatenate((counts, np.zeros(len(buckets) - len(counts), np.int64)))
+            counts[:len(buckets)] += buckets
+            self._histograms[name] = counts
+
+    def report(self):
+        """Get the report, as a dictionary of JSON-serializable values.
+
+        The dictionary has the keys 'timers', 'counters', 'histograms',
+        'profiles' and 'peak_memory' (in bytes, or None if unknown).
+
+        """
+        with self._lock:
+            return self._report()
+
+    def _report(self):
+        """Get the report, with the lock held."""
+        return {
+            'timers': {name: dict(timer) for name, timer in self._timers.items()},
+            'counters': dict(self._counters),
+            'histograms': {
+                name: {str(2**k): int(n) for k, n in enumerate(counts) if n}
+                for name, counts in self._histograms.items()
+            },
+            'profiles': {name: _top_functions(stats, self._profile_limit)
+                         for name, stats in self._profiles.items()},
+            'peak_memory': peak_memory(),
+        }
+
+    def to_json(self, **kwargs):
+        """Get the report as a JSON string.
+
+        Keyword arguments are passed on to json.dumps.
+
+        """
+        return json.dumps(self.report(), sort_keys=True, **kwargs)
+
+
+def _top_functions(stats, limit):
+    """List the functions with the highest cumulative time in a pstats.Stats."""
+    entries = sorted(stats.stats.items(), key=lambda entry: entry[1][3], reverse=True)
+
+    return [{
+                'function': "%s:%d(%s)" % key,
+                'calls': calls,
+                'seconds': tottime,
+                'cumulative_seconds': cumtime,
+            }
+            for key, (primitive, calls, tottime, cumtime, callers) in entries[:limit]]
@@ -0,0 +1,340 @@
+
+# ImageCmp - find similar images among many
+# Copyright (C) 2009,2017 Israel G. Lugo
+#
+# This file is part of ImageCmp.
+#
+# ImageCmp is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# ImageCmp is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with ImageCmp. If not, see <http://www.gnu.org/licenses/>.
+#
+# For suggestions, feedback or bug reports: israel.lugo@lugosys.com
+
+
+"""This module implements a columnar store of image fingerprints."""
+
+
+import numpy as np
+
+from imagecmp import decode
+from imagecmp import executor
+from imagecmp import imagedescr
+from imagecmp import instrument
+from imagecmp import pathtable
+from imagecmp import sharedarray
+
+
+class FingerprintMatrix(object):
+    """Columnar store of image fingerprints.
+
+    Holds the fingerprints of many images in a single contiguous uint8
+    matrix, with one row per image, plus a pathtable.PathTable of file
+    paths. Images are identified by their integer row index. The
+    fingerprints are all of the same mode (see imagedescr.FINGERPRINT_MODES).
+
+    This is a lightweight read-only data container class.
+
+    """
+    __slots__ = ('_fingerprints', '_filepaths', '_shared', '_pyramid')
+
+    def __init__(self, fingerprints, filepaths):
+        """Create a FingerprintMatrix.
+
+        Receives an (N, fingerprint_len(mode)) array of fingerprints of
+        any mode, and a sequence of N file paths, such that filepaths[k] is the path of
+        the image whose fingerprint is fingerprints[k].
+
+        The quadrant sums of every resolution in imagedescr.PYRAMID_LEVELS
+        are calculated here, once, and kept alongside the fingerprints.
+
+        """
+        if not isinstance(filepaths, pathtable.PathTable):
+            filepaths = pathtable.PathTable(filepaths)
+        fingerprints = np.ascontiguousarray(fingerprints, dtype=np.uint8)
+
+        if (fingerprints.ndim != 2 or len(fingerprints) != len(filepaths)
+                or fingerprints.shape[1] not in _MODE_LENGTHS):
+            raise ValueError("fingerprints shape %r does not match %d paths"
+                             % (fingerprints.shape, len(filepaths)))
+
+        fingerprints.setflags(write=False)
+
+        self._fingerprints = fingerprints
+        self._filepaths = filepaths
+        self._shared = None
+        self._pyramid = _calc_pyramid(fingerprints)
+
+    @classmethod
+    def from_descriptors(cls, img_descriptors):
+        """Create a FingerprintMatrix from an iterable of ImageDescr."""
+        img_descriptors = list(img_descriptors)
+
+        fingerprints = np.empty((len(img_descriptors), imagedescr.FINGERPRINT_LEN),
+                                np.uint8)
+        for row, im in enumerate(img_descriptors):
+            fingerprints[row] = im.fingerprint
+
+        return cls(fingerprints, [im.filepath for im in img_descriptors])
+
+    @classmethod
+    def from_files(cls, filenames, pool, cache=None, mode='rgb'):
+        """Create a FingerprintMatrix by fingerprinting image files.
+
+        Receives a sequence of file names, a multiprocessing.Pool or
+        executor to parallelize the work, and optionally a FingerprintCache. Files
+        with a valid cached fingerprint are not decoded; the fingerprints
+        of the remaining files are calculated by the pool, and stored in
+        the cache. The fingerprints are of the given mode, which must be
+        that of the cache.
+
+        The matrix is backed by a SharedArray: the workers receive only
+        row numbers and file names, and write the fingerprints in place.
+        Call close() to release it.
+
+        """
+        filenames = list(filenames)
+
+        shared = sharedarray.SharedArray(
+                (len(filenames), imagedescr.fingerprint_len(mode)), np.uint8)
+
+        try:
+            fingerprints = shared.array
+
+            missing_rows = _fill_cached(fingerprints, filenames, cache)
+
+            with instrument.timed('decode'):
+                chunksize = max(1, len(missing_rows) // (4 * _pool_size(pool)))
+                tasks = [
+                        (shared, rows, [filenames[row] for row in rows])
+                        for rows in _chunks(missing_rows, chunksize)
+                ]
+                executor.map_work(pool, _fingerprint_rows, tasks, len(missing_rows))
+
+            _store_missing(fingerprints, filenames, missing_rows, cache)
+            instrument.count('ipc.shared_bytes', fingerprints.nbytes)
+
+            fpmatrix = cls(fingerprints, filenames)
+        except Exception:
+            shared.close()
+            raise
+
+        fpmatrix._shared = shared
+
+        return fpmatrix
+
+    @classmethod
+    def from_files_threaded(cls, filenames, cache=None, decode_threads=None,
+                            mode='rgb'):
+        """Create a FingerprintMatrix by fingerprinting image files.
+
+        Like from_files, but the files are fingerprinted in this process,
+        by the threaded pipeline of decode.decode_fingerprints, with
+        decode_threads decoding threads. The fingerprints are written
+        straight into the matrix, so no shared storage is needed.
+
+        """
+        filenames = list(filenames)
+
+        fingerprints = np.empty((len(filenames), imagedescr.fingerprint_len(mode)),
+                                np.uint8)
+
+        missing_rows = _fill_cached(fingerprints, filenames, cache)
+
+        with instrument.timed('decode'):
+            decode.decode_fingerprints(
+                    fingerprints, missing_rows,
+                    [filenames[row] for row in missing_rows],
+                    decode_threads=decode_threads)
+
+        _store_missing(fingerprints, filenames, missing_rows, cache)
+
+        return cls(fingerprints, filenames)
+
+    @property
+    def fingerprints(self):
+        """Get the (N, fingerprint_len(mode)) matrix of fingerprints."""
+        return self._fingerprints
+
+    @property
+    def mode(self):
+        """Get the mode of the fingerprints, one of FINGERPRINT_MODES."""
+        return _MODE_LENGTHS[self._fingerprints.shape[1]]
+
+    @property
+    def filepaths(self):
+        """Get the PathTable of file paths, indexed by row."""
+        return self._filepaths
+
+    def __len__(self):
+        """Return the number of images."""
+        return len(self._filepaths)
+
+    def fingerprint(self, index):
+        """Get the fingerprint of the image at a given row."""
+        return self._fingerprints[index]
+
+    def filepath(self, index):
+        """Get the file path of the image at a given row."""
+        return self._filepaths[index]
+
+    def quadrants(self, indices, n_x, n_y):
+        """Get the quadrant averages of the images at some rows.
+
+        Receives an array of row indices, and the number of quadrants
+        along each axis. Returns the same array as calc_quadrants_batch
+        on their fingerprints. Resolutions in imagedescr.PYRAMID_LEVELS
+        come from the precalculated sums; others are calculated.
+
+        """
+        with instrument.timed('quadrants'):
+            sums = self._pyramid.get((n_x, n_y))
+            if sums is None:
+                return imagedescr.calc_quadrants_batch(self._fingerprints[indices], n_x, n_y)
+
+            return imagedescr.quadrants_from_sums(sums[indices], n_x, n_y,
+                                                  _channels(self._fingerprints))
+
+    def quadrant_sums(self, indices, n_x, n_y):
+        """Get the quadrant sums of the images at some rows.
+
+        Receives the same arguments as quadrants. Returns the tuple
+        (sums, area), where sums is an array of integer quadrant sums, of
+        the smallest type that holds them, and area is the number of pixel
+        values per quadrant: sums / float(area) are the quadrant averages.
+
+        """
+        sums = self._pyramid.get((n_x, n_y))
+        if sums is None:
+            sums = imagedescr.calc_pyramid_batch(
+                    self._fingerprints[indices], [(n_x, n_y)])[n_x, n_y]
+        else:
+            sums = sums[indices]
+
+        return sums, self._fingerprints.shape[1] // (n_x * n_y)
+
+    def close(self):
+        """Release the shared storage backing the matrix, if any.
+
+        The matrix must not be used after being closed.
+
+        """
+        if self._shared is not None:
+            self._fingerprints = None
+            self._shared.close()
+            self._shared = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+_MODE_LENGTHS = {imagedescr.fingerprint_len(mode): mode
+                 for mode in imagedescr.FINGERPRINT_MODES}
+"""Fingerprint modes, by their fingerprint length."""
+
+
+def _channels(fingerprints):
+    """Get the number of bytes per pixel of a matrix of fingerprints."""
+    return fingerprints.shape[1] // (imagedescr.FINGERPRINT_SIZE[0]
+                                     * imagedescr.FINGERPRINT_SIZE[1])
+
+
+def _chunks(seq, size):
+    """Split a sequence into consecutive slices of the given size."""
+    return [seq[i:i+size] for i in range(0, len(seq), size)]
+
+
+_PYRAMID_CHUNK_ROWS = 4096
+"""Number of fingerprints whose summed-area tables are held at once."""
+
+
+def _calc_pyramid(fingerprints):
+    """Calculate imagedescr.calc_pyramid_batch, a chunk of rows at a time.
+
+    The summed-area tables are several times larger than the fingerprints,
+    so only a chunk of them is held in memory at once.
+
+    """
+    channels = _channels(fingerprints)
+    pyramid = {(n_x, n_y): np.empty((len(fingerprints), n_x * n_y),
+                                    imagedescr.quadrant_sums_dtype(n_x, n_y, channels))
+               for n_x, n_y in imagedescr.PYRAMID_LEVELS}
+
+    with instrument.timed('pyramid'):
+        for start in range(0, len(fingerprints), _PYRAMID_CHUNK_ROWS):
+            end = start + _PYRAMID_CHUNK_ROWS
+            chunk = imagedescr.calc_pyramid_batch(fingerprints[start:end])
+            for level, sums in chunk.items():
+                pyramid[level][start:end] = sums
+
+    return pyramid
+
+
+def _fill_cached(fingerprints, filepaths, cache):
+    """Fill in the rows of fingerprints found in the cache.
+
+    Receives an (N, fingerprint_len(mode)) array, N file paths, and a
+    FingerprintCache, or None. Returns the list of rows that were not
+    found in the cache.
+
+    """
+    if cache is None:
+        missing_rows = list(range(len(filepaths)))
+    else:
+        missing_rows = []
+        for row, filepath in enumerate(filepaths):
+            cached = cache.get(filepath)
+            if cached is None:
+                missing_rows.append(row)
+            else:
+                fingerprints[row] = cached
+
+    instrument.count('images.cached', len(filepaths) - len(missing_rows))
+    instrument.count('images.decoded', len(missing_rows))
+
+    return missing_rows
+
+
+def _store_missing(fingerprints, filepaths, missing_rows, cache):
+    """Store the newly calculated rows of fingerprints in the cache."""
+    if cache is not None:
+        for row in missing_rows:
+            cache.put(filepaths[row], fingerprints[row])
+        cache.commit()
+
+
+def _fingerprint_rows(task):
+    """Fingerprint image files into rows of a shared matrix.
+
+    Receives the tuple (shared, rows, filepaths), where shared is a
+    SharedArray of fingerprints. Fingerprints filepaths[k], in the mode
+    of the width of the array, and writes the result to row rows[k]. Runs
+    in the worker processes.
+
+    """
+    shared, rows, filepaths = task
+    mode = imagedescr.fingerprint_mode(shared.array.shape[1])
+
+    for row, filepath in zip(rows, filepaths):
+        shared.array[row] = imagedescr.calc_fingerprint(filepath, mode)
+
+
+def _pool_size(pool):
+    """Get the number of workers in an executor or multiprocessing.Pool.
+
+    Falls back to 1 if the pool doesn't expose its size.
+
+    """
+    return (getattr(pool, 'workers', None)
+            or getattr(pool, '_processes', None) or 1)
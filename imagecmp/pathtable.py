@@ -0,0 +1,139 @@
+# ImageCmp - find similar images among many
+# Copyright (C) 2009,2017 Israel G. Lugo
+#
+# This file is part of ImageCmp.
+#
+# ImageCmp is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# ImageCmp is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with ImageCmp. If not, see <http://www.gnu.org/licenses/>.
+#
+# For suggestions, feedback or bug reports: israel.lugo@lugosys.com
+
+
+"""This module implements a compact table of file paths."""
+
+
+import operator
+import os
+import sys
+
+try:
+    from collections.abc import Sequence
+except ImportError:
+    from collections import Sequence
+
+import numpy as np
+
+
+_ENCODING_ERRORS = 'surrogateescape' if sys.version_info[0] >= 3 else 'strict'
+"""Error handler that lets undecodable file names round-trip."""
+
+_SEPARATORS = tuple(os.sep + (os.altsep or ''))
+"""Characters ending the directory part of a path."""
+
+_BYTES_SEPARATORS = tuple(sep.encode('ascii') for sep in _SEPARATORS)
+"""_SEPARATORS, for paths given as bytes."""
+
+
+class PathTable(Sequence):
+    """Compact read-only table of file paths, indexed by integer ID.
+
+    Each distinct directory is stored once, as a string. The file names
+    are encoded and stored one after the other, in a single buffer. Per
+    path, the table holds only a 32-bit directory number, a 64-bit end
+    offset and the bytes of the file name, instead of a string object.
+
+    Paths are split at their last separator, and rebuilt exactly as they
+    were given. A PathTable is a sequence: it can be indexed, iterated,
+    and compared to other sequences of paths.
+
+    This is a lightweight read-only data container class.
+
+    """
+    __slots__ = ('_dirs', '_dir_ids', '_names', '_ends', '_text')
+
+    def __init__(self, paths):
+        """Create a PathTable from an iterable of paths.
+
+        The paths are either all bytes, or text.
+
+        """
+        dir_numbers = {}
+        dir_ids = []
+        names = []
+        text = False
+
+        for path in paths:
+            separators = _BYTES_SEPARATORS if isinstance(path, bytes) else _SEPARATORS
+            split = max(path.rfind(sep) for sep in separators) + 1
+            dirname, name = path[:split], path[split:]
+
+            dir_ids.append(dir_numbers.setdefault(dirname, len(dir_numbers)))
+
+            if not isinstance(name, bytes):
+                text = True
+                name = name.encode('utf-8', _ENCODING_ERRORS)
+            names.append(name)
+
+        dirs = [None] * len(dir_numbers)
+        for dirname, number in dir_numbers.items():
+            dirs[number] = dirname
+
+        self._dirs = tuple(dirs)
+        self._dir_ids = np.array(dir_ids, np.uint32)
+        self._names = b''.join(names)
+        self._ends = np.cumsum([len(name) for name in names], dtype=np.int64)
+        self._text = text
+
+    @property
+    def nbytes(self):
+        """Get the approximate memory taken by the paths, in bytes."""
+        return (sum(len(dirname) for dirname in self._dirs) + len(self._names)
+                + self._dir_ids.nbytes + self._ends.nbytes)
+
+    def __len__(self):
+        """Return the number of paths."""
+        return len(self._dir_ids)
+
+    def __getitem__(self, index):
+        """Get the path at an index, or a tuple of paths for a slice."""
+        if isinstance(index, slice):
+            return tuple(self[k] for k in range(*index.indices(len(self))))
+
+        k = operator.index(index)
+        if k < 0:
+            k += len(self)
+        if not 0 <= k < len(self):
+            raise IndexError("path index out of range")
+
+        start = int(self._ends[k-1]) if k else 0
+        name = self._names[start:int(self._ends[k])]
+        if self._text:
+            name = name.decode('utf-8', _ENCODING_ERRORS)
+
+        return self._dirs[self._dir_ids[k]] + name
+
+    def __eq__(self, other):
+        """Compare with another sequence of paths, element by element."""
+        if not isinstance(other, (PathTable, tuple, list)):
+            return NotImplemented
+
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "PathTable(%r)" % (list(self),)
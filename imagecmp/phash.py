@@ -0,0 +1,221 @@
+
+# ImageCmp - find similar images among many
+# Copyright (C) 2009,2017 Israel G. Lugo
+#
+# This file is part of ImageCmp.
+#
+# ImageCmp is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# ImageCmp is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with ImageCmp. If not, see <http://www.gnu.org/licenses/>.
+#
+# For suggestions, feedback or bug reports: israel.lugo@lugosys.com
+
+
+"""This module implements compact 64-bit perceptual hashes.
+
+The hashes are derived from the 16x16 fingerprint thumbnails: the pixels
+are converted to luma, averaged down to 8x8 blocks, and each block
+contributes one bit. Images are then similar if the Hamming distance
+between their hashes is small.
+
+Near neighbours are found with multi-index hashing: the 64 bits are split
+into (max_distance + 1) substrings. Two hashes within max_distance of
+each other differ in at most max_distance substrings, so at least one
+substring is identical. Looking up identical substrings in sorted tables
+gives a small set of candidates, which are confirmed by their Hamming
+distance.
+
+"""
+
+
+import numpy as np
+
+from imagecmp import imagedescr
+from imagecmp import setops
+
+
+MAX_DISTANCE = 6
+"""Default maximum Hamming distance between the hashes of similar images."""
+
+HASH_BITS = 64
+"""Number of bits in a hash."""
+
+CHUNK_PAIRS = 1 << 20
+"""Approximate number of candidate pairs to generate and compare at a time.
+
+The pairs of a bucket grow with the square of its size; this bounds the
+memory used by dense buckets, e.g. of many near-identical images.
+
+"""
+
+_LUMA_WEIGHTS = np.array([0.299, 0.587, 0.114])
+"""ITU-R BT.601 weights for converting RGB to luma."""
+
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], np.uint8)
+"""Number of set bits in each byte value."""
+
+
+def _hash_blocks(fingerprints):
+    """Get the 8x8 luma blocks of an (N, fingerprint_len(mode)) array.
+
+    'luma' fingerprints are used as they are; 'rgb' ones are converted.
+
+    """
+    x, y = imagedescr.FINGERPRINT_SIZE
+
+    fingerprints = np.asarray(fingerprints)
+    if fingerprints.shape[-1] == imagedescr.fingerprint_len('luma'):
+        luma = fingerprints.reshape(-1, x, y).astype(np.float64)
+    else:
+        rgb = fingerprints.reshape(-1, x, y, 3)
+        luma = rgb.dot(_LUMA_WEIGHTS)
+
+    return luma.reshape(-1, 8, x // 8, 8, y // 8).mean(axis=(2, 4))
+
+
+def _pack(bits):
+    """Pack an (N, 8, 8) boolean array into N 64-bit hashes."""
+    packed = np.packbits(bits.reshape(len(bits), HASH_BITS), axis=1)
+
+    return packed.view('>u8').ravel().astype(np.uint64)
+
+
+def average_hash(fingerprints):
+    """Calculate the average hashes of many fingerprints.
+
+    Each bit is set if its block is brighter than the mean of the image.
+    Returns an array of N uint64 hashes.
+
+    """
+    blocks = _hash_blocks(fingerprints)
+
+    return _pack(blocks > blocks.mean(axis=(1, 2))[:, None, None])
+
+
+def popcount(values):
+    """Count the set bits of each value in an array of uint64."""
+    values = np.ascontiguousarray(values, np.uint64)
+
+    return _POPCOUNT_TABLE[values.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def hamming(a, b):
+    """Return the Hamming distances between two arrays of hashes."""
+    return popcount(np.bitwise_xor(a, b))
+
+
+class HashIndex(object):
+    """Multi-index hashing table for Hamming distance searches.
+
+    Holds only the hashes (8 bytes per image), plus one sorted table of
+    substrings per probe. Images are identified by their position in the
+    array of hashes.
+
+    """
+
+    def __init__(self, hashes, max_distance=MAX_DISTANCE):
+        """Index an array of uint64 hashes, for a maximum distance."""
+        if not 0 <= max_distance < HASH_BITS:
+            raise ValueError("max_distance (%d) must be between 0 and %d"
+                             % (max_distance, HASH_BITS - 1))
+
+        self._hashes = np.ascontiguousarray(hashes, np.uint64)
+        self._max_distance = max_distance
+
+        # split the bits into max_distance + 1 nearly equal substrings
+        bounds = np.linspace(0, HASH_BITS, max_distance + 2).astype(int)
+        self._substrings = list(zip(bounds[:-1], bounds[1:]))
+
+        self._tables = []
+        for lo, hi in self._substrings:
+            keys = self._substring(self._hashes, lo, hi)
+            order = np.argsort(keys, kind='mergesort')
+            self._tables.append((keys[order], order))
+
+    def __len__(self):
+        """Return the number of indexed hashes."""
+        return len(self._hashes)
+
+    @property
+    def hashes(self):
+        """Get the array of indexed hashes."""
+        return self._hashes
+
+    @staticmethod
+    def _substring(hashes, lo, hi):
+        """Extract the bits [lo, hi) of each hash, as integers."""
+        mask = np.uint64((1 << (hi - lo)) - 1)
+
+        return np.right_shift(hashes, np.uint64(lo)) & mask
+
+    def query(self, value):
+        """Find the hashes within max_distance of a hash.
+
+        Returns a sorted array with the positions of the matching hashes.
+
+        """
+        value = np.array([value], np.uint64)
+
+        candidates = [np.empty(0, np.intp)]
+        for (lo, hi), (keys, order) in zip(self._substrings, self._tables):
+            key = self._substring(value, lo, hi)
+            start = np.searchsorted(keys, key, 'left')[0]
+            stop = np.searchsorted(keys, key, 'right')[0]
+            candidates.append(order[start:stop])
+
+        candidates = np.unique(np.concatenate(candidates))
+        distances = hamming(self._hashes[candidates], value)
+
+        return candidates[distances <= self._max_distance]
+
+    def pairs(self):
+        """Find every pair of hashes within max_distance of each other.
+
+        Returns the tuple (pair_ids, distances), where a pair of hashes at
+        positions a < b among n hashes is encoded as a*n + b, as in
+        compare.sum_votes. pair_ids are sorted and unique.
+
+        """
+        n = len(self._hashes)
+
+        found = [np.empty(0, np.int64)]
+        for keys, order in self._tables:
+            # runs of identical substrings are the candidate groups
+            if not n:
+                break
+            starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+            sizes = np.diff(np.append(starts, n))
+
+            # each member of a group is paired with the later members
+            later = np.repeat(starts + sizes, sizes) - np.arange(n) - 1
+
+            for chunk in setops.chunks_by_total(later, CHUNK_PAIRS):
+                first = np.arange(chunk.start, chunk.stop)
+                a = order[np.repeat(first, later[chunk])].astype(np.int64)
+                b = order[setops.expand_ranges(first + 1, later[chunk])].astype(np.int64)
+
+                close = hamming(self._hashes[a], self._hashes[b]) <= self._max_distance
+                a = a[close]
+                b = b[close]
+                found.append(np.minimum(a, b) * n + np.maximum(a, b))
+
+        # pairs may be found through more than one substring; sorting
+        # removes the repeats much faster than np.unique's hashing
+        pair_ids = np.sort(np.concatenate(found))
+        first = np.ones(len(pair_ids), bool)
+        first[1:] = pair_ids[1:] != pair_ids[:-1]
+        pair_ids = pair_ids[first]
+
+        a, b = (pair_ids // n, pair_ids % n) if n else (pair_ids, pair_ids)
+        distances = hamming(self._hashes[a], self._hashes[b])
+
+        return pair_ids, distances
@@ -0,0 +1,343 @@
+# ImageCmp - find similar images among many
+# Copyright (C) 2009,2017 Israel G. Lugo
+#
+# This file is part of ImageCmp.
+#
+# ImageCmp is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# ImageCmp is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with ImageCmp. If not, see <http://www.gnu.org/licenses/>.
+#
+# For suggestions, feedback or bug reports: israel.lugo@lugosys.com
+
+
+"""This module implements a parallel scanner of directory trees.
+
+Directories are listed with scandir, whose entries carry the file type
+from the directory listing itself, so regular files and directories are
+told apart without a stat call for each one. Many directories are listed
+at once by a pool of threads, which hides the latency of network-backed
+storage.
+
+On Python < 3.5, the scandir package is used if installed; otherwise,
+directories are listed with os.listdir, and each entry is stat'ed.
+
+Files can be filtered by extension, and by the magic bytes at their
+start, so that files which aren't images are never decoded.
+
+"""
+
+
+import os
+import stat
+import sys
+import threading
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        # Python < 3.5, with the scandir package
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+SCAN_THREADS = 8
+"""Default number of threads listing directories."""
+
+MAX_PENDING_BATCHES = 256
+"""Maximum number of directories' worth of files found but not yet taken."""
+
+IMAGE_EXTENSIONS = frozenset([
+    '.bmp', '.dib', '.gif', '.ico', '.jfif', '.jpe', '.jpeg', '.jpg', '.pbm',
+    '.pgm', '.png', '.pnm', '.ppm', '.tif', '.tiff', '.webp',
+])
+"""Lowercase extensions of the image files Pillow commonly reads."""
+
+IMAGE_MAGIC = (
+    (0, b'\xff\xd8\xff'),               # JPEG
+    (0, b'\x89PNG\r\n\x1a\n'),          # PNG
+    (0, b'GIF87a'),                     # GIF
+    (0, b'GIF89a'),
+    (0, b'BM'),                         # BMP
+    (0, b'II*\x00'),                    # TIFF, little-endian
+    (0, b'MM\x00*'),                    # TIFF, big-endian
+    (8, b'WEBP'),                       # WebP, after the RIFF header
+    (0, b'\x00\x00\x01\x00'),           # ICO
+    (0, b'P4'),                         # binary PBM, PGM and PPM
+    (0, b'P5'),
+    (0, b'P6'),
+)
+"""(offset, bytes) signatures identifying the content of image files."""
+
+_MAGIC_LENGTH = max(offset + len(magic) for offset, magic in IMAGE_MAGIC)
+
+
+_DONE = object()
+"""Marks the end of a queue."""
+
+
+def _print_error(error):
+    """Print a listing error to stderr."""
+    sys.stderr.write("error listing '%s': %s\n"
+                     % (error.filename, error.strerror))
+
+
+def _raise(error):
+    """Raise an exception, as a function."""
+    raise error
+
+
+_error_handlers = {
+    'abort': _raise,
+    'ignore': None,
+    'print': _print_error,
+}
+
+
+class _DirEntry(object):
+    """Directory entry of _listdir_scandir, like the entries of scandir.
+
+    The file type comes from a stat call, done when first needed.
+
+    """
+
+    def __init__(self, dir_path, name):
+        self.name = name
+        self.path = os.path.join(dir_path, name)
+        self._lstat = None
+        self._stat = None
+
+    def _get_lstat(self):
+        """Get the lstat result of the entry, cached."""
+        if self._lstat is None:
+            self._lstat = os.lstat(self.path)
+        return self._lstat
+
+    def _get_stat(self, follow_symlinks):
+        """Get the stat or lstat result of the entry, cached."""
+        if not follow_symlinks or not self.is_symlink():
+            return self._get_lstat()
+        if self._stat is None:
+            self._stat = os.stat(self.path)
+        return self._stat
+
+    def is_symlink(self):
+        """Return True if the entry is a symbolic link."""
+        return stat.S_ISLNK(self._get_lstat().st_mode)
+
+    def is_dir(self, follow_symlinks=True):
+        """Return True if the entry is a directory."""
+        try:
+            return stat.S_ISDIR(self._get_stat(follow_symlinks).st_mode)
+        except EnvironmentError:
+            # like scandir, a broken symlink isn't a directory
+            return False
+
+    def is_file(self, follow_symlinks=True):
+        """Return True if the entry is a regular file."""
+        try:
+            return stat.S_ISREG(self._get_stat(follow_symlinks).st_mode)
+        except EnvironmentError:
+            return False
+
+
+def _listdir_scandir(path):
+    """List a directory with os.listdir, where scandir isn't available."""
+    return [_DirEntry(path, name) for name in os.listdir(path)]
+
+
+if scandir is None:
+    scandir = _listdir_scandir
+
+
+def has_image_extension(path, extensions=IMAGE_EXTENSIONS):
+    """Return True if path ends in one of the given lowercase extensions."""
+    return os.path.splitext(path)[1].lower() in extensions
+
+
+def has_image_magic(path):
+    """Return True if the file at path starts like an image file.
+
+    Reads only the first few bytes. Raises EnvironmentError if the file
+    can't be read.
+
+    """
+    with open(path, 'rb') as f:
+        head = f.read(_MAGIC_LENGTH)
+
+    return any(head[offset:offset + len(magic)] == magic
+               for offset, magic in IMAGE_MAGIC)
+
+
+def scan_files(top_dirs, follow_dirs=False, follow_files=True, on_error='print',
+               extensions=None, check_magic=False, threads=SCAN_THREADS):
+    """Generate the paths of the files under some directory trees.
+
+    Receives an iterable of top directories. Yields the path of every
+    regular file under them, in no particular order, as soon as its
+    directory is listed.
+
+    follow_dirs specifies whether symbolic links to directories are
+    followed. When they are, each directory is listed only once, as
+    identified by its (st_dev, st_ino), which also stops symlink loops.
+    follow_files specifies whether symbolic links to files are yielded.
+
+    extensions, if not None, is a collection of lowercase extensions
+    (e.g. IMAGE_EXTENSIONS); other files are skipped. If check_magic is
+    True, files that don't start with one of IMAGE_MAGIC are skipped.
+    The magic bytes are read by the scanning threads.
+
+    on_error is as in walk.walk: a function receiving each
+    EnvironmentError, or one of 'abort', 'ignore' or 'print'. It is always
+    called by the thread iterating the paths. threads is the number of
+    threads listing directories.
+
+    """
+    if callable(on_error):
+        error_handler = on_error
+    else:
+        error_handler = _error_handlers[on_error]
+
+    scanner = _Scanner(follow_dirs, follow_files, extensions, check_magic, max(1, threads))
+
+    for top_dir in top_dirs:
+        scanner.add_dir(top_dir)
+
+    if not scanner.pending:
+        return
+
+    workers = [threading.Thread(target=scanner.run) for i in range(scanner.threads)]
+    for thread in workers:
+        thread.daemon = True
+        thread.start()
+
+    try:
+        while True:
+            batch = scanner.found.get()
+            if batch is _DONE:
+                return
+
+            error, paths = batch
+            if error is not None:
+                if error_handler is not None:
+                    error_handler(error)
+                continue
+
+            for path in paths:
+                yield path
+    finally:
+        scanner.stop(workers)
+
+
+class _Scanner(object):
+    """State shared by the threads of scan_files."""
+
+    def __init__(self, follow_dirs, follow_files, extensions, check_magic, threads):
+        self.threads = threads
+        self.pending = 0
+        self.dirs = queue.Queue()
+        self.found = queue.Queue(MAX_PENDING_BATCHES)
+        self._follow_dirs = follow_dirs
+        self._follow_files = follow_files
+        self._extensions = extensions
+        self._check_magic = check_magic
+        self._visited = set()
+        self._lock = threading.Lock()
+        self._stopped = False
+
+    def add_dir(self, path):
+        """Queue a directory to be listed, unless it was seen before."""
+        if self._follow_dirs:
+            try:
+                st = os.stat(path)
+            except EnvironmentError:
+                # let listing it report the error
+                st = None
+
+            if st is not None:
+                key = (st.st_dev, st.st_ino)
+                with self._lock:
+                    if key in self._visited:
+                        return
+                    self._visited.add(key)
+
+        with self._lock:
+            self.pending += 1
+        self.dirs.put(path)
+
+    def run(self):
+        """List directories from the queue, until there are no more."""
+        while True:
+            path = self.dirs.get()
+            if path is _DONE:
+                return
+
+            if not self._stopped:
+                self._scan(path)
+
+            with self._lock:
+                self.pending -= 1
+                done = not self.pending
+
+            if done:
+                self.found.put(_DONE)
+                for i in range(self.threads):
+                    self.dirs.put(_DONE)
+
+    def stop(self, workers):
+        """Stop the workers, even if the paths weren't all taken."""
+        self._stopped = True
+        for thread in workers:
+            self.dirs.put(_DONE)
+
+        # keep draining, so that no worker stays blocked on a full queue
+        while any(thread.is_alive() for thread in workers):
+            try:
+                self.found.get(timeout=0.01)
+            except queue.Empty:
+                pass
+
+    def _scan(self, path):
+        """List a directory, queueing its subdirectories and files."""
+        try:
+            entries = list(scandir(path))
+        except EnvironmentError as e:
+            self.found.put((e, None))
+            return
+
+        files = []
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=self._follow_dirs):
+                    self.add_dir(entry.path)
+                elif entry.is_symlink() and not self._follow_files:
+                    continue
+                elif entry.is_file() and self._wanted(entry.path):
+                    files.append(entry.path)
+            except EnvironmentError as e:
+                self.found.put((e, None))
+
+        if files:
+            self.found.put((None, files))
+
+    def _wanted(self, path):
+        """Return True if a file passes the extension and magic filters."""
+        if self._extensions is not None and not has_image_extension(path, self._extensions):
+            return False
+
+        return not self._check_magic or has_image_magic(path)
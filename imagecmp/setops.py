@@ -26,6 +26,7 @@
 import operator
 import itertools
 
+import numpy as np
 
 
 def has_supersets(x, seq):
@@ -38,10 +39,53 @@ def has_supersets(x, seq):
 
 
 def without_subsets(seq):
-    """Return a new set without sets contained in other sets."""
-    sorted_by_len = sorted(seq, key=len)
+    """Return a new set without sets contained in other sets.
 
-    return {x for i, x in enumerate(sorted_by_len) if not has_supersets(x, itertools.islice(sorted_by_len, i+1, None))}
+    Uses an inverted index, mapping each element to the sets that contain
+    it. The supersets of a set are the intersection of the posting lists
+    of its elements, which is computed starting from the shortest list,
+    and stops as soon as the set itself is the only one left. This avoids
+    comparing every set against every other set.
+
+    """
+    unique = set(seq)
+
+    postings = {}
+    for x in unique:
+        for element in x:
+            postings.setdefault(element, []).append(x)
+
+    result = set()
+    for x in unique:
+        if not x:
+            # the empty set is contained in any other set
+            if len(unique) == 1:
+                result.add(x)
+            continue
+
+        if not _has_strict_supersets(x, postings):
+            result.add(x)
+
+    return result
+
+
+def _has_strict_supersets(x, postings):
+    """Return True if a non-empty set x is contained in another set.
+
+    postings maps each element to the list of (distinct) sets containing
+    it, including x itself.
+
+    """
+    lists = sorted((postings[element] for element in x), key=len)
+
+    candidates = set(lists[0])
+    for posting_list in itertools.islice(lists, 1, None):
+        if len(candidates) == 1:
+            # only x itself is left
+            return False
+        candidates.intersection_update(posting_list)
+
+    return len(candidates) > 1
 
 
 def without_pair_subsets(pairs):
@@ -91,58 +135,266 @@ def without_pair_subsets(pairs):
     return sorted_pairs
 
 
-def group_by(seq, tolerance, no_singles=False, key=None):
-    """Group the values of a numerical sequence by a certain tolerance.
+def without_pair_subsets_array(lo, hi):
+    """Return the intervals not contained in other intervals, vectorized.
 
-    Returns a list of slices from the original sequence, possibly
-    overlapping, where in each slice all the values are within (n -
-    tolerance <= n <= n + tolerance). The ordering of the list of slices is
-    arbitrary.
+    Receives two arrays lo and hi of equal length, describing the
+    intervals (lo[k], hi[k]), lo[k] <= hi[k]. Returns the arrays (lo, hi)
+    of the intervals that are not contained within other intervals, as
+    without_pair_subsets does, sorted by lo.
+
+    """
+    lo = np.asarray(lo)
+    hi = np.asarray(hi)
+
+    if not len(lo):
+        return lo, hi
+
+    # Sort growing on lo and decreasing on hi, as in without_pair_subsets.
+    # An interval is then contained in some previous interval iff its hi
+    # is not above the highest hi seen so far.
+    order = np.lexsort((-hi, lo))
+    lo = lo[order]
+    hi = hi[order]
+
+    highest_before = np.maximum.accumulate(hi)[:-1]
+    keep = np.concatenate(([True], hi[1:] > highest_before))
+
+    return lo[keep], hi[keep]
+
+
+def group_by_array(values, tolerance, no_singles=False):
+    """Group the values of a numerical array by a certain tolerance.
+
+    The array counterpart of group_by. Returns the tuple (order, lo, hi),
+    where order is the (stable) argsort of values, and each group k is
+    order[lo[k]:hi[k]]. The groups are the same as those of group_by:
+    possibly overlapping, with no group contained in another one.
 
     If no_singles is True, groups with a single item will be discarded.
 
-    key, if provided and not None, is a function to be applied to each
-    element of the sequence, to obtain a numerical comparison key.
+    """
+    values = np.asarray(values)
+
+    order = np.argsort(values, kind='mergesort')
+    sorted_values = values[order]
+
+    # each value's group spans from the first value >= value - tolerance
+    # up to the last value <= value + tolerance
+    lo = np.searchsorted(sorted_values, sorted_values - tolerance, 'left')
+    hi = np.searchsorted(sorted_values, sorted_values + tolerance, 'right')
+
+    if no_singles:
+        multiple = hi > lo + 1
+        lo = lo[multiple]
+        hi = hi[multiple]
+
+    lo, hi = without_pair_subsets_array(lo, hi)
+
+    return order, lo, hi
+
+
+def group_by_segments_array(values, segments, tolerance, no_singles=False):
+    """Group the values of many segments of an array, each on its own.
+
+    Receives an array of values, and an array with the segment number of
+    each value. Values are only grouped with values of the same segment.
+    Returns the tuple (order, lo, hi), as group_by_array does; each group
+    order[lo[k]:hi[k]] is the same as one of the groups that
+    group_by_array would find within the segment on its own.
 
     """
-    # we use a list of index pairs, and build the groups in the end
-    groups = []
+    order, lo, hi = _segment_ranges(values, segments, tolerance)
 
-    if key is None:
-        # slower than checking with an if and not using the key, but we
-        # optimize for uses with a key, as that's the case in this program
-        key = lambda x: x
+    if no_singles:
+        multiple = hi > lo + 1
+        lo = lo[multiple]
+        hi = hi[multiple]
+
+    # groups of different segments never contain each other
+    lo, hi = without_pair_subsets_array(lo, hi)
+
+    return order, lo, hi
+
+
+def within_tolerance_array(values, tolerance, segments=None):
+    """Find the values of a numerical array within tolerance of each other.
+
+    Returns the tuple (order, hi), where order is the (stable) argsort of
+    values, and for each position i, order[i+1:hi[i]] are the values
+    after values[order[i]] that are within tolerance of it. Each pair of
+    values within tolerance is thus found once.
+
+    segments, if provided and not None, is an array with the segment
+    number of each value. Values are then only matched within the same
+    segment, and order sorts by segment first.
+
+    """
+    if segments is not None:
+        order, lo, hi = _segment_ranges(values, segments, tolerance)
+        return order, hi
+
+    values = np.asarray(values)
+
+    order = np.argsort(values, kind='mergesort')
+    sorted_values = values[order]
 
-    lo_idx = 0
-    hi_idx = 0
+    return order, np.searchsorted(sorted_values, sorted_values + tolerance, 'right')
 
-    sorted_seq = sorted(seq, key=key)
 
-    for i, val in enumerate(sorted_seq):
-        group = []
-        if key is not None:
-            val = key(val)
+def _segment_ranges(values, segments, tolerance):
+    """Find the range of values within tolerance of each value, by segment.
 
-        minval = val - tolerance
-        maxval = val + tolerance
+    Returns the tuple (order, lo, hi), where order sorts the values by
+    segment and then by value, and order[lo[i]:hi[i]] are the values of
+    the same segment within tolerance of values[order[i]].
 
-        # skip lower than minval, starting from last low idx
-        # (no use going back before that)
-        while lo_idx < i and key(sorted_seq[lo_idx]) < minval:
-            lo_idx += 1
+    """
+    values = np.asarray(values)
+    count = len(values)
+
+    # Replace the values by their integer ranks, so that segment and
+    # value can be combined into a single exact sort key. Value v' is
+    # within tolerance of v iff its rank is within [lo_rank, hi_rank) of
+    # the ranks of v - tolerance and v + tolerance.
+    sorted_values = np.sort(values)
+    ranks = np.searchsorted(sorted_values, values, 'left')
+    lo_ranks = np.searchsorted(sorted_values, values - tolerance, 'left')
+    hi_ranks = np.searchsorted(sorted_values, values + tolerance, 'right')
+
+    base = np.asarray(segments, np.int64) * (count + 1)
+    keys = base + ranks
+
+    order = np.argsort(keys, kind='mergesort')
+    sorted_keys = keys[order]
+
+    lo = np.searchsorted(sorted_keys, (base + lo_ranks)[order], 'left')
+    hi = np.searchsorted(sorted_keys, (base + hi_ranks)[order], 'left')
+
+    return order, lo, hi
+
+
+def expand_ranges(starts, sizes):
+    """Concatenate the integer ranges [starts[k], starts[k] + sizes[k]).
+
+    Receives two arrays of equal length. Returns a single array with all
+    the ranges, one after the other, e.g.:
+
+        expand_ranges([5, 0], [2, 3]) = [5, 6, 0, 1, 2]
+
+    """
+    starts = np.asarray(starts, np.int64)
+    sizes = np.asarray(sizes, np.int64)
+
+    offsets = np.cumsum(sizes) - sizes
+
+    return np.repeat(starts - offsets, sizes) + np.arange(int(np.sum(sizes)))
+
+
+def pairs_within_groups(sizes):
+    """Enumerate the pairs of members within consecutive groups.
+
+    Receives the sizes of groups laid out one after the other in a flat
+    array of members. Returns the arrays (first, second) of positions in
+    the flat array, for every pair of members in the same group, with
+    first < second.
+
+    """
+    sizes = np.asarray(sizes, np.int64)
+    count = int(sizes.sum())
+
+    # position of each member within its group, and how many members
+    # come after it in the group
+    starts = np.cumsum(sizes) - sizes
+    local = np.arange(count) - np.repeat(starts, sizes)
+    later = np.repeat(sizes, sizes) - local - 1
+
+    # each member is paired with each of the later members in its group
+    first = np.repeat(np.arange(count), later)
+    run_starts = np.cumsum(later) - later
+    second = first + 1 + np.arange(len(first)) - np.repeat(run_starts, later)
+
+    return first, second
+
+
+def chunks_by_total(sizes, limit):
+    """Split an array of sizes into slices adding up to about limit.
+
+    Generates slice objects. Each slice adds up to at most limit, unless
+    it has a single element bigger than limit.
+
+    """
+    ends = np.cumsum(sizes)
+    start = 0
+    while start < len(sizes):
+        base = ends[start - 1] if start else 0
+        stop = max(start + 1, int(np.searchsorted(ends, base + limit, 'right')))
+
+        yield slice(start, stop)
+
+        start = stop
 
-        # find first value higher than maxval, starting from last high idx
-        # (no use checking before that)
-        while hi_idx < len(sorted_seq) and key(sorted_seq[hi_idx]) <= maxval:
-            hi_idx += 1
 
-        # discard unitary pairs if requested (note hi_idx is not inclusive)
-        if hi_idx > lo_idx+1 or not no_singles:
-            groups.append((lo_idx, hi_idx))
+def connected_components(n, a, b):
+    """Find the connected components of a graph, with a disjoint-set forest.
 
-    groups = without_pair_subsets(groups)
+    Receives the number of nodes n, and two arrays a and b with the
+    edges (a[k], b[k]). Returns an array of n labels, where each node is
+    labeled with the smallest node of its component.
 
-    return [sorted_seq[a:b] for a, b in groups]
+    The forest is kept as an array of parent pointers. Every round hooks
+    the roots of the two ends of each edge together (the higher root
+    under the lower one), and then compresses the paths, until all edges
+    are within a single tree.
+
+    """
+    labels = np.arange(n)
+    a = np.asarray(a, np.intp)
+    b = np.asarray(b, np.intp)
+
+    while True:
+        root_a = labels[a]
+        root_b = labels[b]
+        split = root_a != root_b
+        if not split.any():
+            return labels
+
+        # hook the higher root under the lowest root it's connected to
+        low = np.minimum(root_a[split], root_b[split])
+        high = np.maximum(root_a[split], root_b[split])
+        np.minimum.at(labels, high, low)
+
+        # compress the paths, so that every node points to its root
+        while True:
+            parents = labels[labels]
+            if np.array_equal(parents, labels):
+                break
+            labels = parents
+
+
+def group_by(seq, tolerance, no_singles=False, key=None):
+    """Group the values of a numerical sequence by a certain tolerance.
+
+    Returns a list of slices from the original sequence, possibly
+    overlapping, where in each slice all the values are within (n -
+    tolerance <= n <= n + tolerance). The ordering of the list of slices is
+    arbitrary.
+
+    If no_singles is True, groups with a single item will be discarded.
+
+    key, if provided and not None, is a function to be applied to each
+    element of the sequence, to obtain a numerical comparison key.
+
+    """
+    seq = list(seq)
+
+    if key is None:
+        keys = seq
+    else:
+        keys = [key(x) for x in seq]
 
+    order, lo, hi = group_by_array(np.asarray(keys), tolerance, no_singles)
 
+    sorted_seq = [seq[i] for i in order]
 
+    return [sorted_seq[a:b] for a, b in zip(lo.tolist(), hi.tolist())]
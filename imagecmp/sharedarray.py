@@ -0,0 +1,126 @@
+
+# ImageCmp - find similar images among many
+# Copyright (C) 2009,2017 Israel G. Lugo
+#
+# This file is part of ImageCmp.
+#
+# ImageCmp is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# ImageCmp is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with ImageCmp. If not, see <http://www.gnu.org/licenses/>.
+#
+# For suggestions, feedback or bug reports: israel.lugo@lugosys.com
+
+
+"""This module implements NumPy arrays shared with worker processes.
+
+Sending an array to a multiprocessing.Pool pickles it, which copies the
+data into every worker and back. A SharedArray is backed by a temporary
+memory-mapped file instead: pickling it only sends the file name, shape
+and data type, and each worker maps the same file. Workers can thus read
+their input and write their results in place, without copies.
+
+"""
+
+
+import os
+import tempfile
+
+import numpy as np
+
+
+def _map_file(filename, shape, dtype, mode):
+    """Map a file as a NumPy array.
+
+    Empty arrays can't be memory-mapped, so a regular empty array is
+    returned for those.
+
+    """
+    if int(np.prod(shape)) == 0:
+        return np.empty(shape, dtype)
+
+    return np.memmap(filename, dtype=dtype, mode=mode, shape=shape)
+
+
+class SharedArray(object):
+    """NumPy array shared between processes through a memory-mapped file.
+
+    The process that creates a SharedArray owns the backing file, and
+    removes it when the SharedArray is closed. Copies received by other
+    processes (through pickling) map the same file, and can write to it.
+
+    Usable as a context manager, which closes the SharedArray on exit.
+
+    """
+    __slots__ = ('_filename', '_shape', '_dtype', '_array', '_owner')
+
+    def __init__(self, shape, dtype, dir=None):
+        """Create a SharedArray of the given shape and data type.
+
+        The array is initialized to zeros. dir, if provided and not None,
+        is the directory where the backing file will be created (e.g. a
+        tmpfs mount such as /dev/shm).
+
+        """
+        fd, filename = tempfile.mkstemp(prefix='imagecmp-', suffix='.array',
+                                        dir=dir)
+        os.close(fd)
+
+        self._filename = filename
+        self._shape = tuple(shape)
+        self._dtype = np.dtype(dtype)
+        self._owner = True
+
+        try:
+            self._array = _map_file(filename, self._shape, self._dtype, 'w+')
+        except Exception:
+            os.remove(filename)
+            raise
+
+    @classmethod
+    def copy_of(cls, array, dir=None):
+        """Create a SharedArray holding a copy of an existing array."""
+        array = np.asarray(array)
+
+        shared = cls(array.shape, array.dtype, dir)
+        shared.array[...] = array
+
+        return shared
+
+    @property
+    def array(self):
+        """Get the shared NumPy array."""
+        return self._array
+
+    def close(self):
+        """Unmap the array, and remove its backing file if we own it."""
+        self._array = None
+
+        if self._owner:
+            self._owner = False
+            os.remove(self._filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __getstate__(self):
+        """Return the state for pickling: only where to find the data."""
+        return self._filename, self._shape, self._dtype.str
+
+    def __setstate__(self, state):
+        """Map the array from the state received from pickling."""
+        self._filename, self._shape, dtype = state
+        self._dtype = np.dtype(dtype)
+        self._owner = False
+        self._array = _map_file(self._filename, self._shape, self._dtype, 'r+')
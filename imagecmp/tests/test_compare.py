@@ -0,0 +1,512 @@
+
+# ImageCmp - find similar images among many
+# Copyright (C) 2009,2017 Israel G. Lugo
+#
+# This file is part of ImageCmp.
+#
+# ImageCmp is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# ImageCmp is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with ImageCmp. If not, see <http://www.gnu.org/licenses/>.
+#
+# For suggestions, feedback or bug reports: israel.lugo@lugosys.com
+
+
+"""Unit tests for the compare module."""
+
+
+import os
+import shutil
+import sys
+
+import numpy as np
+import pytest
+
+import imagecmp.compare as compare
+import imagecmp.executor as executor
+import imagecmp.instrument as instrument
+import imagecmp.matrix as matrix
+import imagecmp.setops as setops
+
+
+def test_similar_mask():
+    """similar_mask counts the quadrants within tolerance."""
+    base = np.zeros(10)
+    quads = np.array([
+        np.zeros(10),                       # identical
+        [5] * 6 + [100] * 4,                # 6/10 within tolerance
+        [5] * 5 + [100] * 5,                # 5/10 within tolerance
+        [-5] * 10,                          # all within tolerance, below
+        [6] * 10,                           # all just out of tolerance
+    ])
+
+    result = compare.similar_mask(base, quads, 5)
+
+    assert result.tolist() == [True, True, False, True, False]
+
+
+def test_grow():
+    """_grow keeps the existing rows, and only grows when needed."""
+    array = np.arange(6).reshape(3, 2)
+
+    assert compare._grow(array, 2) is array
+
+    grown = compare._grow(array, 4)
+    assert len(grown) >= 4
+    assert np.array_equal(grown[:3], array)
+
+
+def test_query_similar():
+    """query_similar finds the fingerprints close to the base one."""
+    rng = np.random.RandomState(0)
+    base = rng.randint(0, 256, size=768).astype(np.uint8)
+
+    fingerprints = np.array([
+        rng.randint(0, 256, size=768),      # unrelated
+        np.clip(base.astype(int) + 3, 0, 255),  # slightly brighter
+        255 - base,                         # negative
+        base,                               # identical
+    ]).astype(np.uint8)
+
+    assert compare.query_similar(base, fingerprints, 10).tolist() == [1, 3]
+
+
+def test_query_similar_matrix():
+    """query_similar gives the same positions for a FingerprintMatrix."""
+    rng = np.random.RandomState(0)
+    base = rng.randint(0, 256, size=768).astype(np.uint8)
+    fingerprints = np.clip(base.astype(int) + rng.randint(-30, 30, size=(50, 768)),
+                           0, 255).astype(np.uint8)
+    fingerprints[::2] = rng.randint(0, 256, size=(25, 768))
+    fpmatrix = matrix.FingerprintMatrix(fingerprints, [str(k) for k in range(50)])
+
+    expected = compare.query_similar(base, fingerprints, 15)
+
+    assert 0 < len(expected) < 50
+    assert compare.query_similar(base, fpmatrix, 15).tolist() == expected.tolist()
+
+
+def test_query_similar_empty():
+    """query_similar accepts an empty set of fingerprints."""
+    base = np.zeros(768, np.uint8)
+
+    assert len(compare.query_similar(base, np.zeros((0, 768), np.uint8), 10)) == 0
+
+
+def test_count_quadrant():
+    """Every pair sharing a group gets a single vote."""
+    groups = [[0, 1, 2], [3, 0], [1, 0]]
+
+    pair_ids, votes = compare.count_quadrant(groups, 4)
+
+    # (0, 1) is in two groups
+    assert pair_ids.tolist() == [0*4+1, 0*4+2, 0*4+3, 1*4+2]
+    assert votes.tolist() == [1, 1, 1, 1]
+
+
+def test_count_quadrant_no_pairs():
+    """Groups of a single image don't vote."""
+    pair_ids, votes = compare.count_quadrant([[0], [1]], 2)
+
+    assert len(pair_ids) == 0
+    assert len(votes) == 0
+
+
+def test_merge_votes():
+    """merge_votes adds the votes of equal pairs."""
+    quadrant_votes = [
+        compare.count_quadrant([[0, 1, 2]], 3),
+        compare.count_quadrant([[0, 1]], 3),
+        compare.count_quadrant([], 3),
+    ]
+
+    pair_ids, votes = compare.merge_votes(quadrant_votes)
+
+    assert pair_ids.tolist() == [1, 2, 5]
+    assert votes.tolist() == [2, 1, 1]
+
+
+def test_candidates_from_votes():
+    """Images with enough votes are grouped with their similar images."""
+    indices = np.array([10, 20, 30, 40])
+    pair_ids = np.array([0*4+1, 0*4+2, 2*4+3])
+    votes = np.array([3, 1, 3])
+
+    candidates = compare.candidates_from_votes(indices, pair_ids, votes, 2)
+
+    assert candidates == {
+        frozenset([10, 20]),
+        frozenset([30, 40]),
+    }
+
+
+def pairs_within(column, tolerance):
+    """Brute force encoded IDs of the pairs within tolerance of each other."""
+    n = len(column)
+    a, b = np.triu_indices(n, 1)
+    close = np.abs(column[a] - column[b]) <= tolerance
+
+    return a[close] * n + b[close]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_count_column(seed):
+    """count_column gives one vote to every pair within tolerance."""
+    column = np.random.RandomState(seed).uniform(0, 255, size=200)
+
+    pair_ids, votes = compare.count_column(column, 10)
+
+    assert pair_ids.tolist() == pairs_within(column, 10).tolist()
+    assert votes.tolist() == [1] * len(pair_ids)
+
+
+def test_count_column_ties():
+    """Equal values are within any tolerance, including zero."""
+    column = np.array([3.0, 1.0, 3.0, 3.0, 1.0])
+
+    pair_ids, votes = compare.count_column(column, 0)
+
+    assert pair_ids.tolist() == pairs_within(column, 0).tolist()
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_votes_at_most_nquads(seed):
+    """No pair gets more votes than there are quadrants."""
+    rng = np.random.RandomState(seed)
+    quads = rng.uniform(100, 140, size=(150, 16))
+    positions = np.arange(150) % 100
+    segments = np.arange(150) // 50
+
+    pair_ids, votes = compare.get_similar_votes(quads, 20, None)
+    assert votes.max() == 16
+    assert len(pair_ids) == 150 * 149 // 2
+
+    pair_ids, votes = compare.get_segmented_votes(quads[:100], positions, segments, 20, None)
+    assert votes.max() <= 16
+
+
+def test_default_cascade_bench_corpus():
+    """The default cascade separates the base images of the bench corpus."""
+    corpus = bench_corpus()
+    fingerprints, labels = corpus.synthesize_fingerprints(40, seed=0)
+    fpmatrix = matrix.FingerprintMatrix(fingerprints, [str(k) for k in range(len(labels))])
+
+    groups, stats = compare.run_cascade(fpmatrix, compare.DEFAULT_CASCADE, 20, None)
+
+    assert len(groups) == 40
+    assert corpus.precision_recall(groups, labels) == (1.0, 1.0)
+
+
+def test_get_similar_candidates_unknown_engine():
+    """Unknown engines are rejected."""
+    fpmatrix = matrix.FingerprintMatrix(np.zeros((2, 768), np.uint8), ["a", "b"])
+
+    with pytest.raises(ValueError):
+        compare.get_similar_candidates(fpmatrix, [0, 1], 10, 4, 4, None, 'nope')
+
+
+@pytest.mark.parametrize("engine", compare.ENGINES)
+def test_get_similar_candidates_engines(engine):
+    """Every engine finds a pair of near-identical images."""
+    rng = np.random.RandomState(0)
+    fingerprints = rng.randint(0, 256, size=(3, 768))
+    fingerprints[1] = np.clip(fingerprints[0] + 2, 0, 255)
+    fingerprints[2] = 255 - fingerprints[0]
+    fpmatrix = matrix.FingerprintMatrix(fingerprints, ["a", "b", "c"])
+
+    candidates = compare.get_similar_candidates(fpmatrix, [0, 1, 2], 5, 4, 4, None, engine)
+
+    assert candidates == {frozenset([0, 1])}
+
+
+def test_cluster_labels():
+    """Similar pairs are merged into non-overlapping clusters."""
+    indices = np.array([10, 11, 12, 13, 14, 15])
+    # 0-1 and 1-2 chain into one cluster, 4-5 is another, 3 is alone
+    pair_ids = np.array([0*6+1, 1*6+2, 4*6+5])
+
+    labels = compare.cluster_labels(20, indices, pair_ids)
+
+    assert len(labels) == 20
+    clusters = compare.labels_to_clusters(labels)
+    assert sorted(c.tolist() for c in clusters) == [[10, 11, 12], [14, 15]]
+    assert (labels[np.r_[0:10, 13, 16:20]] == -1).all()
+
+
+def test_labels_to_clusters_empty():
+    """No clusters without labels."""
+    assert compare.labels_to_clusters(np.full(5, -1)) == []
+
+
+def test_refine_clusters():
+    """A cluster is split into the clusters of its finer similar pairs."""
+    rng = np.random.RandomState(0)
+    fingerprints = rng.randint(0, 256, size=(4, 768))
+    fingerprints[1] = np.clip(fingerprints[0] + 2, 0, 255)
+    fingerprints[3] = np.clip(fingerprints[2] + 2, 0, 255)
+    fpmatrix = matrix.FingerprintMatrix(fingerprints, ["a", "b", "c", "d"])
+
+    labels = compare.refine_clusters(fpmatrix, np.zeros(4, np.intp), 5, 16, 16, None)
+
+    clusters = compare.labels_to_clusters(labels)
+    assert sorted(c.tolist() for c in clusters) == [[0, 1], [2, 3]]
+
+
+def test_findsimilar_reuses_executor(tmpdir):
+    """A caller-supplied executor is left open, and can be reused."""
+    from PIL import Image
+
+    rng = np.random.RandomState(0)
+    pixels = rng.randint(0, 256, size=(4, 8, 3)).astype(np.uint8)
+    image = Image.fromarray(pixels).resize((64, 48), Image.BICUBIC)
+    paths = [str(tmpdir.join(name)) for name in ("a.png", "b.png", "c.png")]
+    image.save(paths[0])
+    image.save(paths[1])
+    Image.fromarray(255 - pixels).resize((64, 48), Image.BICUBIC).save(paths[2])
+
+    with executor.ThreadExecutor(2) as ex:
+        for i in range(2):
+            result = compare.findsimilar(paths, 10, executor=ex)
+            assert result == {frozenset(paths[:2])}
+
+
+def test_findsimilar_duplicates(tmpdir):
+    """Byte-identical files are decoded once, and grouped together."""
+    from PIL import Image
+
+    rng = np.random.RandomState(1)
+    paths = []
+    for k in range(3):
+        pixels = rng.randint(0, 256, size=(4, 8, 3)).astype(np.uint8)
+        paths.append(str(tmpdir.join("%d.png" % k)))
+        Image.fromarray(pixels).resize((64, 48), Image.BICUBIC).save(paths[-1])
+    for k in range(2):
+        paths.append(str(tmpdir.join("copy%d.png" % k)))
+        shutil.copyfile(paths[k], paths[-1])
+
+    with executor.SerialExecutor() as ex:
+        with instrument.listening(instrument.Recorder()) as recorder:
+            result = compare.findsimilar(paths, 10, executor=ex)
+        expected = compare.findsimilar(paths, 10, executor=ex, collapse_duplicates=False)
+
+    assert result == expected == {frozenset([paths[0], paths[3]]), frozenset([paths[1], paths[4]])}
+    assert recorder.report()['counters']['images.decoded'] == 3
+
+
+@pytest.mark.parametrize("decode_threads", [None, 2])
+def test_findsimilar_luma(tmpdir, decode_threads):
+    """Luma fingerprints find the same near-duplicates as RGB ones."""
+    from PIL import Image
+
+    rng = np.random.RandomState(2)
+    paths = []
+    for k in range(3):
+        pixels = rng.randint(0, 256, size=(4, 8, 3)).astype(np.uint8)
+        paths.append(str(tmpdir.join("%d.png" % k)))
+        Image.fromarray(pixels).resize((64, 48), Image.BICUBIC).save(paths[-1])
+    Image.open(paths[0]).point(lambda v: min(255, v + 3)).save(str(tmpdir.join("bright.png")))
+    paths.append(str(tmpdir.join("bright.png")))
+
+    with executor.SerialExecutor() as ex:
+        rgb = compare.findsimilar(paths, 10, executor=ex, decode_threads=decode_threads)
+        luma = compare.findsimilar(paths, 10, executor=ex, decode_threads=decode_threads,
+                                   mode='luma')
+
+    assert luma == rgb == {frozenset([paths[0], paths[3]])}
+
+
+def bench_corpus():
+    """Import the synthetic corpus module of the benchmarks."""
+    bench = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir,
+                         'bench')
+    sys.path.insert(0, bench)
+    try:
+        import corpus
+    finally:
+        sys.path.remove(bench)
+
+    return corpus
+
+
+def make_similar_files(tmpdir, count=4, copies=2, seed=3):
+    """Write count random images, each with slightly brighter copies."""
+    from PIL import Image
+
+    rng = np.random.RandomState(seed)
+    paths = []
+    for k in range(count):
+        pixels = rng.randint(0, 256, size=(4, 8, 3)).astype(np.uint8)
+        im = Image.fromarray(pixels).resize((64, 48), Image.BICUBIC)
+        for c in range(copies + 1):
+            paths.append(str(tmpdir.join("%d_%d.png" % (k, c))))
+            im.point(lambda v: min(255, v + 2 * c)).save(paths[-1])
+
+    return paths
+
+
+def test_findsimilar_to(tmpdir):
+    """findsimilar_to lists the copies of the base image, but not itself."""
+    paths = make_similar_files(tmpdir)
+    link = str(tmpdir.join("link.png"))
+    os.link(paths[3], link)
+
+    with executor.SerialExecutor() as ex:
+        similar = compare.findsimilar_to(paths[3], [link] + paths, 10, executor=ex)
+
+    assert similar == paths[4:6]
+
+
+@pytest.mark.parametrize("batch_size", [1, 4, 100])
+def test_iter_similar(tmpdir, batch_size):
+    """The groups streamed by iter_similar add up to those of findsimilar."""
+    paths = make_similar_files(tmpdir)
+    shuffled = [paths[k] for k in np.random.RandomState(0).permutation(len(paths))]
+
+    with executor.SerialExecutor() as ex:
+        streamed = list(compare.iter_similar(iter(shuffled), 10, ex, batch_size=batch_size))
+        expected = compare.findsimilar(paths, 10, executor=ex)
+
+    assert len(expected) == 4
+    assert len(set(streamed)) == len(streamed)
+    assert expected <= set(streamed)
+    assert setops.without_subsets(streamed) == expected
+
+
+def test_findsimilar_iter(tmpdir):
+    """findsimilar_iter streams in any mode, and fills the cache."""
+    paths = make_similar_files(tmpdir, count=2)
+    cache_file = str(tmpdir.join("cache.db"))
+
+    with executor.SerialExecutor() as ex:
+        expected = compare.findsimilar(paths, 10, executor=ex, mode='luma')
+        streamed = list(compare.findsimilar_iter(paths, 10, cache_file=cache_file,
+                                                 executor=ex, mode='luma'))
+        with instrument.listening(instrument.Recorder()) as recorder:
+            cached = compare.findsimilar(paths, 10, cache_file=cache_file, executor=ex,
+                                         mode='luma')
+
+    assert setops.without_subsets(streamed) == expected == cached
+    assert recorder.report()['counters']['images.cached'] == len(paths)
+
+
+@pytest.mark.parametrize("seed", range(3))
+@pytest.mark.parametrize("batch_votes", [compare.BATCH_VOTES, 20000])
+def test_refine_candidates_batch(monkeypatch, seed, batch_votes):
+    """Refining all groups at once = refining each group on its own."""
+    monkeypatch.setattr(compare, 'BATCH_VOTES', batch_votes)
+    rng = np.random.RandomState(seed)
+    base = rng.randint(0, 256, size=(5, 768))
+    fingerprints = np.clip(base[rng.randint(0, 5, 60)]
+                           + rng.randint(-12, 13, size=(60, 768)), 0, 255)
+    fpmatrix = matrix.FingerprintMatrix(fingerprints, [str(i) for i in range(60)])
+    candidates = [frozenset(rng.choice(60, 8, replace=False).tolist())
+                  for i in range(30)]
+
+    expected = set()
+    for group in candidates:
+        expected.update(compare.get_similar_candidates(fpmatrix, group, 20, 16, 16, None))
+
+    result = compare.refine_candidates(fpmatrix, candidates, 20, 16, 16, None)
+
+    assert result == setops.without_subsets(expected)
+
+
+def test_refine_candidates_empty():
+    """No candidates refine to no candidates."""
+    fpmatrix = matrix.FingerprintMatrix(np.zeros((2, 768), np.uint8), ["a", "b"])
+
+    assert compare.refine_candidates(fpmatrix, [], 10, 16, 16, None) == set()
+
+
+def clustered_matrix(seed, count=40, nbases=4, noise=10):
+    """A FingerprintMatrix of noisy copies of a few random fingerprints."""
+    rng = np.random.RandomState(seed)
+    base = rng.randint(0, 256, size=(nbases, 768))
+    fingerprints = np.clip(base[rng.randint(0, nbases, count)]
+                           + rng.randint(-noise, noise + 1, size=(count, 768)), 0, 255)
+    return matrix.FingerprintMatrix(fingerprints, [str(i) for i in range(count)])
+
+
+def test_stage_unknown_engine():
+    """Stages reject unknown engines."""
+    with pytest.raises(ValueError):
+        compare.Stage(4, 4, engine='nope')
+
+
+def test_run_cascade_empty():
+    """A cascade needs at least one stage."""
+    with pytest.raises(ValueError):
+        compare.run_cascade(clustered_matrix(0), [], 20, None)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_run_cascade_default(seed):
+    """The default cascade refines 4x4 candidates with 16x16 quadrants."""
+    fpmatrix = clustered_matrix(seed)
+
+    expected = compare.refine_candidates(fpmatrix, [range(40)], 20, 4, 4, None)
+    expected = compare.refine_candidates(fpmatrix, expected, 20, 16, 16, None)
+
+    groups, stats = compare.run_cascade(fpmatrix, compare.DEFAULT_CASCADE, 20, None)
+
+    assert groups == expected
+    assert [s.stage for s in stats] == list(compare.DEFAULT_CASCADE)
+    assert stats[0].images_in == 40
+    assert stats[-1].groups_out == len(groups)
+    assert all(s.pairs_evaluated > 0 and s.seconds >= 0 for s in stats)
+
+
+@pytest.mark.parametrize("cascade", [compare.DEFAULT_CASCADE,
+                                     [compare.Stage(4, 4), compare.Stage(2, 6)]])
+def test_run_cascade_shared_transport(monkeypatch, cascade):
+    """Quadrants shared with worker processes give the same groups."""
+    fpmatrix = clustered_matrix(2)
+    expected, stats = compare.run_cascade(fpmatrix, cascade, 20, None)
+
+    monkeypatch.setattr(compare, 'SHARED_TRANSPORT_MIN_IMAGES', 1)
+    with executor.ProcessExecutor(2, min_batch=1) as ex:
+        with instrument.listening(instrument.Recorder()) as recorder:
+            groups, stats = compare.run_cascade(fpmatrix, cascade, 20, ex)
+
+    assert groups == expected
+    assert recorder.report()['counters']['ipc.shared_bytes'] > 0
+
+
+def test_run_cascade_stage_parameters():
+    """Each stage uses its own tolerance and ratio."""
+    fpmatrix = clustered_matrix(0)
+    cascade = [compare.Stage(4, 4, tolerance=0), compare.Stage(16, 16)]
+
+    groups, stats = compare.run_cascade(fpmatrix, cascade, 20, None)
+
+    # no two noisy copies have a single equal quadrant
+    assert groups == set()
+    assert stats[0].groups_out == 0
+    assert stats[1].images_in == 0
+
+    # every quadrant is within tolerance of every other
+    cascade = [compare.Stage(4, 4, tolerance=255, ratio=1.0)]
+    groups, stats = compare.run_cascade(fpmatrix, cascade, 0, None)
+
+    assert groups == {frozenset(range(40))}
+
+
+def test_run_cascade_clusters():
+    """Clusters are disjoint, and labeled stage after stage."""
+    fpmatrix = clustered_matrix(1)
+    cascade = [compare.Stage(4, 4), compare.Stage(8, 8), compare.Stage(16, 16)]
+
+    clusters, stats = compare.run_cascade(fpmatrix, cascade, 20, None, clusters=True)
+
+    assert len(stats) == 3
+    assert stats[-1].groups_out == len(clusters)
+    members = [i for cluster in clusters for i in cluster]
+    assert len(members) == len(set(members))
@@ -0,0 +1,81 @@
+
+# ImageCmp - find similar images among many
+# Copyright (C) 2009,2017 Israel G. Lugo
+#
+# This file is part of ImageCmp.
+#
+# ImageCmp is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# ImageCmp is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with ImageCmp. If not, see <http://www.gnu.org/licenses/>.
+#
+# For suggestions, feedback or bug reports: israel.lugo@lugosys.com
+
+
+"""Unit tests for the decode module."""
+
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import imagecmp.decode as decode
+import imagecmp.imagedescr as imagedescr
+
+
+def make_images(tmpdir, count):
+    rng = np.random.RandomState(0)
+    paths = []
+    for k in range(count):
+        pixels = rng.randint(0, 256, size=(32, 32, 3)).astype(np.uint8)
+        path = str(tmpdir.join("%d.png" % k))
+        Image.fromarray(pixels).save(path)
+        paths.append(path)
+    return paths
+
+
+@pytest.mark.parametrize("read_threads, decode_threads, prefetch", [
+    (1, 1, 1),
+    (4, 2, 3),
+    (2, 8, 64),
+])
+def test_decode_fingerprints(tmpdir, read_threads, decode_threads, prefetch):
+    """Every file is fingerprinted into its row, as calc_fingerprint does."""
+    paths = make_images(tmpdir, 12)
+    rows = list(range(11, -1, -1))
+    fingerprints = np.zeros((12, imagedescr.FINGERPRINT_LEN), np.uint8)
+
+    decode.decode_fingerprints(fingerprints, rows, paths, read_threads,
+                               decode_threads, prefetch)
+
+    for row, path in zip(rows, paths):
+        assert np.array_equal(fingerprints[row],
+                              imagedescr.calc_fingerprint(path))
+
+
+def test_decode_fingerprints_missing_file(tmpdir):
+    """Files that can't be read raise their error."""
+    paths = make_images(tmpdir, 5) + [str(tmpdir.join("missing.png"))]
+    fingerprints = np.zeros((6, imagedescr.FINGERPRINT_LEN), np.uint8)
+
+    with pytest.raises(IOError):
+        decode.decode_fingerprints(fingerprints, range(6), paths, prefetch=1)
+
+
+def test_decode_fingerprints_bad_image(tmpdir):
+    """Files that can't be decoded raise their error."""
+    path = tmpdir.join("bad.png")
+    path.write_binary(b"not an image")
+    paths = make_images(tmpdir, 20) + [str(path)]
+    fingerprints = np.zeros((21, imagedescr.FINGERPRINT_LEN), np.uint8)
+
+    with pytest.raises(IOError):
+        decode.decode_fingerprints(fingerprints, range(21), paths, 1, 1, 1)
@@ -0,0 +1,83 @@
+# ImageCmp - find similar images among many
+# Copyright (C) 2009,2017 Israel G. Lugo
+#
+# This file is part of ImageCmp.
+#
+# ImageCmp is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# ImageCmp is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with ImageCmp. If not, see <http://www.gnu.org/licenses/>.
+#
+# For suggestions, feedback or bug reports: israel.lugo@lugosys.com
+
+
+"""Unit tests for the dedup module."""
+
+
+import pytest
+
+import imagecmp.dedup as dedup
+import imagecmp.executor as executor
+
+
+def write_files(tmpdir, contents):
+    """Write files named 0, 1, ... with the given contents."""
+    paths = []
+    for k, data in enumerate(contents):
+        path = str(tmpdir.join(str(k)))
+        with open(path, 'wb') as f:
+            f.write(data)
+        paths.append(path)
+
+    return paths
+
+
+@pytest.mark.parametrize("size", [10, 3 * dedup.PARTIAL_HASH_BYTES])
+def test_find_duplicates(tmpdir, size):
+    """Only byte-identical files are duplicates."""
+    same = b'a' * size
+    middle = b'a' * (size // 2) + b'b' + b'a' * (size - size // 2 - 1)
+    paths = write_files(tmpdir, [same, b'c' * size, same, middle, same, b'c' * size, b'x'])
+
+    assert dedup.find_duplicates(paths) == [[paths[0], paths[2], paths[4]],
+                                            [paths[1], paths[5]]]
+
+
+def test_find_duplicates_pool(tmpdir):
+    """Hashing can be done by an executor."""
+    paths = write_files(tmpdir, [b'same'] * 3 + [b'diff'])
+
+    with executor.ThreadExecutor(2) as ex:
+        assert dedup.find_duplicates(paths, ex) == [paths[:3]]
+
+
+def test_find_duplicates_unreadable(tmpdir):
+    """Missing files and repeated names are not duplicates."""
+    paths = write_files(tmpdir, [b'x', b'y'])
+    missing = str(tmpdir.join('missing'))
+
+    assert dedup.find_duplicates([paths[0], missing, paths[0], missing, paths[1]]) == []
+
+
+def test_collapse_expand(tmpdir):
+    """Duplicates are left out, and put back in the groups."""
+    paths = write_files(tmpdir, [b'a', b'b', b'a', b'c', b'c', b'a', b'd'])
+
+    unique, copies = dedup.collapse_duplicates(paths)
+
+    assert unique == [paths[0], paths[1], paths[3], paths[6]]
+    assert copies == {paths[0]: [paths[2], paths[5]], paths[3]: [paths[4]]}
+
+    groups = [frozenset([paths[0], paths[1]])]
+    assert dedup.expand_duplicates(groups, copies) == {
+        frozenset([paths[0], paths[1], paths[2], paths[5]]),
+        frozenset([paths[3], paths[4]]),
+    }
@@ -0,0 +1,114 @@
+
+# ImageCmp - find similar images among many
+# Copyright (C) 2009,2017 Israel G. Lugo
+#
+# This file is part of ImageCmp.
+#
+# ImageCmp is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# ImageCmp is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with ImageCmp. If not, see <http://www.gnu.org/licenses/>.
+#
+# For suggestions, feedback or bug reports: israel.lugo@lugosys.com
+
+
+"""Unit tests for the executor module."""
+
+
+import os
+
+import pytest
+
+import imagecmp.executor as executor
+
+
+def square(x):
+    return x * x
+
+
+def pid(x):
+    return os.getpid()
+
+
+@pytest.fixture(params=['serial', 'thread', 'process'])
+def any_executor(request):
+    if request.param == 'serial':
+        ex = executor.SerialExecutor()
+    elif request.param == 'thread':
+        ex = executor.ThreadExecutor(2, min_batch=1)
+    else:
+        ex = executor.ProcessExecutor(2, min_batch=1)
+
+    with ex:
+        yield ex
+
+
+def test_map(any_executor):
+    """map(f, items) = [f(x) for x in items]"""
+    assert any_executor.map(square, range(50)) == [x * x for x in range(50)]
+
+
+def test_imap_unordered(any_executor):
+    """imap_unordered returns all the results, in any order."""
+    result = any_executor.imap_unordered(square, range(50))
+
+    assert sorted(result) == [x * x for x in range(50)]
+
+
+def test_map_empty(any_executor):
+    """Empty batches have empty results."""
+    assert any_executor.map(square, []) == []
+
+
+def test_small_batch_in_process():
+    """Batches below min_batch run in the calling process."""
+    with executor.ProcessExecutor(2, min_batch=5) as ex:
+        assert ex.map(pid, range(4)) == [os.getpid()] * 4
+        assert set(ex.imap_unordered(pid, range(4))) == {os.getpid()}
+
+
+def test_small_job_never_starts_pool():
+    """Executors that only see small batches never start their workers."""
+    with executor.ProcessExecutor(2) as ex:
+        assert not ex.started
+        assert ex.map(pid, range(10)) == [os.getpid()] * 10
+        assert set(ex.imap_unordered(pid, range(10))) == {os.getpid()}
+        assert not ex.started
+
+
+def test_pool_started_lazily():
+    """The workers are started by the first batch that reaches min_batch."""
+    with executor.ProcessExecutor(2, min_batch=8) as ex:
+        ex.map(square, range(4))
+        assert not ex.started
+
+        assert os.getpid() not in ex.map(pid, range(8))
+        assert ex.started
+
+
+def test_map_work():
+    """map_work sends a few items to the workers when their work is large."""
+    with executor.ProcessExecutor(2, min_batch=100) as ex:
+        assert executor.map_work(ex, pid, range(2), 10) == [os.getpid()] * 2
+        assert not ex.started
+
+        assert os.getpid() not in executor.map_work(ex, pid, range(2), 100)
+
+
+@pytest.mark.parametrize("workers, count, expected", [
+    (1, 0, 1),
+    (1, 100, 25),
+    (4, 100, 6),
+    (4, 10, 1),
+])
+def test_chunksize(workers, count, expected):
+    """Batches are split into CHUNKS_PER_WORKER chunks per worker."""
+    assert executor.Executor(workers).chunksize(count) == expected
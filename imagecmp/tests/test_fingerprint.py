@@ -0,0 +1,177 @@
+
+# ImageCmp - find similar images among many
+# Copyright (C) 2009,2017 Israel G. Lugo
+#
+# This file is part of ImageCmp.
+#
+# ImageCmp is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# ImageCmp is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with ImageCmp. If not, see <http://www.gnu.org/licenses/>.
+#
+# For suggestions, feedback or bug reports: israel.lugo@lugosys.com
+
+
+"""Unit tests for the fingerprint decoding in imagedescr."""
+
+
+import io
+import struct
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import imagecmp.imagedescr as imagedescr
+
+
+def exif_with_thumbnail(thumbnail):
+    """Build an EXIF block with an embedded JPEG thumbnail in IFD1."""
+    data = io.BytesIO()
+    thumbnail.save(data, 'JPEG')
+    data = data.getvalue()
+
+    # TIFF header, an empty IFD0 pointing to IFD1, and IFD1 with the
+    # offset and length of the thumbnail, which follows it
+    ifd0 = struct.pack('<HI', 0, 14)
+    offset = 14 + 2 + 2*12 + 4
+    ifd1 = (struct.pack('<H', 2)
+            + struct.pack('<HHII', 0x0201, 4, 1, offset)
+            + struct.pack('<HHII', 0x0202, 4, 1, len(data))
+            + struct.pack('<I', 0))
+
+    return b'Exif\x00\x00II*\x00' + struct.pack('<I', 8) + ifd0 + ifd1 + data
+
+
+def save_jpeg(tmpdir, image, thumbnail=None):
+    path = str(tmpdir.join("image.jpg"))
+    if thumbnail is None:
+        image.save(path)
+    else:
+        image.save(path, exif=exif_with_thumbnail(thumbnail))
+    return path
+
+
+def test_exif_thumbnail(tmpdir):
+    """The EXIF thumbnail is used instead of the image, when usable."""
+    path = save_jpeg(tmpdir, Image.new('RGB', (800, 600), (0, 0, 255)),
+                     Image.new('RGB', (160, 120), (255, 0, 0)))
+
+    im = imagedescr.open_small(path)
+
+    r, g, b = im.getpixel((0, 0))
+    assert r > 200 and b < 50
+
+
+@pytest.mark.parametrize("thumb_size", [(160, 90), (8, 6)])
+def test_exif_thumbnail_unusable(tmpdir, thumb_size):
+    """Letterboxed or too small EXIF thumbnails are ignored."""
+    path = save_jpeg(tmpdir, Image.new('RGB', (800, 600), (0, 0, 255)),
+                     Image.new('RGB', thumb_size, (255, 0, 0)))
+
+    im = imagedescr.open_small(path)
+
+    r, g, b = im.getpixel((0, 0))
+    assert b > 200 and r < 50
+
+
+@pytest.mark.parametrize("mode, ext", [
+    ('RGB', 'jpg'),
+    ('L', 'jpg'),
+    ('CMYK', 'jpg'),
+    ('RGB', 'png'),
+    ('RGBA', 'png'),
+    ('P', 'png'),
+    ('L', 'png'),
+])
+def test_open_small(tmpdir, mode, ext):
+    """Images are decoded small, in RGB, keeping their aspect ratio."""
+    pixels = np.random.RandomState(0).randint(0, 256, size=(480, 320, 3))
+    path = str(tmpdir.join("image." + ext))
+    Image.fromarray(pixels.astype(np.uint8)).convert(mode).save(path)
+
+    im = imagedescr.open_small(path)
+
+    assert im.mode == 'RGB'
+    width, height = im.size
+    assert 16 <= width < 128 and 16 <= height < 192
+    assert abs(width * 480 - height * 320) <= 480
+    assert imagedescr.calc_fingerprint(path).shape == (imagedescr.FINGERPRINT_LEN,)
+
+
+@pytest.mark.parametrize("dtype, scale, ext", [
+    (np.uint16, 257, 'png'),
+    (np.float32, 1 / 255.0, 'tiff'),
+])
+def test_open_small_wide(tmpdir, dtype, scale, ext):
+    """Images with more than 8 bits per sample are scaled, not clipped."""
+    pixels = np.random.RandomState(0).randint(0, 256, size=(480, 320))
+    pixels[0, 0], pixels[-1, -1] = 0, 255
+    path8 = str(tmpdir.join("image8.png"))
+    path = str(tmpdir.join("image." + ext))
+    Image.fromarray(pixels.astype(np.uint8)).save(path8)
+    Image.fromarray((pixels * scale).astype(dtype)).save(path)
+
+    assert Image.open(path).mode in imagedescr._WIDE_MODES
+    expected = imagedescr.calc_fingerprint(path8).astype(int)
+    fingerprint = imagedescr.calc_fingerprint(path).astype(int)
+
+    assert np.abs(fingerprint - expected).max() <= 1
+
+
+def test_open_small_without_reduce(tmpdir, monkeypatch):
+    """Pillow versions without Image.reduce give nearly the same fingerprint."""
+    pixels = np.random.RandomState(0).randint(0, 256, size=(8, 6, 3))
+    pixels = pixels.repeat(60, axis=0).repeat(60, axis=1)
+    path = str(tmpdir.join("image.png"))
+    Image.fromarray(pixels.astype(np.uint8)).save(path)
+
+    expected = imagedescr.calc_fingerprint(path).astype(int)
+    reduced_size = imagedescr.open_small(path).size
+
+    monkeypatch.delattr(Image.Image, 'reduce')
+    assert imagedescr.open_small(path).size == reduced_size
+    fingerprint = imagedescr.calc_fingerprint(path).astype(int)
+
+    assert np.abs(fingerprint - expected).max() <= 2
+
+
+def test_open_small_tiny(tmpdir):
+    """Images smaller than the fingerprint are kept as they are."""
+    path = str(tmpdir.join("tiny.png"))
+    Image.new('L', (10, 5)).save(path)
+
+    im = imagedescr.open_small(path)
+
+    assert im.size == (10, 5)
+    assert im.mode == 'RGB'
+
+
+def test_calc_fingerprint_luma(tmpdir):
+    """Luma fingerprints have one byte per pixel, close to the RGB luma."""
+    pixels = np.random.RandomState(0).randint(0, 256, size=(8, 8, 3))
+    pixels = pixels.repeat(8, axis=0).repeat(8, axis=1)
+    path = str(tmpdir.join("image.png"))
+    Image.fromarray(pixels.astype(np.uint8)).save(path)
+
+    rgb = imagedescr.calc_fingerprint(path)
+    luma = imagedescr.calc_fingerprint(path, 'luma')
+
+    assert luma.shape == (imagedescr.fingerprint_len('luma'),)
+    assert luma.size * 3 == rgb.size == imagedescr.FINGERPRINT_LEN
+    assert imagedescr.fingerprint_mode(luma.size) == 'luma'
+
+    # both are autocontrasted, in different ways: compare their order
+    rgb_luma = rgb.reshape(-1, 3).dot([0.299, 0.587, 0.114])
+    assert np.corrcoef(rgb_luma, luma)[0, 1] > 0.95
+
+    with pytest.raises(ValueError):
+        imagedescr.calc_fingerprint(path, 'cmyk')
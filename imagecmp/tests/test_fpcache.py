@@ -0,0 +1,138 @@
+
+# ImageCmp - find similar images among many
+# Copyright (C) 2009,2017 Israel G. Lugo
+#
+# This file is part of ImageCmp.
+#
+# ImageCmp is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# ImageCmp is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with ImageCmp. If not, see <http://www.gnu.org/licenses/>.
+#
+# For suggestions, feedback or bug reports: israel.lugo@lugosys.com
+
+
+"""Unit tests for fpcache.FingerprintCache."""
+
+
+import os
+
+import numpy as np
+import pytest
+
+import imagecmp.fpcache as fpcache
+import imagecmp.imagedescr as imagedescr
+
+
+@pytest.fixture
+def cache(tmpdir):
+    with fpcache.FingerprintCache(str(tmpdir.join("cache.db"))) as c:
+        yield c
+
+
+def make_file(tmpdir, name, contents=b"x"):
+    path = tmpdir.join(name)
+    path.write_binary(contents)
+    return str(path)
+
+
+def fingerprint(value):
+    return np.full(imagedescr.FINGERPRINT_LEN, value, np.uint8)
+
+
+def test_cache_hit(tmpdir, cache):
+    """put(f, x); get(f) = x"""
+    path = make_file(tmpdir, "a")
+
+    assert cache.get(path) is None
+
+    cache.put(path, fingerprint(7))
+
+    assert np.array_equal(cache.get(path), fingerprint(7))
+
+
+def test_cache_stale(tmpdir, cache):
+    """Changing a file invalidates its cached fingerprint."""
+    path = make_file(tmpdir, "a")
+    cache.put(path, fingerprint(7))
+
+    make_file(tmpdir, "a", b"longer contents")
+
+    assert cache.get(path) is None
+    assert len(cache) == 0
+
+
+def test_cache_persistent(tmpdir):
+    """Fingerprints survive closing and reopening the cache."""
+    path = make_file(tmpdir, "a")
+    filename = str(tmpdir.join("cache.db"))
+
+    with fpcache.FingerprintCache(filename) as cache:
+        cache.put(path, fingerprint(3))
+
+    with fpcache.FingerprintCache(filename) as cache:
+        assert np.array_equal(cache.get(path), fingerprint(3))
+
+
+def test_cache_version(tmpdir, monkeypatch):
+    """Fingerprints of another algorithm version are discarded."""
+    path = make_file(tmpdir, "a")
+    filename = str(tmpdir.join("cache.db"))
+
+    with fpcache.FingerprintCache(filename) as cache:
+        cache.put(path, fingerprint(3))
+    with fpcache.FingerprintCache(filename, 'luma') as cache:
+        cache.put(path, np.zeros(imagedescr.fingerprint_len('luma'), np.uint8))
+
+    monkeypatch.setattr(imagedescr, 'FINGERPRINT_VERSION',
+                        imagedescr.FINGERPRINT_VERSION + 1)
+
+    with fpcache.FingerprintCache(filename, 'luma') as cache:
+        assert len(cache) == 0
+    with fpcache.FingerprintCache(filename) as cache:
+        assert cache.get(path) is None
+        cache.put(path, fingerprint(4))
+
+    with fpcache.FingerprintCache(filename) as cache:
+        assert np.array_equal(cache.get(path), fingerprint(4))
+
+
+def test_cache_compact(tmpdir, cache):
+    """compact() removes entries of missing files."""
+    kept = make_file(tmpdir, "kept")
+    removed = make_file(tmpdir, "removed")
+    cache.put(kept, fingerprint(1))
+    cache.put(removed, fingerprint(2))
+
+    os.remove(removed)
+
+    assert cache.compact() == 1
+    assert len(cache) == 1
+    assert cache.get(kept) is not None
+
+
+def test_cache_modes(tmpdir):
+    """Each fingerprint mode is cached separately, in the same file."""
+    path = make_file(tmpdir, "a")
+    filename = str(tmpdir.join("cache.db"))
+    luma = np.full(imagedescr.fingerprint_len('luma'), 9, np.uint8)
+
+    with fpcache.FingerprintCache(filename) as cache:
+        cache.put(path, fingerprint(3))
+    with fpcache.FingerprintCache(filename, 'luma') as cache:
+        assert cache.get(path) is None
+        cache.put(path, luma)
+
+    with fpcache.FingerprintCache(filename) as cache:
+        assert np.array_equal(cache.get(path), fingerprint(3))
+    with fpcache.FingerprintCache(filename, 'luma') as cache:
+        assert np.array_equal(cache.get(path), luma)
+        assert len(cache) == 1
@@ -0,0 +1,82 @@
+
+# ImageCmp - find similar images among many
+# Copyright (C) 2009,2017 Israel G. Lugo
+#
+# This file is part of ImageCmp.
+#
+# ImageCmp is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# ImageCmp is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with ImageCmp. If not, see <http://www.gnu.org/licenses/>.
+#
+# For suggestions, feedback or bug reports: israel.lugo@lugosys.com
+
+
+"""Unit tests for gridindex."""
+
+
+import numpy as np
+import pytest
+
+import imagecmp.gridindex as gridindex
+
+
+def brute_force_pairs(quads, tolerance, min_votes):
+    """Check every pair of images, returning (pair_ids, votes)."""
+    n = len(quads)
+    votes = (np.abs(quads[:, None, :] - quads[None, :, :]) <= tolerance).sum(axis=2)
+    a, b = np.nonzero(np.triu(votes >= min_votes, 1))
+    return a * n + b, votes[a, b]
+
+
+def clustered_quads(count, nquads, seed):
+    """Quadrant vectors scattered around a few cluster centers."""
+    rng = np.random.RandomState(seed)
+    centers = rng.uniform(0, 255, size=(5, nquads))
+    quads = centers[rng.randint(0, 5, count)] + rng.normal(0, 8, (count, nquads))
+    return np.clip(quads, 0, 255)
+
+
+@pytest.mark.parametrize("seed", range(3))
+@pytest.mark.parametrize("nquads, min_votes", [(16, 9), (16, 16), (16, 1), (4, 2)])
+def test_similar_pairs_matches_brute_force(seed, nquads, min_votes):
+    """similar_pairs finds exactly the pairs found by brute force."""
+    quads = clustered_quads(150, nquads, seed)
+
+    pair_ids, votes = gridindex.similar_pairs(quads, 10, min_votes)
+    expected_ids, expected_votes = brute_force_pairs(quads, 10, min_votes)
+
+    assert pair_ids.tolist() == expected_ids.tolist()
+    assert votes.tolist() == expected_votes.tolist()
+
+
+def test_similar_pairs_chunked(monkeypatch):
+    """Results don't depend on the chunk size."""
+    quads = clustered_quads(100, 16, 0)
+    expected = gridindex.similar_pairs(quads, 10, 9)
+
+    monkeypatch.setattr(gridindex, 'CHUNK_PAIRS', 7)
+    result = gridindex.similar_pairs(quads, 10, 9)
+
+    assert np.array_equal(result[0], expected[0])
+
+
+def test_similar_pairs_empty():
+    """No images, no pairs."""
+    pair_ids, votes = gridindex.similar_pairs(np.zeros((0, 16)), 10, 9)
+
+    assert len(pair_ids) == 0
+
+
+def test_similar_pairs_bad_votes():
+    """min_votes must be within the number of quadrants."""
+    with pytest.raises(ValueError):
+        gridindex.similar_pairs(np.zeros((3, 16)), 10, 0)
@@ -23,6 +23,7 @@
 """Unit tests for setops.group_by."""
 
 
+import numpy as np
 import pytest
 
 import imagecmp.setops as setops
@@ -114,3 +115,92 @@ def test_group_by_key():
     for group, expected_group in zip(groups, expected):
         for i, a in enumerate(group):
             assert a is expected_group[i]
+
+
+def reference_group_by(seq, tolerance, no_singles):
+    """Straightforward group_by, scanning the whole sequence per value."""
+    sorted_seq = sorted(seq)
+
+    pairs = []
+    for val in sorted_seq:
+        window = [i for i, x in enumerate(sorted_seq)
+                  if val - tolerance <= x <= val + tolerance]
+        if len(window) > 1 or not no_singles:
+            pairs.append((window[0], window[-1] + 1))
+
+    return [sorted_seq[a:b] for a, b in setops.without_pair_subsets(pairs)]
+
+
+@pytest.mark.parametrize("seq, tolerance", group_by_numeric_data)
+@pytest.mark.parametrize("no_singles", [False, True])
+def test_group_by_reference(seq, tolerance, no_singles):
+    """group_by(seq, t) = reference_group_by(seq, t)"""
+    expected = reference_group_by(seq, tolerance, no_singles)
+
+    groups = setops.group_by(seq, tolerance, no_singles)
+
+    assert sorted(groups) == sorted(expected)
+
+
+@pytest.mark.parametrize("seq, tolerance", group_by_numeric_data)
+@pytest.mark.parametrize("no_singles", [False, True])
+def test_group_by_array(seq, tolerance, no_singles):
+    """group_by_array(seq, t) = reference_group_by(seq, t), as index ranges"""
+    expected = reference_group_by(seq, tolerance, no_singles)
+
+    order, lo, hi = setops.group_by_array(seq, tolerance, no_singles)
+
+    groups = [[seq[i] for i in order[a:b]] for a, b in zip(lo, hi)]
+    assert sorted(groups) == sorted(expected)
+
+
+def test_group_by_array_floats():
+    """group_by_array works on float arrays, e.g. quadrant averages."""
+    values = np.array([0.5, 10.25, 0.0, 10.0, 5.5])
+
+    order, lo, hi = setops.group_by_array(values, 0.5)
+
+    groups = sorted(sorted(values[order[a:b]].tolist()) for a, b in zip(lo, hi))
+    assert groups == [[0.0, 0.5], [5.5], [10.0, 10.25]]
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("no_singles", [False, True])
+def test_group_by_segments_array(seed, no_singles):
+    """group_by_segments_array = group_by_array within each segment"""
+    rng = np.random.RandomState(seed)
+    values = rng.randint(0, 40, size=120) / 3.0
+    segments = rng.randint(0, 6, size=120)
+
+    order, lo, hi = setops.group_by_segments_array(values, segments, 2, no_singles)
+
+    groups = sorted(sorted(order[a:b].tolist()) for a, b in zip(lo, hi))
+
+    expected = []
+    for segment in range(6):
+        positions = np.flatnonzero(segments == segment)
+        seg_order, seg_lo, seg_hi = setops.group_by_array(values[positions], 2, no_singles)
+        expected.extend(sorted(positions[seg_order[a:b]].tolist())
+                        for a, b in zip(seg_lo, seg_hi))
+
+    assert groups == sorted(expected)
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("with_segments", [False, True])
+def test_within_tolerance_array(seed, with_segments):
+    """within_tolerance_array finds every pair within tolerance, once"""
+    rng = np.random.RandomState(seed)
+    values = rng.randint(0, 40, size=120) / 4.0
+    segments = rng.randint(0, 6, size=120) if with_segments else np.zeros(120, int)
+
+    order, hi = setops.within_tolerance_array(values, 2, segments if with_segments else None)
+
+    pairs = [tuple(sorted((order[i], order[j])))
+             for i in range(len(order)) for j in range(i + 1, hi[i])]
+
+    expected = [(a, b) for a in range(120) for b in range(a + 1, 120)
+                if segments[a] == segments[b] and abs(values[a] - values[b]) <= 2]
+
+    assert len(pairs) == len(set(pairs))
+    assert sorted(pairs) == expected
@@ -0,0 +1,151 @@
+
+# ImageCmp - find similar images among many
+# Copyright (C) 2009,2017 Israel G. Lugo
+#
+# This file is part of ImageCmp.
+#
+# ImageCmp is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# ImageCmp is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with ImageCmp. If not, see <http://www.gnu.org/licenses/>.
+#
+# For suggestions, feedback or bug reports: israel.lugo@lugosys.com
+
+
+"""Unit tests for index.SimilarityIndex."""
+
+
+import numpy as np
+
+import imagecmp.compare as compare
+import imagecmp.imagedescr as imagedescr
+import imagecmp.index as index
+
+
+TOLERANCE = 20
+
+
+def make_library(count=60, seed=0):
+    """Return (paths, fingerprints) with a few near-duplicates."""
+    rng = np.random.RandomState(seed)
+
+    # smooth random images, so that quadrant averages vary a lot
+    coarse = rng.randint(0, 256, size=(count, 4, 4))
+    fingerprints = np.repeat(np.repeat(coarse, 4, axis=1), 12, axis=2)
+    fingerprints = fingerprints.reshape(count, -1)
+
+    # every third image is a slightly brighter copy of the previous one
+    for k in range(1, count, 3):
+        fingerprints[k] = np.clip(fingerprints[k-1] + 5, 0, 255)
+
+    paths = ["img%03d" % k for k in range(count)]
+
+    return paths, fingerprints.astype(np.uint8)
+
+
+def brute_force_similar(fingerprints, k):
+    """Rows similar to row k, checking every other row."""
+    mask = np.ones(len(fingerprints), bool)
+    for n in (4, 16):
+        quads = imagedescr.calc_quadrants_batch(fingerprints, n, n)
+        mask &= compare.similar_mask(quads[k], quads, TOLERANCE)
+
+    return set(np.flatnonzero(mask)) - {k}
+
+
+def test_index_query_matches_brute_force():
+    """query(p) = all similar images, found by brute force."""
+    paths, fingerprints = make_library()
+    idx = index.SimilarityIndex(TOLERANCE)
+    idx.add_fingerprints(paths, fingerprints)
+
+    for k, path in enumerate(paths):
+        expected = {paths[i] for i in brute_force_similar(fingerprints, k)}
+        assert idx.query(path) == expected
+
+
+def test_index_add_reports_affected_groups():
+    """add_fingerprints reports only groups with new images."""
+    paths, fingerprints = make_library()
+    idx = index.SimilarityIndex(TOLERANCE)
+    idx.add_fingerprints(paths[:30], fingerprints[:30])
+
+    groups = idx.add_fingerprints(paths[30:], fingerprints[30:])
+
+    assert groups
+    for group in groups:
+        assert group & set(paths[30:])
+
+
+def test_index_remove():
+    """Removed images are no longer found, others still are."""
+    paths, fingerprints = make_library()
+    idx = index.SimilarityIndex(TOLERANCE)
+    idx.add_fingerprints(paths, fingerprints)
+
+    idx.remove(paths[::3])
+
+    assert len(idx) == len(paths) - len(paths[::3])
+    for k, path in enumerate(paths):
+        if k % 3 == 0:
+            assert path not in idx
+        else:
+            expected = {paths[i] for i in brute_force_similar(fingerprints, k)
+                        if i % 3 != 0}
+            assert idx.query(path) == expected
+
+
+def test_index_save_load(tmpdir):
+    """An index survives save() and load()."""
+    paths, fingerprints = make_library()
+    idx = index.SimilarityIndex(TOLERANCE)
+    idx.add_fingerprints(paths, fingerprints)
+
+    filename = str(tmpdir.join("index.npz"))
+    idx.save(filename)
+    loaded = index.SimilarityIndex.load(filename)
+
+    assert loaded.tolerance == TOLERANCE
+    assert loaded.filepaths == idx.filepaths
+    for path in paths:
+        assert loaded.query(path) == idx.query(path)
+
+
+def test_index_remove_compacts(monkeypatch):
+    """Removing most images compacts the index, which keeps working."""
+    monkeypatch.setattr(index, '_MIN_CAPACITY', 1)
+    paths, fingerprints = make_library()
+    idx = index.SimilarityIndex(TOLERANCE)
+    for start in range(0, len(paths), 7):
+        idx.add_fingerprints(paths[start:start+7], fingerprints[start:start+7])
+
+    idx.remove(paths[:45])
+    idx.add_fingerprints(paths[:3], fingerprints[:3])
+
+    assert idx.filepaths == tuple(paths[45:] + paths[:3])
+    kept = list(range(45, len(paths))) + [0, 1, 2]
+    for k in kept:
+        expected = {paths[i] for i in brute_force_similar(fingerprints, k) if i in kept}
+        assert idx.query(paths[k]) == expected
+
+
+def test_index_empty_query():
+    """An empty index finds nothing."""
+    paths, fingerprints = make_library(3)
+    idx = index.SimilarityIndex(TOLERANCE)
+
+    assert idx.query_fingerprint(fingerprints[0]) == frozenset()
+
+    idx.add_fingerprints(paths, fingerprints)
+    idx.remove(paths)
+
+    assert len(idx) == 0
+    assert idx.query_fingerprint(fingerprints[0]) == frozenset()
@@ -0,0 +1,149 @@
+# ImageCmp - find similar images among many
+# Copyright (C) 2009,2017 Israel G. Lugo
+#
+# This file is part of ImageCmp.
+#
+# ImageCmp is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# ImageCmp is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with ImageCmp. If not, see <http://www.gnu.org/licenses/>.
+#
+# For suggestions, feedback or bug reports: israel.lugo@lugosys.com
+
+
+"""Unit tests for the instrument module."""
+
+
+import json
+import time
+
+import numpy as np
+
+import imagecmp.compare as compare
+import imagecmp.executor as executor
+import imagecmp.instrument as instrument
+import imagecmp.matrix as matrix
+
+
+class EventLog(instrument.Listener):
+    def __init__(self):
+        self.events = []
+
+    def start(self, name):
+        self.events.append(('start', name))
+
+    def stop(self, name, seconds):
+        self.events.append(('stop', name))
+
+    def count(self, name, value):
+        self.events.append(('count', name, value))
+
+
+def test_disabled():
+    """Without listeners, nothing is recorded."""
+    assert not instrument.enabled()
+
+    with instrument.timed('x'):
+        instrument.count('y')
+        instrument.histogram('z', [1, 2])
+
+
+def test_listening():
+    """Listeners receive the events of their with block, in order."""
+    log = EventLog()
+
+    with instrument.listening(log):
+        assert instrument.enabled()
+        with instrument.timed('outer'):
+            with instrument.timed('inner'):
+                instrument.count('n', 3)
+
+    instrument.count('n', 1)
+
+    assert log.events == [('start', 'outer'), ('start', 'inner'), ('count', 'n', 3),
+                          ('stop', 'inner'), ('stop', 'outer')]
+    assert not instrument.enabled()
+
+
+def test_recorder_timers():
+    """Self seconds exclude the time of nested timers."""
+    with instrument.listening(instrument.Recorder()) as recorder:
+        for i in range(2):
+            with instrument.timed('outer'):
+                with instrument.timed('inner'):
+                    sum(range(10000))
+
+    timers = recorder.report()['timers']
+
+    assert timers['outer']['calls'] == 2
+    assert timers['inner']['calls'] == 2
+    assert np.isclose(timers['outer']['self_seconds'],
+                      timers['outer']['seconds'] - timers['inner']['seconds'])
+
+
+def _sleep_timed(seconds):
+    with instrument.timed('inner'):
+        time.sleep(seconds)
+
+
+def test_recorder_threads():
+    """Timers nest within the timers of their own thread only."""
+    with instrument.listening(instrument.Recorder()) as recorder:
+        with executor.ThreadExecutor(4, min_batch=1) as pool:
+            with instrument.timed('outer'):
+                pool.map(_sleep_timed, [0.02] * 8, chunksize=1)
+
+    timers = recorder.report()['timers']
+
+    assert timers['inner']['calls'] == 8
+    assert np.isclose(timers['inner']['self_seconds'], timers['inner']['seconds'])
+    assert np.isclose(timers['outer']['self_seconds'], timers['outer']['seconds'])
+
+
+def test_recorder_histogram():
+    """Sizes are counted in power-of-two buckets."""
+    with instrument.listening(instrument.Recorder()) as recorder:
+        instrument.histogram('sizes', [1, 2, 3, 4, 7, 8])
+        instrument.histogram('sizes', np.array([0, 3]))
+
+    assert recorder.report()['histograms'] == {'sizes': {'1': 1, '2': 3, '4': 2, '8': 1}}
+
+
+def test_recorder_profile():
+    """Profiled timers list their functions."""
+    with instrument.listening(instrument.Recorder(profile=['profiled'])) as recorder:
+        with instrument.timed('profiled'):
+            sorted(range(1000), key=lambda x: -x)
+        with instrument.timed('other'):
+            pass
+
+    profiles = recorder.report()['profiles']
+
+    assert list(profiles) == ['profiled']
+    assert any('<lambda>' in entry['function'] for entry in profiles['profiled'])
+
+
+def test_run_cascade_report():
+    """A cascade reports each of its stages and parts, as JSON."""
+    rng = np.random.RandomState(0)
+    fpmatrix = matrix.FingerprintMatrix(rng.randint(0, 256, size=(30, 768)),
+                                        [str(i) for i in range(30)])
+
+    with instrument.listening(instrument.Recorder()) as recorder:
+        groups, stats = compare.run_cascade(fpmatrix, compare.DEFAULT_CASCADE, 255, None)
+
+    report = json.loads(recorder.to_json())
+
+    assert {'stage.0.4x4', 'stage.1.16x16', 'quadrants', 'group_by',
+            'count_quadrant', 'merge_votes', 'without_subsets'} <= set(report['timers'])
+    assert report['counters']['stage.0.4x4.images_in'] == 30
+    assert report['counters']['stage.1.16x16.groups_out'] == len(groups)
+    assert 'group_by.sizes' in report['histograms']
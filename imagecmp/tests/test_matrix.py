@@ -0,0 +1,109 @@
+
+# ImageCmp - find similar images among many
+# Copyright (C) 2009,2017 Israel G. Lugo
+#
+# This file is part of ImageCmp.
+#
+# ImageCmp is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# ImageCmp is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with ImageCmp. If not, see <http://www.gnu.org/licenses/>.
+#
+# For suggestions, feedback or bug reports: israel.lugo@lugosys.com
+
+
+"""Unit tests for matrix.FingerprintMatrix."""
+
+
+import numpy as np
+import pytest
+
+import imagecmp.imagedescr as imagedescr
+import imagecmp.matrix as matrix
+
+
+class FakeDescr(object):
+    """Stand-in for ImageDescr, with a given path and fingerprint."""
+    def __init__(self, filepath, fingerprint):
+        self.filepath = filepath
+        self.fingerprint = fingerprint
+
+
+def test_fingerprint_matrix_rows():
+    """Rows and paths are kept together, and the matrix is read-only."""
+    fingerprints = np.arange(3 * imagedescr.FINGERPRINT_LEN).reshape(3, -1) % 256
+    fpmatrix = matrix.FingerprintMatrix(fingerprints, ["a", "b", "c"])
+
+    assert len(fpmatrix) == 3
+    assert fpmatrix.filepath(1) == "b"
+    assert fpmatrix.fingerprints.dtype == np.uint8
+    assert np.array_equal(fpmatrix.fingerprint(2), fingerprints[2])
+
+    with pytest.raises(ValueError):
+        fpmatrix.fingerprints[0, 0] = 1
+
+
+def test_fingerprint_matrix_from_descriptors():
+    """from_descriptors(d).fingerprint(k) = d[k].fingerprint"""
+    descrs = [FakeDescr(str(k), np.full(imagedescr.FINGERPRINT_LEN, k, np.uint8))
+              for k in range(4)]
+
+    fpmatrix = matrix.FingerprintMatrix.from_descriptors(descrs)
+
+    assert fpmatrix.filepaths == ("0", "1", "2", "3")
+    for k, im in enumerate(descrs):
+        assert np.array_equal(fpmatrix.fingerprint(k), im.fingerprint)
+
+
+@pytest.mark.parametrize("shape, npaths", [
+    ((2, imagedescr.FINGERPRINT_LEN), 3),
+    ((2, imagedescr.FINGERPRINT_LEN - 1), 2),
+])
+def test_fingerprint_matrix_bad_shape(shape, npaths):
+    """Fingerprints must match the path table."""
+    with pytest.raises(ValueError):
+        matrix.FingerprintMatrix(np.zeros(shape, np.uint8), ["x"] * npaths)
+
+
+@pytest.mark.parametrize("n_x, n_y", imagedescr.PYRAMID_LEVELS + ((2, 2),))
+def test_fingerprint_matrix_quadrants(n_x, n_y):
+    """quadrants(rows) = calc_quadrants_batch(fingerprints[rows])"""
+    fingerprints = np.random.RandomState(0).randint(
+            0, 256, size=(6, imagedescr.FINGERPRINT_LEN)).astype(np.uint8)
+    fpmatrix = matrix.FingerprintMatrix(fingerprints, "abcdef")
+    rows = np.array([4, 0, 2])
+
+    assert np.array_equal(fpmatrix.quadrants(rows, n_x, n_y),
+                          imagedescr.calc_quadrants_batch(fingerprints[rows], n_x, n_y))
+
+
+def test_fingerprint_matrix_pyramid_chunks(monkeypatch):
+    """The pyramid is the same when calculated in chunks."""
+    monkeypatch.setattr(matrix, '_PYRAMID_CHUNK_ROWS', 4)
+    fingerprints = np.random.RandomState(1).randint(
+            0, 256, size=(10, imagedescr.FINGERPRINT_LEN)).astype(np.uint8)
+    fpmatrix = matrix.FingerprintMatrix(fingerprints, "abcdefghij")
+
+    assert np.array_equal(fpmatrix.quadrants(np.arange(10), 16, 16),
+                          imagedescr.calc_quadrants_batch(fingerprints, 16, 16))
+
+
+@pytest.mark.parametrize("n_x, n_y", imagedescr.PYRAMID_LEVELS + ((2, 8),))
+def test_fingerprint_matrix_luma(n_x, n_y):
+    """Matrices hold luma fingerprints as well, and know their mode."""
+    fingerprints = np.random.RandomState(2).randint(
+            0, 256, size=(6, imagedescr.fingerprint_len('luma'))).astype(np.uint8)
+    fpmatrix = matrix.FingerprintMatrix(fingerprints, "abcdef")
+    rows = np.array([5, 1])
+
+    assert fpmatrix.mode == 'luma'
+    assert np.array_equal(fpmatrix.quadrants(rows, n_x, n_y),
+                          imagedescr.calc_quadrants_batch(fingerprints[rows], n_x, n_y))
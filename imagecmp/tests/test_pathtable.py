@@ -0,0 +1,80 @@
+# ImageCmp - find similar images among many
+# Copyright (C) 2009,2017 Israel G. Lugo
+#
+# This file is part of ImageCmp.
+#
+# ImageCmp is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# ImageCmp is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with ImageCmp. If not, see <http://www.gnu.org/licenses/>.
+#
+# For suggestions, feedback or bug reports: israel.lugo@lugosys.com
+
+
+"""Unit tests for the pathtable module."""
+
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+from imagecmp.pathtable import PathTable
+
+
+PATHS = [
+    os.path.join('photos', '2017', 'a.jpg'),
+    os.path.join('photos', '2017', 'b.jpg'),
+    'c.jpg',
+    os.sep + os.path.join('abs', 'd.jpg'),
+    os.path.join('photos', '2017', 'café.jpg'),
+    'photos' + os.sep + os.sep + 'e.jpg',
+    os.path.join('photos', 'dir') + os.sep,
+    os.path.join('photos', '2017', 'b.jpg'),
+]
+
+
+def test_round_trip():
+    """Every path comes back exactly as given."""
+    table = PathTable(PATHS)
+
+    assert len(table) == len(PATHS)
+    assert list(table) == PATHS
+    assert table[-1] == PATHS[-1]
+    assert table[np.int64(2)] == PATHS[2]
+    assert table[1:3] == tuple(PATHS[1:3])
+    assert table == tuple(PATHS) and table == PATHS and not table != PATHS
+    assert table != PATHS[:-1]
+
+    with pytest.raises(IndexError):
+        table[len(PATHS)]
+
+
+def test_bytes_paths():
+    """Paths given as bytes come back as bytes."""
+    paths = [b'/x/\xff.jpg', b'y.jpg']
+
+    assert list(PathTable(paths)) == paths
+
+
+def test_empty():
+    """A table can be empty."""
+    assert list(PathTable([])) == []
+
+
+def test_shared_directories():
+    """Each directory is stored once."""
+    paths = [os.path.join('some', 'long', 'directory', '%d.jpg' % k) for k in range(1000)]
+
+    table = PathTable(paths)
+
+    assert table.nbytes < sum(sys.getsizeof(path) for path in paths) / 2
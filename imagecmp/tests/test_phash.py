@@ -0,0 +1,105 @@
+
+# ImageCmp - find similar images among many
+# Copyright (C) 2009,2017 Israel G. Lugo
+#
+# This file is part of ImageCmp.
+#
+# ImageCmp is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# ImageCmp is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with ImageCmp. If not, see <http://www.gnu.org/licenses/>.
+#
+# For suggestions, feedback or bug reports: israel.lugo@lugosys.com
+
+
+"""Unit tests for phash."""
+
+
+import numpy as np
+import pytest
+
+import imagecmp.phash as phash
+
+
+def random_hashes(count, seed):
+    """Random hashes, with some near-duplicates of the first ones."""
+    rng = np.random.RandomState(seed)
+    hashes = rng.randint(0, 2**62, size=count, dtype=np.int64).astype(np.uint64)
+
+    # flip a few random bits of the first tenth into the second tenth
+    for k in range(count // 10):
+        flips = rng.choice(64, rng.randint(0, 9), replace=False)
+        hashes[count // 10 + k] = hashes[k] ^ np.uint64(sum(1 << int(f) for f in flips))
+
+    return hashes
+
+
+def test_popcount():
+    """popcount(x) = number of set bits in x"""
+    values = np.array([0, 1, 3, 2**63, 2**64 - 1], np.uint64)
+
+    assert phash.popcount(values).tolist() == [0, 1, 2, 1, 64]
+
+
+def test_average_hash_brightness():
+    """A uniform brightness shift doesn't change the average hash."""
+    rng = np.random.RandomState(0)
+    fingerprints = rng.randint(0, 200, size=(5, 768))
+
+    assert np.array_equal(phash.average_hash(fingerprints),
+                          phash.average_hash(fingerprints + 40))
+
+
+@pytest.mark.parametrize("seed", range(3))
+@pytest.mark.parametrize("max_distance", [0, 3, 6])
+def test_hash_index_pairs(seed, max_distance):
+    """HashIndex.pairs() = every pair within max_distance"""
+    hashes = random_hashes(300, seed)
+    n = len(hashes)
+
+    a, b = np.triu_indices(n, 1)
+    distances = phash.hamming(hashes[a], hashes[b])
+    close = distances <= max_distance
+
+    pair_ids, result_distances = phash.HashIndex(hashes, max_distance).pairs()
+
+    assert pair_ids.tolist() == (a[close] * n + b[close]).tolist()
+    assert result_distances.tolist() == distances[close].tolist()
+
+
+def test_hash_index_pairs_dense(monkeypatch):
+    """Dense buckets are paired in chunks, with the same result."""
+    monkeypatch.setattr(phash, 'CHUNK_PAIRS', 7)
+    hashes = np.concatenate((np.repeat(random_hashes(3, 0), 20), random_hashes(40, 1)))
+    n = len(hashes)
+
+    a, b = np.triu_indices(n, 1)
+    close = phash.hamming(hashes[a], hashes[b]) <= 3
+
+    pair_ids, _ = phash.HashIndex(hashes, 3).pairs()
+
+    assert pair_ids.tolist() == (a[close] * n + b[close]).tolist()
+
+
+def test_hash_index_query():
+    """HashIndex.query(h) = every hash within max_distance of h"""
+    hashes = random_hashes(300, 0)
+    index = phash.HashIndex(hashes, 4)
+
+    for value in hashes[:40]:
+        expected = np.flatnonzero(phash.hamming(hashes, value) <= 4)
+        assert index.query(value).tolist() == expected.tolist()
+
+
+def test_hash_index_bad_distance():
+    """max_distance must leave at least one bit per substring."""
+    with pytest.raises(ValueError):
+        phash.HashIndex(np.zeros(3, np.uint64), 64)
@@ -0,0 +1,148 @@
+
+# ImageCmp - find similar images among many
+# Copyright (C) 2009,2017 Israel G. Lugo
+#
+# This file is part of ImageCmp.
+#
+# ImageCmp is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# ImageCmp is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with ImageCmp. If not, see <http://www.gnu.org/licenses/>.
+#
+# For suggestions, feedback or bug reports: israel.lugo@lugosys.com
+
+
+"""Unit tests for the quadrant calculations in imagedescr."""
+
+
+import numpy as np
+import pytest
+
+import imagecmp.imagedescr as imagedescr
+
+
+FINGERPRINT_LEN = imagedescr.FINGERPRINT_SIZE[0] * imagedescr.FINGERPRINT_SIZE[1] * 3
+
+
+class FakeDescr(object):
+    """Stand-in for ImageDescr, with a given fingerprint."""
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+
+
+def random_fingerprints(count, seed=0):
+    """Return a (count, FINGERPRINT_LEN) array of random fingerprints."""
+    rng = np.random.RandomState(seed)
+    return rng.randint(0, 256, size=(count, FINGERPRINT_LEN)).astype(np.uint8)
+
+
+@pytest.mark.parametrize("n_x, n_y", [(1, 1), (4, 4), (8, 8), (16, 16), (2, 48)])
+def test_calc_quadrants_batch_matches_single(n_x, n_y):
+    """calc_quadrants_batch(f)[k] = calc_quadrants(f[k])"""
+    fingerprints = random_fingerprints(7)
+
+    result = imagedescr.calc_quadrants_batch(fingerprints, n_x, n_y)
+
+    assert result.shape == (7, n_x * n_y)
+    for k, fingerprint in enumerate(fingerprints):
+        expected = imagedescr.calc_quadrants(FakeDescr(fingerprint), n_x, n_y)
+        assert np.allclose(result[k], expected.quadrants)
+
+
+def test_quadrant_averages_compact():
+    """QuadrantAverages keeps integer sums, and gives the exact averages."""
+    fingerprint = random_fingerprints(1)[0]
+    rect = fingerprint.reshape(imagedescr.FINGERPRINT_SIZE[0], -1)
+
+    quads = imagedescr.calc_quadrants(FakeDescr(fingerprint), 16, 16)
+
+    assert quads.sums.dtype == np.uint16
+    assert quads.quadrants[0] == rect[0:1, 0:3].mean()
+    assert quads.quadrants[-1] == rect[15:16, 45:48].mean()
+    assert quads == imagedescr.calc_quadrants(quads.imdesc, 16, 16)
+    assert quads != imagedescr.calc_quadrants(FakeDescr(255 - fingerprint), 16, 16)
+
+
+def test_quadrant_averages_constructor():
+    """QuadrantAverages can be created with the averages themselves."""
+    imdesc = FakeDescr(random_fingerprints(1)[0])
+    from_sums = imagedescr.QuadrantAverages.from_sums(imdesc, [3, 4], 2)
+
+    quads = imagedescr.QuadrantAverages(imdesc, (1.5, 2.0))
+
+    assert quads.quadrants == (1.5, 2.0)
+    assert quads == from_sums
+    assert hash(quads) == hash(from_sums)
+    assert quads != imagedescr.QuadrantAverages(imdesc, (1.5, 2.5))
+
+
+def test_calc_quadrants_batch_2d_rectangles():
+    """Accepts (N, x, y) stacks as well as flat fingerprints."""
+    fingerprints = random_fingerprints(3)
+    rects = fingerprints.reshape(3, imagedescr.FINGERPRINT_SIZE[0], -1)
+
+    assert np.array_equal(imagedescr.calc_quadrants_batch(rects, 4, 4),
+                          imagedescr.calc_quadrants_batch(fingerprints, 4, 4))
+
+
+def test_calc_quadrants_batch_empty():
+    """An empty stack gives an empty result."""
+    fingerprints = np.zeros((0, FINGERPRINT_LEN), np.uint8)
+
+    assert imagedescr.calc_quadrants_batch(fingerprints, 4, 4).shape == (0, 16)
+
+
+@pytest.mark.parametrize("n_x, n_y", [(3, 4), (4, 5)])
+def test_calc_quadrants_batch_uneven(n_x, n_y):
+    """Quadrants must evenly divide the fingerprint."""
+    with pytest.raises(ValueError):
+        imagedescr.calc_quadrants_batch(random_fingerprints(1), n_x, n_y)
+
+
+def test_calc_integral_batch():
+    """Each summed-area table element is the sum of a rectangle."""
+    fingerprints = random_fingerprints(2)
+    rects = fingerprints.reshape(2, imagedescr.FINGERPRINT_SIZE[0], -1).astype(int)
+
+    integral = imagedescr.calc_integral_batch(fingerprints)
+
+    assert integral.shape == (2,) + tuple(np.add(rects.shape[1:], 1))
+    for i, j in [(0, 0), (0, 5), (3, 0), (7, 20), (16, 48)]:
+        assert (integral[:, i, j] == rects[:, :i, :j].sum(axis=(1, 2))).all()
+
+
+@pytest.mark.parametrize("n_x, n_y", [(1, 1), (4, 4), (8, 8), (16, 16), (2, 16)])
+def test_calc_pyramid_batch(n_x, n_y):
+    """Pyramid sums give exactly the averages of calc_quadrants_batch."""
+    fingerprints = random_fingerprints(5)
+    fingerprints[0] = 255
+
+    pyramid = imagedescr.calc_pyramid_batch(fingerprints, [(n_x, n_y)])
+
+    assert np.array_equal(imagedescr.quadrants_from_sums(pyramid[n_x, n_y], n_x, n_y),
+                          imagedescr.calc_quadrants_batch(fingerprints, n_x, n_y))
+
+
+@pytest.mark.parametrize("n_x, n_y", [(4, 4), (16, 16), (2, 8)])
+def test_quadrants_luma(n_x, n_y):
+    """Luma fingerprints have a quadrant per block of pixels."""
+    rng = np.random.RandomState(0)
+    fingerprints = rng.randint(0, 256, size=(5, FINGERPRINT_LEN // 3)).astype(np.uint8)
+    rects = fingerprints.reshape(5, n_x, 16 // n_x, n_y, 16 // n_y).astype(float)
+
+    result = imagedescr.calc_quadrants_batch(fingerprints, n_x, n_y)
+    pyramid = imagedescr.calc_pyramid_batch(fingerprints, [(n_x, n_y)])
+
+    assert np.allclose(result, rects.mean(axis=(2, 4)).reshape(5, -1))
+    assert np.allclose(imagedescr.calc_quadrants(FakeDescr(fingerprints[1]), n_x, n_y).quadrants,
+                       result[1])
+    assert np.array_equal(imagedescr.quadrants_from_sums(pyramid[n_x, n_y], n_x, n_y, 1),
+                          result)
@@ -0,0 +1,137 @@
+# ImageCmp - find similar images among many
+# Copyright (C) 2009,2017 Israel G. Lugo
+#
+# This file is part of ImageCmp.
+#
+# ImageCmp is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# ImageCmp is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with ImageCmp. If not, see <http://www.gnu.org/licenses/>.
+#
+# For suggestions, feedback or bug reports: israel.lugo@lugosys.com
+
+
+"""Unit tests for the scan module."""
+
+
+import os
+
+import pytest
+
+import imagecmp.scan as scan
+
+
+PNG_DATA = b'\x89PNG\r\n\x1a\n' + b'\x00' * 16
+
+
+def make_tree(top):
+    """Create a small tree of files, and return the set of their paths."""
+    paths = set()
+    for dirpath in ['', 'a', os.path.join('a', 'b'), 'c']:
+        full_dir = os.path.join(top, dirpath)
+        if not os.path.isdir(full_dir):
+            os.makedirs(full_dir)
+        for name in ['x.png', 'y.txt']:
+            path = os.path.join(full_dir, name)
+            with open(path, 'wb') as f:
+                f.write(PNG_DATA if name.endswith('.png') else b'text')
+            paths.add(path)
+
+    return paths
+
+
+@pytest.mark.parametrize("threads", [1, 4])
+def test_scan_files(tmpdir, threads):
+    """Every file is found, once."""
+    top = str(tmpdir)
+    expected = make_tree(top)
+
+    found = list(scan.scan_files([top], threads=threads))
+
+    assert len(found) == len(expected)
+    assert set(found) == expected
+
+
+def test_scan_filters(tmpdir):
+    """Files can be filtered by extension and by content."""
+    top = str(tmpdir)
+    expected = make_tree(top)
+    os.rename(os.path.join(top, 'c', 'x.png'), os.path.join(top, 'c', 'x.dat'))
+    with open(os.path.join(top, 'fake.png'), 'wb') as f:
+        f.write(b'not an image')
+
+    by_extension = set(scan.scan_files([top], extensions=scan.IMAGE_EXTENSIONS))
+    by_magic = set(scan.scan_files([top], check_magic=True))
+
+    images = {path for path in expected if path.endswith('.png')}
+    moved = os.path.join(top, 'c', 'x.png')
+
+    assert by_extension == images - {moved} | {os.path.join(top, 'fake.png')}
+    assert by_magic == images - {moved} | {os.path.join(top, 'c', 'x.dat')}
+
+
+@pytest.fixture(params=['scandir', 'listdir'])
+def listing(request, monkeypatch):
+    """List directories with scandir, and with the os.listdir fallback."""
+    if request.param == 'listdir':
+        monkeypatch.setattr(scan, 'scandir', scan._listdir_scandir)
+    return request.param
+
+
+@pytest.mark.skipif(not hasattr(os, 'symlink'), reason="needs symlinks")
+def test_scan_symlink_loop(tmpdir, listing):
+    """Symlinks to parent directories don't loop forever."""
+    top = str(tmpdir)
+    expected = make_tree(top)
+    os.symlink(top, os.path.join(top, 'a', 'b', 'loop'))
+    os.symlink(os.path.join(top, 'a', 'x.png'), os.path.join(top, 'link.png'))
+
+    followed = list(scan.scan_files([top], follow_dirs=True))
+    not_followed = list(scan.scan_files([top], follow_files=False))
+
+    assert sorted(followed) == sorted(expected | {os.path.join(top, 'link.png')})
+    assert sorted(not_followed) == sorted(expected)
+
+
+@pytest.mark.skipif(not hasattr(os, 'symlink'), reason="needs symlinks")
+def test_scan_broken_symlink(tmpdir, listing):
+    """Broken symlinks are neither files nor directories."""
+    top = str(tmpdir)
+    expected = make_tree(top)
+    os.symlink(os.path.join(top, 'missing'), os.path.join(top, 'broken.png'))
+
+    assert sorted(scan.scan_files([top], follow_dirs=True)) == sorted(expected)
+
+
+def test_scan_errors(tmpdir, listing):
+    """Listing errors go to the error handler."""
+    missing = os.path.join(str(tmpdir), 'missing')
+    errors = []
+
+    assert list(scan.scan_files([missing], on_error=errors.append)) == []
+    assert len(errors) == 1 and errors[0].filename == missing
+
+    assert list(scan.scan_files([missing], on_error='ignore')) == []
+    with pytest.raises(OSError):
+        list(scan.scan_files([missing], on_error='abort'))
+
+
+def test_scan_early_stop(tmpdir):
+    """Iteration can stop early, without leaving threads behind."""
+    top = str(tmpdir)
+    for i in range(50):
+        os.makedirs(os.path.join(top, str(i)))
+        with open(os.path.join(top, str(i), 'x.png'), 'wb') as f:
+            f.write(PNG_DATA)
+
+    paths = scan.scan_files([top], threads=2)
+    next(paths)
+    paths.close()
@@ -27,6 +27,8 @@ setops.group_by is tested in a separate unit.
 """
 
 
+import random
+
 import pytest
 
 import imagecmp.setops as setops
@@ -125,6 +127,18 @@ def test_without_subsets(seq, expected):
     assert result == expected
 
 
+@pytest.mark.parametrize("seed", range(10))
+def test_without_subsets_random(seed):
+    """without_subsets(seq) = quadratic reference, on random sets"""
+    rng = random.Random(seed)
+    seq = [frozenset(rng.sample(range(20), rng.randint(0, 6)))
+           for i in range(200)]
+
+    expected = {x for x in seq if not any(x < y for y in seq)}
+
+    assert setops.without_subsets(seq) == expected
+
+
 @pytest.mark.parametrize("pairs, expected", without_pair_subsets_data)
 def test_without_pair_subsets(pairs, expected):
     """without_pair_subsets(pairs) = expected"""
@@ -133,3 +147,67 @@ def test_without_pair_subsets(pairs, expected):
     # without_pair_subsets makes no promises about the order of its output
     assert sorted(result) == sorted(expected)
 
+
+
+@pytest.mark.parametrize("pairs, expected", without_pair_subsets_data)
+def test_without_pair_subsets_array(pairs, expected):
+    """without_pair_subsets_array(lo, hi) = expected"""
+    lo = [a for a, b in pairs]
+    hi = [b for a, b in pairs]
+
+    result_lo, result_hi = setops.without_pair_subsets_array(lo, hi)
+
+    assert sorted(zip(result_lo.tolist(), result_hi.tolist())) == sorted(expected)
+
+
+@pytest.mark.parametrize("sizes, limit, expected", [
+    ([], 5, []),
+    ([2, 2, 2, 2], 4, [(0, 2), (2, 4)]),
+    ([1, 9, 1, 1], 4, [(0, 1), (1, 2), (2, 4)]),
+    ([3, 0, 0, 3], 3, [(0, 3), (3, 4)]),
+])
+def test_chunks_by_total(sizes, limit, expected):
+    """chunks_by_total splits sizes into slices adding up to about limit."""
+    chunks = setops.chunks_by_total(sizes, limit)
+
+    assert [(c.start, c.stop) for c in chunks] == expected
+
+
+def test_connected_components():
+    """Nodes are labeled with the smallest node of their component."""
+    # a chain hooked from its far end, an isolated node, and a pair
+    a = [5, 4, 3, 7]
+    b = [4, 3, 1, 8]
+
+    result = setops.connected_components(9, a, b)
+
+    assert result.tolist() == [0, 1, 2, 1, 1, 1, 6, 7, 7]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_connected_components_random(seed):
+    """connected_components(n, a, b) = components found by graph search"""
+    rng = random.Random(seed)
+    n = 100
+    edges = [(rng.randrange(n), rng.randrange(n)) for i in range(60)]
+
+    neighbours = {i: set() for i in range(n)}
+    for x, y in edges:
+        neighbours[x].add(y)
+        neighbours[y].add(x)
+
+    expected = list(range(n))
+    for start in range(n):
+        if expected[start] != start:
+            continue
+        stack = [start]
+        while stack:
+            for j in neighbours[stack.pop()]:
+                if expected[j] != start:
+                    expected[j] = start
+                    stack.append(j)
+
+    result = setops.connected_components(n, [x for x, y in edges],
+                                         [y for x, y in edges])
+
+    assert result.tolist() == expected
@@ -0,0 +1,69 @@
+
+# ImageCmp - find similar images among many
+# Copyright (C) 2009,2017 Israel G. Lugo
+#
+# This file is part of ImageCmp.
+#
+# ImageCmp is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# ImageCmp is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with ImageCmp. If not, see <http://www.gnu.org/licenses/>.
+#
+# For suggestions, feedback or bug reports: israel.lugo@lugosys.com
+
+
+"""Unit tests for sharedarray.SharedArray."""
+
+
+import os
+import pickle
+
+import numpy as np
+
+import imagecmp.sharedarray as sharedarray
+
+
+def test_shared_array_pickle_shares_data():
+    """A pickled copy maps the same data, in both directions."""
+    with sharedarray.SharedArray.copy_of(np.arange(12).reshape(3, 4)) as shared:
+        copy = pickle.loads(pickle.dumps(shared))
+
+        assert np.array_equal(copy.array, shared.array)
+
+        copy.array[1, 2] = -1
+        assert shared.array[1, 2] == -1
+
+        copy.close()
+
+
+def test_shared_array_pickle_is_small():
+    """Pickling doesn't send the data."""
+    with sharedarray.SharedArray((1000, 768), np.uint8) as shared:
+        assert len(pickle.dumps(shared)) < 1000
+
+
+def test_shared_array_close_removes_file():
+    """Only the owner removes the backing file."""
+    shared = sharedarray.SharedArray((2, 2), np.float64)
+    filename = shared.__getstate__()[0]
+
+    pickle.loads(pickle.dumps(shared)).close()
+    assert os.path.exists(filename)
+
+    shared.close()
+    assert not os.path.exists(filename)
+
+
+def test_shared_array_empty():
+    """Empty arrays are supported."""
+    with sharedarray.SharedArray((0, 16), np.float64) as shared:
+        copy = pickle.loads(pickle.dumps(shared))
+        assert copy.array.shape == (0, 16)